@@ -4,4 +4,19 @@
 
 # this seems to make unit test happy, though
 
-from .autoperm import *
+# The names from autoperm.autoperm are exposed here, but only looked up the
+# first time someone asks for one (PEP 562), so that importing some other
+# submodule (eg autoperm.perm) doesn't pay for the whole CLI.
+
+import importlib
+
+
+def __getattr__(name):
+    """
+    Look up public names in autoperm.autoperm lazily
+    """
+    module = importlib.import_module(".autoperm", __name__)
+    if name.startswith("_") or not hasattr(module, name):
+        raise AttributeError("module {!r} has no attribute {!r}"
+                .format(__name__, name))
+    return getattr(module, name)
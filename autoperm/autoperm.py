@@ -14,14 +14,26 @@ Implementation of the autoperm cipher described in autoperm.tex.
 Implementation and specification by the mighty Alastair Horn.
 """
 
+import os
+import sys
+import time
 import string
 import collections
 
 import argparse
 
 from perm import Perm
-from cipher_streamer import CipherStreamer, chunk, BLOCK_DEFAULT, WIDTH_DEFAULT
-from util import strip_punc, permutation_from_key
+from cipher_streamer import CipherStreamer, BLOCK_DEFAULT, WIDTH_DEFAULT
+from autoperm_engine import AutopermEngine, ByteAutopermEngine
+from util import (
+        BINARY_CHUNK_SIZE, CONTAINER_CHUNK_SIZE_MAX, INTERVAL_DEFAULT,
+        file_chunks, strip_punc, permutation_from_key,
+        byte_permutation_from_key)
+
+# The modules for the other modes (checkpoint indexes, state files, containers
+# and anything with a process pool) are only imported by the functions that
+# use them, so that plain encryption and decryption start up quickly.
+# pylint: disable=import-outside-toplevel
 
 
 @CipherStreamer
@@ -29,14 +41,7 @@ def autoperm_encipher(plaintext, sigma, tau):
     """
     Encrypt
     """
-    for a, b in chunk(plaintext, 2):
-        if b is None:
-            yield sigma[a]
-        else:
-            yield from (sigma[a], tau[b])
-            transposition = Perm.from_cycle([a, b])
-            sigma *= transposition
-            tau *= transposition
+    return AutopermEngine(sigma, tau).encipher(plaintext)
 
 
 @CipherStreamer
@@ -44,23 +49,210 @@ def autoperm_decipher(ciphertext, sigma, tau):
     """
     Decrypt
     """
-    sigma_inverse = sigma.inverse()
-    tau_inverse = tau.inverse()
-    for a, b in chunk(ciphertext, 2):
-        if b is None:
-            yield sigma_inverse[a]
-        else:
-            a_plain = sigma_inverse[a]
-            b_plain = tau_inverse[b]
-            yield from (a_plain, b_plain)
-            transposition = Perm.from_cycle([a_plain, b_plain])
-            sigma_inverse = transposition * sigma_inverse
-            tau_inverse = transposition * tau_inverse
+    return AutopermEngine(sigma, tau).decipher(ciphertext)
 
 
-def get_args():
+class AutopermCipher:
     """
-    Parse argv
+    Encrypt or decrypt text that turns up a piece at a time (like fragments of
+    a message coming in over a network), without needing file objects or
+    generators: just pass each piece to update, and get back its output as a
+    string. Punctuation is stripped, as with CipherStreamer.strip.
+
+    Pieces can have an odd number of letters. The odd letter at the end gets
+    output straight away (it's just enciphered with sigma), and carried over
+    to pair up with the first letter of the next piece, so the output of all
+    the updates put together is always the same as doing the whole text at
+    once.
+    """
+    def __init__(self, sigma, tau, decrypt=False):
+        """
+        Start a cipher with sigma and tau as Perm objects
+        """
+        from cipher_state import CipherState
+        self.state = CipherState.from_keys(sigma, tau)
+        self.decrypt = decrypt
+        self.finished = False
+
+    def update(self, chunk):
+        """
+        Encrypt or decrypt the next piece of text, returning the output
+        """
+        if self.finished:
+            raise ValueError("can't update a cipher after finalize")
+        return "".join(self.state.run(strip_punc(chunk), self.decrypt))
+
+    def finalize(self):
+        """
+        Say that there's no more text, returning any output that's left.
+
+        There never is any left at the moment, as update doesn't hold anything
+        back, but call this anyway in case it does one day (and so that
+        calling update by mistake afterwards raises an error).
+        """
+        if self.finished:
+            raise ValueError("cipher has already been finalized")
+        self.finished = True
+        return ""
+
+
+def perm_to_key(perm):
+    """
+    Write a permutation of A-Z as a 26 letter key, which permutation_from_key
+    turns straight back into the same permutation (so it can be given to -k).
+    """
+    return "".join(perm[c] for c in string.ascii_uppercase)
+
+
+def run_cipher(in_file, out_file, sigma, tau, decrypt=False, **kwargs):
+    """
+    Encrypt or decrypt in_file to out_file, either preserving punctuation
+    (`preserve=True`) or stripping it (in which case kwargs go to
+    CipherStreamer.strip).
+    """
+    process_func = autoperm_decipher if decrypt else autoperm_encipher
+    run_streamer(process_func, in_file, out_file, (sigma, tau), kwargs)
+
+
+def run_streamer(process_func, in_file, out_file, args, options, **kwargs):
+    """
+    Run a CipherStreamer from in_file to out_file, with positional arguments
+    `args` and keyword arguments `kwargs`. `options` are as returned by
+    cipher_options (`decrypt` is ignored, as that's down to process_func).
+    """
+    options = dict(options)
+    options.pop("decrypt", None)
+    if options.pop("preserve", False):
+        process_func.preserve(in_file, out_file, *args, **kwargs)
+    else:
+        process_func.strip(in_file, out_file, *args, **options, **kwargs)
+
+
+def run_binary(in_file, out_file, sigma, tau, decrypt=False):
+    """
+    Encrypt or decrypt binary file in_file to binary file out_file with
+    ByteAutopermEngine, where sigma and tau are Perm objects on range(256).
+    """
+    engine = ByteAutopermEngine(sigma, tau)
+    process = engine.decipher if decrypt else engine.encipher
+    for block in file_chunks(in_file, BINARY_CHUNK_SIZE):
+        out_file.write(process(block))
+
+
+def batch_inputs(source):
+    """
+    Find the input files for batch mode. `source` is either a directory, in
+    which case every file under it is used, or a manifest listing one file per
+    line, relative to the manifest's directory.
+
+    Returns a list of pairs (path, name), where name is the path relative to
+    the directory (or as written in the manifest), which is used to name the
+    output and in key manifests.
+    """
+    if os.path.isdir(source):
+        inputs = []
+        for directory, subdirectories, files in os.walk(source):
+            subdirectories.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                inputs.append((path, os.path.relpath(path, source)))
+        return inputs
+    base = os.path.dirname(source)
+    with open(source, encoding="utf-8") as manifest:
+        names = [line.strip() for line in manifest if line.strip()]
+    for name in names:
+        if os.path.isabs(name) or os.pardir in name.split(os.sep):
+            raise ValueError("manifest entries should be relative paths below "
+                             "the manifest's directory, not {!r}".format(name))
+    return [(os.path.join(base, name), name) for name in names]
+
+
+def write_key_manifest(keys, manifest):
+    """
+    Write a key manifest: a line for each file giving its name, sigma and tau
+    as 26 letter keys, separated by tabs. `keys` maps names to (sigma, tau).
+    """
+    for name, (sigma, tau) in keys.items():
+        manifest.write("{}\t{}\t{}\n".format(name, perm_to_key(sigma),
+                                             perm_to_key(tau)))
+
+
+def read_key_manifest(manifest):
+    """
+    Read a key manifest written by write_key_manifest
+    """
+    keys = {}
+    for line in manifest:
+        if line.strip():
+            name, sigma, tau = line.rstrip("\n").split("\t")
+            keys[name] = permutation_from_key(sigma), permutation_from_key(tau)
+    return keys
+
+
+def process_file(job):
+    """
+    Encrypt or decrypt one file in batch mode. This is what the worker
+    processes run.
+
+    `job` is a tuple (name, in_path, out_path, sigma, tau, options), where
+    options are keyword arguments for run_cipher. Returns (name, size in
+    bytes, time taken in seconds).
+    """
+    name, in_path, out_path, sigma, tau, options = job
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(out_path) or os.curdir, exist_ok=True)
+    with open(in_path, encoding="utf-8") as in_file, \
+            open(out_path, "w", encoding="utf-8") as out_file:
+        run_cipher(in_file, out_file, sigma, tau, **options)
+    return name, os.path.getsize(in_path), time.perf_counter() - start
+
+
+def run_batch(inputs, out_dir, keys, options, processes=None, report=None):
+    """
+    Encrypt or decrypt a list of files from batch_inputs across a process pool,
+    writing each one to the same relative path under out_dir.
+
+    `keys` maps each name to its (sigma, tau), and `options` are keyword
+    arguments for run_cipher. Each process imports everything once and then
+    works through many files, which is much cheaper than starting the CLI once
+    per file when there are lots of small ones.
+
+    The throughput for each file and overall is written to `report`
+    (default stdout).
+    """
+    import concurrent.futures
+    if report is None:
+        report = sys.stdout
+    jobs = [(name, path, os.path.join(out_dir, name), *keys[name], options)
+            for path, name in inputs]
+    start = time.perf_counter()
+    total_size = 0
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        # hand out files in batches, so that tiny files aren't dominated by
+        # the cost of talking to the workers
+        chunksize = max(1, len(jobs) // (4 * (processes or os.cpu_count())))
+        for name, size, seconds in executor.map(process_file, jobs,
+                                                chunksize=chunksize):
+            total_size += size
+            report.write("{}: {} bytes in {:.3f}s ({})\n".format(
+                    name, size, seconds, format_rate(size, seconds)))
+    seconds = time.perf_counter() - start
+    report.write("total: {} files, {} bytes in {:.3f}s ({})\n".format(
+            len(jobs), total_size, seconds, format_rate(total_size, seconds)))
+
+
+def format_rate(size, seconds):
+    """
+    Format a throughput in megabytes per second
+    """
+    if seconds <= 0:
+        return "- MB/s"
+    return "{:.2f} MB/s".format(size / seconds / 10 ** 6)
+
+
+def get_parser():
+    """
+    Make the argument parser
     """
     parser = argparse.ArgumentParser(
             description=__doc__,
@@ -71,13 +263,18 @@ def get_args():
     parser.add_argument(
             "out_file", type=argparse.FileType("w"), default="-", nargs="?",
             help="Output file (plaintext or ciphertext)")
-    key = parser.add_mutually_exclusive_group(required=True)
+    # not required=True, as decrypting with an index doesn't need keys
+    key = parser.add_mutually_exclusive_group()
     key.add_argument(
         "-r", "--random", action="store_true",
         help="Generate random keys (hard to remember)")
     key.add_argument(
         "-k", "--keys", nargs=2, metavar=("SIGMA", "TAU"),
         help="Give two keywords to convert into permutations sigma, tau")
+    key.add_argument(
+        "-K", "--keys-from", type=argparse.FileType("r"), metavar="MANIFEST",
+        help="""In batch mode, use each file's keys from a key manifest written
+                by --key-manifest""")
     action = parser.add_mutually_exclusive_group(required=True)
     action.add_argument(
             "-e", "--encrypt", action="store_true",
@@ -89,6 +286,11 @@ def get_args():
             "-v", "--verbose", action="store_true",
             help="""Print more information - careful you don't use `-` as
                     out_file and pipe to anything.""")
+    parser.add_argument(
+            "-B", "--binary", action="store_true",
+            help="""Treat in_file and out_file as binary, and encrypt every
+                    byte, using all 256 byte values as the alphabet. Keys from
+                    -k are taken as UTF-8.""")
     parser.add_argument(
             "-p", "--preserve", action="store_true",
             help="Preserve punctuation and case in output")
@@ -106,10 +308,249 @@ def get_args():
             "-w", "--width", type=int,
             help="""Length of lines to format output into - internal default
                     {}""".format(WIDTH_DEFAULT))
+    parser.add_argument(
+            "-j", "--jobs", type=int,
+            help="""Number of processes to use - default is one per CPU. When
+                    encrypting, this splits in_file up into segments to
+                    encrypt in parallel (or see --batch and --index).""")
+    batch = parser.add_argument_group(
+            "batch mode",
+            """Encrypt or decrypt lots of files at once across a pool of
+               processes, reporting throughput as it goes. in_file and out_file
+               shouldn't be given.""")
+    batch.add_argument(
+            "--batch", metavar="SOURCE",
+            help="""Directory of input files (searched recursively), or a
+                    manifest listing input files one per line""")
+    batch.add_argument(
+            "-o", "--out-dir",
+            help="Directory to write output files to, with the same names")
+    batch.add_argument(
+            "--key-manifest", type=argparse.FileType("w"), metavar="MANIFEST",
+            help="""With -r, generate different random keys for each file, and
+                    write them here""")
+    index = parser.add_argument_group(
+            "checkpoint index",
+            """When encrypting, write an index of checkpoints of the state of
+               the cipher. When decrypting, use one to start from the middle
+               of in_file (which has to be a real file), or to decrypt pieces
+               of it in parallel with -j. No keys are needed to decrypt with
+               an index, which means the index has to be kept as secret as the
+               keys!""")
+    index.add_argument(
+            "--index", metavar="INDEX",
+            help="Index file to write (when encrypting) or read (decrypting)")
+    index.add_argument(
+            "--checkpoint-interval", type=int, default=INTERVAL_DEFAULT,
+            metavar="PAIRS",
+            help="Number of pairs of letters between checkpoints")
+    index.add_argument(
+            "--range", metavar="START:STOP",
+            help="""Only decrypt letters START to STOP (counting from 0, not
+                    including STOP). Either can be left out. This can also be
+                    used with --container, where it counts bytes.""")
+    resume = parser.add_argument_group(
+            "resuming",
+            """Save the state of the cipher at the end, and carry on from it
+               next time, so you can encrypt text that's been added to
+               something you already encrypted (like a log file) without
+               starting again. Just give the new text as in_file, and append
+               the output to the old output. Use a separate state file for
+               decrypting. The state file is as secret as the keys!""")
+    resume.add_argument(
+            "--state", metavar="STATE",
+            help="""State file to carry on from and then update. If it doesn't
+                    exist yet, start from the keys and create it. If it does,
+                    any keys given are ignored.""")
+    container = parser.add_argument_group(
+            "container mode",
+            """With -B, encrypt into (or decrypt from) a container, which
+               splits the data into chunks that are each encrypted with keys
+               of their own, so that they can be done in parallel (see -j),
+               and any part can be decrypted without the rest (see
+               --range). When encrypting, out_file has to be seekable.""")
+    container.add_argument(
+            "--container", action="store_true",
+            help="Use a container")
+    container.add_argument(
+            "--chunk-size", type=int, default=BINARY_CHUNK_SIZE,
+            metavar="BYTES", help="Size of the chunks in a new container")
+    return parser
+
+
+def get_args():
+    """
+    Parse argv
+    """
+    parser = get_parser()
     # have to do a bit of manual checking here - I don't think there's a way to
     # express this kind of dependency in pure ArgumentParser. cf:
     # https://stackoverflow.com/questions/27411268/arguments-that-are-dependent-on-other-arguments-with-argparse
     args = parser.parse_args()
+    if not (args.random or args.keys or args.keys_from
+            or (args.decrypt and args.index)
+            or (args.state is not None and os.path.exists(args.state))):
+        parser.error("one of the arguments -r/--random -k/--keys "
+                     "-K/--keys-from is required")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("-j/--jobs should be at least 1")
+    if args.checkpoint_interval < 1:
+        parser.error("--checkpoint-interval should be at least 1")
+    if args.batch is None:
+        reject_args(parser, args, "{} can only be used with --batch",
+                    ("-o/--out-dir", "out_dir"),
+                    ("--key-manifest", "key_manifest"),
+                    ("-K/--keys-from", "keys_from"))
+    # each mode checks that nothing from the modes after it is given, so
+    # there's no need to check both ways round
+    if args.batch is not None:
+        check_batch_args(parser, args)
+    elif args.index is not None:
+        check_index_args(parser, args)
+    elif args.state is not None:
+        check_state_args(parser, args)
+    elif args.binary:
+        check_binary_args(parser, args)
+    else:
+        check_text_args(parser, args)
+    check_format_args(parser, args)
+    return args
+
+
+def reject_args(parser, args, message, *names):
+    """
+    Give a usage error if any of some arguments were given. `names` are pairs
+    of how the argument is written on the command line and its name in args,
+    and `message` is formatted with the former.
+    """
+    for name, arg in names:
+        if vars(args)[arg] not in (None, False):
+            parser.error(message.format(name))
+
+
+def parse_range(parser, text):
+    """
+    Parse the argument of --range into a pair (start, stop), where stop may be
+    None
+    """
+    try:
+        start, stop = (int(n) if n else None for n in text.split(":"))
+    except ValueError:
+        parser.error("--range should look like START:STOP")
+    start = start or 0
+    if start < 0 or (stop is not None and stop < start):
+        parser.error("--range should have 0 <= START <= STOP")
+    return start, stop
+
+
+def check_batch_args(parser, args):
+    """
+    Check the arguments for batch mode
+    """
+    reject_args(parser, args, "{} can't be used with --batch",
+                ("--index", "index"), ("--state", "state"),
+                ("-B/--binary", "binary"), ("--container", "container"),
+                ("--range", "range"))
+    if args.in_file is not sys.stdin or args.out_file is not sys.stdout:
+        parser.error("in_file and out_file can't be used with --batch")
+    if args.out_dir is None:
+        parser.error("--batch needs -o/--out-dir")
+    if args.random and args.key_manifest is None:
+        parser.error("-r with --batch needs --key-manifest, or the keys "
+                     "would be lost")
+    if args.key_manifest is not None and not args.random:
+        parser.error("--key-manifest can only be used with -r")
+    # writing the output over the input would destroy it as it's being read,
+    # and output under an input directory would be picked up as input next
+    # time. A manifest can list files from anywhere below its directory, so
+    # only writing to that directory itself is ruled out there
+    out_dir = os.path.realpath(args.out_dir)
+    if os.path.isdir(args.batch):
+        source = os.path.realpath(args.batch)
+        if os.path.commonpath([source, out_dir]) == source:
+            parser.error("-o/--out-dir can't be in the --batch directory")
+    elif out_dir == os.path.realpath(os.path.dirname(args.batch)):
+        parser.error("-o/--out-dir can't be the --batch manifest's directory")
+
+
+def check_index_args(parser, args):
+    """
+    Check the arguments for writing or reading a checkpoint index
+    """
+    reject_args(parser, args, "{} can't be used with --index",
+                ("--state", "state"), ("-B/--binary", "binary"),
+                ("--container", "container"))
+    if args.encrypt:
+        reject_args(parser, args,
+                    "{} can't be used when encrypting with --index",
+                    ("-c/--compare", "compare"), ("-j/--jobs", "jobs"),
+                    ("--range", "range"))
+        return
+    if args.in_file is sys.stdin:
+        parser.error("decrypting with --index needs in_file to be a file")
+    if args.range is not None:
+        reject_args(parser, args, "{} can't be used with --range",
+                    ("-p/--preserve", "preserve"), ("-c/--compare", "compare"))
+        args.range = parse_range(parser, args.range)
+
+
+def check_state_args(parser, args):
+    """
+    Check the arguments for carrying on from a state file
+    """
+    reject_args(parser, args, "{} can't be used with --state",
+                ("-B/--binary", "binary"), ("--container", "container"),
+                ("--range", "range"), ("-j/--jobs", "jobs"))
+
+
+def check_binary_args(parser, args):
+    """
+    Check the arguments for binary mode, with or without a container
+    """
+    reject_args(parser, args, "{} can't be used with -B/--binary",
+                ("-p/--preserve", "preserve"), ("-c/--compare", "compare"),
+                ("-l/--lowercase", "lowercase"), ("-b/--block", "block"),
+                ("-w/--width", "width"))
+    if not args.container:
+        reject_args(parser, args, "{} can only be used with --container",
+                    ("-j/--jobs", "jobs"), ("--range", "range"))
+        return
+    if args.chunk_size <= 0:
+        parser.error("--chunk-size should be positive")
+    if args.chunk_size > CONTAINER_CHUNK_SIZE_MAX:
+        parser.error("--chunk-size should be at most {}".format(
+                CONTAINER_CHUNK_SIZE_MAX))
+    if args.encrypt:
+        if not args.out_file.seekable():
+            parser.error("--container needs out_file to be seekable when "
+                         "encrypting")
+        reject_args(parser, args, "{} can only be used when decrypting",
+                    ("--range", "range"))
+    elif args.range is not None:
+        if not args.in_file.seekable():
+            parser.error("--range with --container needs in_file to be "
+                         "seekable")
+        args.range = parse_range(parser, args.range)
+
+
+def check_text_args(parser, args):
+    """
+    Check the arguments for encrypting or decrypting text in one go
+    """
+    reject_args(parser, args, "{} needs -B/--binary",
+                ("--container", "container"))
+    reject_args(parser, args, "{} can only be used when decrypting with "
+                "--index or --container", ("--range", "range"))
+    if args.decrypt:
+        reject_args(parser, args, "{} can't be used when decrypting without "
+                    "--batch, --index or --container", ("-j/--jobs", "jobs"))
+
+
+def check_format_args(parser, args):
+    """
+    Check the arguments for how the output is formatted, and fill in the
+    defaults
+    """
     if args.preserve:
         # here I'm directly accessing the dictionary associated with the
         # returned NameSpace object, for D.R.Y reasons.
@@ -126,13 +567,67 @@ def get_args():
                 vars(args)[arg] = default
         if min(args.block, args.width) > 0 and args.width < args.block:
             parser.error("WIDTH should be >= BLOCK")
-    return args
 
 
 def main(args):
     """
     Main function
     """
+    if args.batch is not None:
+        main_batch(args)
+    elif args.index is not None and args.decrypt:
+        main_index_decrypt(args)
+    elif args.index is not None:
+        main_index_encrypt(args)
+    elif args.state is not None:
+        main_state(args)
+    elif args.binary:
+        main_binary(args)
+    else:
+        main_text(args)
+
+
+def main_text(args):
+    """
+    Main function for encrypting or decrypting text in one go
+    """
+    sigma, tau = get_keys(args)
+    with args.in_file, args.out_file:
+        if args.encrypt:
+            args.verbose and print("Enciphering...")
+        else:
+            args.verbose and print("Deciphering...")
+        if args.jobs is not None:
+            from parallel_encipher import parallel_encipher
+            run_streamer(parallel_encipher, args.in_file, args.out_file,
+                         (sigma, tau), cipher_options(args),
+                         processes=args.jobs)
+        else:
+            run_cipher(args.in_file, args.out_file, sigma, tau,
+                       **cipher_options(args))
+
+
+def main_index_encrypt(args):
+    """
+    Main function for encrypting and writing a checkpoint index
+    """
+    from checkpoint_index import checkpointed_encipher, CheckpointWriter
+    sigma, tau = get_keys(args)
+    checkpoints = collections.deque()
+    with args.in_file, args.out_file, \
+            open(args.index, "w", encoding="utf-8") as index_file:
+        args.verbose and print("Enciphering...")
+        out_file = CheckpointWriter(args.out_file, index_file, checkpoints,
+                                    args.checkpoint_interval)
+        run_streamer(checkpointed_encipher, args.in_file, out_file,
+                     (sigma, tau, checkpoints), cipher_options(args),
+                     interval=args.checkpoint_interval)
+
+
+def get_keys(args):
+    """
+    Get sigma and tau from the command line arguments
+    """
     if args.random:
         # Generate random permutation for initial sigma, tau
         sigma = Perm.random(string.ascii_uppercase)
@@ -141,20 +636,112 @@ def main(args):
         sigma, tau = map(permutation_from_key, args.keys)
     args.verbose and print("sigma = {}".format(sigma))
     args.verbose and print("tau   = {}".format(tau))
+    return sigma, tau
+
+
+def main_binary(args):
+    """
+    Main function for binary mode
+    """
+    from container import write_container, read_container, read_range
+    if args.random:
+        sigma = Perm.random(range(256))
+        tau = Perm.random(range(256))
+    else:
+        sigma, tau = map(byte_permutation_from_key, args.keys)
+    args.verbose and print("sigma = {}".format(sigma))
+    args.verbose and print("tau   = {}".format(tau))
     with args.in_file, args.out_file:
-        if args.encrypt:
-            args.verbose and print("Enciphering...")
-            process_func = autoperm_encipher
+        # read and write the files underneath the text wrappers that argparse
+        # opened
+        in_file = args.in_file.buffer
+        out_file = args.out_file.buffer
+        if not args.container:
+            run_binary(in_file, out_file, sigma, tau, args.decrypt)
+        elif args.encrypt:
+            write_container(in_file, out_file, sigma, tau, args.chunk_size,
+                            args.jobs)
+        elif args.range is not None:
+            for data in read_range(in_file, sigma, tau, *args.range):
+                out_file.write(data)
         else:
-            args.verbose and print("Deciphering...")
-            process_func = autoperm_decipher
-        if args.preserve:
-            process_func.preserve(args.in_file, args.out_file, sigma, tau)
+            read_container(in_file, out_file, sigma, tau, args.jobs)
+
+
+def main_state(args):
+    """
+    Main function for carrying on from a state file
+    """
+    from cipher_state import CipherState, state_encipher, state_decipher
+    if os.path.exists(args.state):
+        with open(args.state, encoding="utf-8") as state_file:
+            state = CipherState.read(state_file)
+        args.verbose and print("Carrying on after {} letters".format(
+                state.letters))
+    else:
+        state = CipherState.from_keys(*get_keys(args))
+    process_func = state_decipher if args.decrypt else state_encipher
+    with args.in_file, args.out_file:
+        run_streamer(process_func, args.in_file, args.out_file, (state,),
+                     cipher_options(args))
+    state.save(args.state)
+
+
+def main_index_decrypt(args):
+    """
+    Main function for decrypting with a checkpoint index
+    """
+    from checkpoint_index import read_index, range_decipher, parallel_decipher
+    with open(args.index, encoding="utf-8") as index_file:
+        entries = read_index(index_file)
+    path = args.in_file.name
+    encoding = args.in_file.encoding
+    with args.in_file, args.out_file:
+        if args.range is not None:
+            args.verbose and print("Deciphering letters {}:{}...".format(
+                    *args.range))
+            run_streamer(range_decipher, args.in_file, args.out_file,
+                         (path, entries, *args.range), cipher_options(args),
+                         encoding=encoding)
         else:
-            process_func.strip(
-                    args.in_file, args.out_file, sigma, tau,
-                    block=args.block, width=args.width, compare=args.compare,
-                    lowercase=args.lowercase)
+            args.verbose and print("Deciphering in parallel...")
+            run_streamer(parallel_decipher, args.in_file, args.out_file,
+                         (path, entries), cipher_options(args),
+                         processes=args.jobs, encoding=encoding)
+
+
+def cipher_options(args):
+    """
+    Get the keyword arguments for run_cipher from the command line arguments
+    """
+    if args.preserve:
+        return {"decrypt": args.decrypt, "preserve": True}
+    return {"decrypt": args.decrypt, "block": args.block, "width": args.width,
+            "compare": args.compare, "lowercase": args.lowercase}
+
+
+def main_batch(args):
+    """
+    Main function for batch mode
+    """
+    inputs = batch_inputs(args.batch)
+    if args.random:
+        keys = {name: (Perm.random(string.ascii_uppercase),
+                       Perm.random(string.ascii_uppercase))
+                for _, name in inputs}
+        # write the keys before doing anything, so they can't get lost
+        with args.key_manifest:
+            write_key_manifest(keys, args.key_manifest)
+    elif args.keys_from is not None:
+        with args.keys_from:
+            keys = read_key_manifest(args.keys_from)
+        missing = [name for _, name in inputs if name not in keys]
+        if missing:
+            raise SystemExit("no keys for {}".format(", ".join(missing)))
+    else:
+        keys = dict.fromkeys((name for _, name in inputs),
+                             tuple(map(permutation_from_key, args.keys)))
+    run_batch(inputs, args.out_dir, keys, cipher_options(args), args.jobs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,318 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Array-backed engine for the autoperm cipher.
+
+The reference formulation in autoperm.tex composes sigma and tau with a fresh
+transposition after every pair of letters. Doing that literally with Perm
+objects builds a couple of new dictionaries per pair, which is slow. Here sigma,
+tau and their inverses are instead kept as flat lists of integers (indices
+into an alphabet), so composing with a transposition is just swapping two
+entries.
+
+There's also ByteAutopermEngine, for the same cipher over all 256 byte values,
+so that binary data can be encrypted without going anywhere near str.
+"""
+
+import string
+import itertools
+
+from perm import Perm
+from cipher_streamer import chunk
+
+ALPHABET = string.ascii_uppercase
+
+
+class AutopermEngine:
+    """
+    Holds the live state of the autoperm cipher: sigma, tau, sigma^-1 and tau^-1
+    as lists of integers, where integer i represents symbols[i].
+
+    The alphabet starts off as A-Z (plus anything else in the domains of the
+    permutations you pass in), but is extended on the fly with any symbol that
+    turns up in the text, which is mapped to itself initially. This mirrors the
+    Perm convention that unknown items map to themselves, so output is
+    identical to composing Perm objects, however weird your input is.
+
+    The engine is stateful: enciphering or deciphering some text advances
+    sigma and tau, so you can feed it a long text in several goes (as long as
+    each go has an even length - see encipher).
+    """
+    __slots__ = ("symbols", "index", "sigma", "tau", "sigma_inverse",
+                 "tau_inverse")
+
+    def __init__(self, sigma, tau, alphabet=ALPHABET):
+        """
+        Create the engine from two Perm objects.
+        """
+        self.symbols = list(dict.fromkeys(
+                itertools.chain(alphabet, sigma.mapping, tau.mapping)))
+        self.index = {s: i for i, s in enumerate(self.symbols)}
+        self.sigma = [self.index[sigma[s]] for s in self.symbols]
+        self.tau = [self.index[tau[s]] for s in self.symbols]
+        self.sigma_inverse = self.inverse_of(self.sigma)
+        self.tau_inverse = self.inverse_of(self.tau)
+
+    @staticmethod
+    def inverse_of(array):
+        """
+        Invert a permutation represented as a list of integers.
+        """
+        inverse = [0] * len(array)
+        for i, a in enumerate(array):
+            inverse[a] = i
+        return inverse
+
+    def add_symbol(self, symbol):
+        """
+        Extend the alphabet with a symbol that was not seen before, which all of
+        the permutations fix. Returns its index.
+        """
+        new_index = len(self.symbols)
+        self.symbols.append(symbol)
+        self.index[symbol] = new_index
+        for array in (self.sigma, self.tau,
+                      self.sigma_inverse, self.tau_inverse):
+            array.append(new_index)
+        return new_index
+
+    def perms(self):
+        """
+        Get the current sigma and tau as Perm objects.
+        """
+        symbols = self.symbols
+        return tuple(Perm({s: symbols[a] for s, a in zip(symbols, array)})
+                     for array in (self.sigma, self.tau))
+
+    def encipher(self, plaintext):
+        """
+        Generate the ciphertext for an iterable of plaintext symbols, advancing
+        the state as it goes.
+
+        An odd symbol at the end is enciphered with sigma and does not advance
+        the state, exactly as in autoperm_encipher. That means if you call this
+        more than once, every call but the last should see an even number of
+        symbols.
+        """
+        # local names for everything, this is the hot loop
+        index = self.index
+        symbols = self.symbols
+        sigma = self.sigma
+        tau = self.tau
+        sigma_inverse = self.sigma_inverse
+        tau_inverse = self.tau_inverse
+        for a, b in chunk(plaintext, 2):
+            i = index[a] if a in index else self.add_symbol(a)
+            if b is None:
+                yield symbols[sigma[i]]
+                return
+            j = index[b] if b in index else self.add_symbol(b)
+            yield symbols[sigma[i]]
+            yield symbols[tau[j]]
+            # sigma <- sigma (i j), so sigma^-1 <- (i j) sigma^-1
+            sigma[i], sigma[j] = sigma[j], sigma[i]
+            tau[i], tau[j] = tau[j], tau[i]
+            sigma_inverse[sigma[i]] = tau_inverse[tau[i]] = i
+            sigma_inverse[sigma[j]] = tau_inverse[tau[j]] = j
+
+    def decipher(self, ciphertext):
+        """
+        Generate the plaintext for an iterable of ciphertext symbols, advancing
+        the state as it goes. The same caveat about odd lengths applies as for
+        encipher.
+        """
+        index = self.index
+        symbols = self.symbols
+        sigma = self.sigma
+        tau = self.tau
+        sigma_inverse = self.sigma_inverse
+        tau_inverse = self.tau_inverse
+        for a, b in chunk(ciphertext, 2):
+            i = sigma_inverse[index[a] if a in index else self.add_symbol(a)]
+            if b is None:
+                yield symbols[i]
+                return
+            j = tau_inverse[index[b] if b in index else self.add_symbol(b)]
+            yield symbols[i]
+            yield symbols[j]
+            sigma[i], sigma[j] = sigma[j], sigma[i]
+            tau[i], tau[j] = tau[j], tau[i]
+            sigma_inverse[sigma[i]] = tau_inverse[tau[i]] = i
+            sigma_inverse[sigma[j]] = tau_inverse[tau[j]] = j
+
+
+class ByteAutopermEngine:
+    """
+    The autoperm cipher with every byte value 0-255 as the alphabet, taking
+    and returning bytes. sigma, tau and their inverses are bytearrays, and
+    transpositions are swaps of two entries, just like AutopermEngine.
+
+    Unlike AutopermEngine, this doesn't care how long each lot of data you
+    give it is: if there's an odd byte at the end, it's output straight away
+    (enciphered with sigma), and then paired up with the first byte of the
+    next lot. So you can feed it whatever file.read gives you.
+    """
+    __slots__ = ("sigma", "tau", "sigma_inverse", "tau_inverse", "pending")
+
+    def __init__(self, sigma, tau):
+        """
+        Create the engine from two Perm objects on range(256)
+        """
+        self.sigma = bytearray(sigma[i] for i in range(256))
+        self.tau = bytearray(tau[i] for i in range(256))
+        # encipher doesn't keep these up to date, so they're only worked out
+        # when they're needed
+        self.sigma_inverse = self.tau_inverse = None
+        # the plaintext byte waiting for the other half of its pair
+        self.pending = None
+
+    @staticmethod
+    def inverse_of(array):
+        """
+        Invert a permutation represented as a bytearray
+        """
+        inverse = bytearray(256)
+        for i, a in enumerate(array):
+            inverse[a] = i
+        return inverse
+
+    def perms(self):
+        """
+        Get the current sigma and tau as Perm objects
+        """
+        return tuple(Perm(dict(enumerate(array)))
+                     for array in (self.sigma, self.tau))
+
+    def encipher(self, plaintext):
+        """
+        Encipher some bytes, returning the ciphertext as bytes
+        """
+        sigma = self.sigma
+        tau = self.tau
+        self.sigma_inverse = self.tau_inverse = None
+        ciphertext = bytearray(len(plaintext))
+        start = 0
+        if self.pending is not None and plaintext:
+            # sigma[a] was output last time
+            a = self.pending
+            b = plaintext[0]
+            ciphertext[0] = tau[b]
+            sigma[a], sigma[b] = sigma[b], sigma[a]
+            tau[a], tau[b] = tau[b], tau[a]
+            self.pending = None
+            start = 1
+        end = len(plaintext) - (len(plaintext) - start) % 2
+        # this is the hot loop, so the output positions come from a range
+        # rather than being counted up by hand
+        pairs = iter(plaintext[start:end])
+        for t, a, b in zip(range(start, end, 2), pairs, pairs):
+            ciphertext[t] = sigma[a]
+            ciphertext[t + 1] = tau[b]
+            sigma[a], sigma[b] = sigma[b], sigma[a]
+            tau[a], tau[b] = tau[b], tau[a]
+        if end < len(plaintext):
+            self.pending = plaintext[end]
+            ciphertext[end] = sigma[self.pending]
+        return bytes(ciphertext)
+
+    def decipher(self, ciphertext):
+        """
+        Decipher some bytes, returning the plaintext as bytes
+        """
+        sigma = self.sigma
+        tau = self.tau
+        if self.sigma_inverse is None:
+            self.sigma_inverse = self.inverse_of(sigma)
+            self.tau_inverse = self.inverse_of(tau)
+        sigma_inverse = self.sigma_inverse
+        tau_inverse = self.tau_inverse
+        plaintext = bytearray(len(ciphertext))
+        start = 0
+        if self.pending is not None and ciphertext:
+            a = self.pending
+            b = plaintext[0] = tau_inverse[ciphertext[0]]
+            sigma[a], sigma[b] = sigma[b], sigma[a]
+            tau[a], tau[b] = tau[b], tau[a]
+            sigma_inverse[sigma[a]] = tau_inverse[tau[a]] = a
+            sigma_inverse[sigma[b]] = tau_inverse[tau[b]] = b
+            self.pending = None
+            start = 1
+        end = len(ciphertext) - (len(ciphertext) - start) % 2
+        pairs = iter(ciphertext[start:end])
+        for t, c, d in zip(range(start, end, 2), pairs, pairs):
+            a = plaintext[t] = sigma_inverse[c]
+            b = plaintext[t + 1] = tau_inverse[d]
+            sigma[a], sigma[b] = sigma[b], sigma[a]
+            tau[a], tau[b] = tau[b], tau[a]
+            sigma_inverse[sigma[a]] = tau_inverse[tau[a]] = a
+            sigma_inverse[sigma[b]] = tau_inverse[tau[b]] = b
+        if end < len(ciphertext):
+            self.pending = plaintext[end] = sigma_inverse[ciphertext[end]]
+        return bytes(plaintext)
+
+
+def perms_to_array(perms, alphabet=ALPHABET):
+    """
+    Convert a sequence of K Perm objects on some alphabet into a (K, n) NumPy
+    array of integers, where row k maps i to the index of perms[k] applied to
+    alphabet[i]. Needs NumPy.
+    """
+    # NumPy takes a while to import, and the engine is needed for plain
+    # encryption, where it isn't, so it's only imported here
+    import numpy  # pylint: disable=import-outside-toplevel
+    index = {s: i for i, s in enumerate(alphabet)}
+    return numpy.array([[index[perm[s]] for s in alphabet] for perm in perms],
+                       dtype=numpy.intp).reshape(-1, len(alphabet))
+
+
+def batch_decipher(ciphertext, sigmas, taus):
+    """
+    Decipher the same ciphertext under K different keys at once. Needs NumPy.
+
+    `ciphertext` is a sequence of integers (indices into the alphabet, eg
+    A = 0, ..., Z = 25), and `sigmas` and `taus` are (K, n) integer arrays as
+    produced by perms_to_array. Returns a (K, len(ciphertext)) uint8 array,
+    where row k is the plaintext (again as integers) under sigmas[k], taus[k].
+
+    The stream has to be processed a pair at a time, as each pair's
+    transposition depends on the last, but every step is done for all K keys
+    in one go, so deciphering with hundreds of keys costs about as much as one
+    pass through the text. The state is kept exactly as in AutopermEngine,
+    just with a row per key (flattened, so that everything is indexed by
+    row offset + letter).
+    """
+    import numpy  # pylint: disable=import-outside-toplevel
+    count, size = sigmas.shape
+    offsets = numpy.arange(count, dtype=numpy.intp) * size
+    letters = numpy.tile(numpy.arange(size, dtype=numpy.intp), count)
+    sigma = numpy.array(sigmas, dtype=numpy.intp).ravel()
+    tau = numpy.array(taus, dtype=numpy.intp).ravel()
+    sigma_inverse = numpy.empty_like(sigma)
+    sigma_inverse[numpy.repeat(offsets, size) + sigma] = letters
+    tau_inverse = numpy.empty_like(tau)
+    tau_inverse[numpy.repeat(offsets, size) + tau] = letters
+    ciphertext = [int(c) for c in ciphertext]
+    plaintext = numpy.empty((count, len(ciphertext)), dtype=numpy.uint8)
+    for t in range(0, len(ciphertext) - 1, 2):
+        a = sigma_inverse[offsets + ciphertext[t]]
+        b = tau_inverse[offsets + ciphertext[t + 1]]
+        plaintext[:, t] = a
+        plaintext[:, t + 1] = b
+        a_index = offsets + a
+        b_index = offsets + b
+        # sigma <- sigma (a b), and sigma^-1 <- (a b) sigma^-1, for every row
+        sigma_a = sigma[a_index]
+        sigma_b = sigma[b_index]
+        sigma[a_index] = sigma_b
+        sigma[b_index] = sigma_a
+        sigma_inverse[offsets + sigma_b] = a
+        sigma_inverse[offsets + sigma_a] = b
+        tau_a = tau[a_index]
+        tau_b = tau[b_index]
+        tau[a_index] = tau_b
+        tau[b_index] = tau_a
+        tau_inverse[offsets + tau_b] = a
+        tau_inverse[offsets + tau_a] = b
+    if len(ciphertext) % 2:
+        plaintext[:, -1] = sigma_inverse[offsets + ciphertext[-1]]
+    return plaintext
@@ -3,9 +3,11 @@
 import string
 import random
 
-from hill_climbing import HillClimber, MOD_PERMUTATIONS
+from hill_climbing import HillClimber, mod_permutations
 from autoperm import autoperm_encipher, autoperm_decipher
-from quadgram_metric import quadgram_score
+from autoperm_engine import perms_to_array, batch_decipher
+from quadgram_metric import (
+        quadgram_score, letters_to_array, batch_quadgram_score)
 from perm import Perm
 
 
@@ -27,14 +29,42 @@ class AutopermHillClimber(HillClimber):
         # try a random state
         yield tuple(Perm.random(string.ascii_uppercase) for _ in range(2))
         # try modifying just one of sigma or tau
+        transpositions = mod_permutations()
         yield from ((self.sigma * p, self.tau) for p in
-                random.sample(MOD_PERMUTATIONS, k=len(MOD_PERMUTATIONS)))
+                random.sample(transpositions, k=len(transpositions)))
         yield from ((self.sigma, self.tau * p) for p in
-                random.sample(MOD_PERMUTATIONS, k=len(MOD_PERMUTATIONS)))
+                random.sample(transpositions, k=len(transpositions)))
 
-    def get_score(self, state):
+    def random_neighbour(self):
+        transposition = random.choice(mod_permutations())
+        if random.random() < 0.5:
+            return self.sigma * transposition, self.tau
+        return self.sigma, self.tau * transposition
+
+    def get_score(self, state, bound=None):
+        # deciphering is lazy, so giving up scoring early also saves deciphering
+        # the rest of the text
         return quadgram_score.no_strip(
-                autoperm_decipher.func(self.text, *state))
+                autoperm_decipher.func(self.text, *state), bound=bound)
+
+    def score_batch(self, states, batch_size=2 ** 24):
+        # decipher under lots of keys at once, and score all the plaintexts
+        # together. This needs NumPy, and ciphertext that's all A-Z.
+        letters = letters_to_array(self.text)
+        if letters is None:
+            return super().score_batch(states)
+        # limit how many keys are done at once, so that the matrix of
+        # plaintexts is at most about `batch_size` bytes
+        step = max(batch_size // max(len(letters), 1), 1)
+        scores = []
+        for start in range(0, len(states), step):
+            batch = states[start:start + step]
+            plaintexts = batch_decipher(
+                    letters,
+                    perms_to_array([sigma for sigma, _ in batch]),
+                    perms_to_array([tau for _, tau in batch]))
+            scores.extend(batch_quadgram_score(plaintexts))
+        return scores
 
     def set_state(self, state):
         self.sigma, self.tau = state
@@ -51,5 +81,13 @@ if __name__ == "__main__":
     tau = permutation_from_key("linustorvalds")
     ciphertext = "".join(autoperm_encipher.func(plaintext, sigma, tau))
     print("ciphertext: {}".format(ciphertext))
+    # this gets stuck in local optima a lot, so do lots of restarts, on every
+    # core going
+    import os
+    from hill_climbing import parallel_hill_climb
+    score, state = parallel_hill_climb(AutopermHillClimber, ciphertext,
+                                       restarts=4 * (os.cpu_count() or 1))
     hill_climber = AutopermHillClimber(ciphertext, 1)
-    hill_climber.hill_climb()
+    hill_climber.set_state(state)
+    print("best score {:.0f}".format(score))
+    hill_climber.format_state()
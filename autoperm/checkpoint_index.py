@@ -0,0 +1,222 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Checkpoint indexes, for decrypting autoperm ciphertext from the middle.
+
+Every letter of autoperm ciphertext depends on every pair before it, so
+normally to decrypt the end of a file you have to decrypt the whole thing. To
+get around this, encryption can write a sidecar index, which records the state
+of the cipher (sigma^-1 and tau^-1, which is all that decryption needs) every
+`interval` pairs, along with where that pair starts in the ciphertext, counted
+both in letters and in bytes. Then decryption can seek straight to the nearest
+checkpoint before where it wants to start, and carry on from there. It also
+means a big file can be split at the checkpoints and the pieces decrypted in
+parallel.
+
+The index is a JSON lines file: a header {"interval": ...}, then one line per
+checkpoint like
+{"letters": ..., "bytes": ..., "symbols": [...], "sigma_inverse": [...],
+ "tau_inverse": [...]}
+where sigma_inverse maps symbols[i] to sigma_inverse[i], and likewise for
+tau_inverse. The first checkpoint is at the very start, so it's just the keys.
+
+Obviously this means an index is as secret as the keys! Anyone with it can
+decrypt everything after any of its checkpoints.
+"""
+
+import io
+import os
+import json
+import bisect
+import itertools
+import collections
+import concurrent.futures
+
+from perm import Perm
+from cipher_streamer import CipherStreamer, count_letters
+from autoperm_engine import AutopermEngine
+from util import INTERVAL_DEFAULT, file_chunks, strip_chunks
+
+
+def engine_checkpoint(engine, letters):
+    """
+    Record the state of an engine as an index entry (without the byte offset,
+    which CheckpointWriter fills in later).
+    """
+    symbols = engine.symbols
+    return {"letters": letters, "symbols": list(symbols),
+            "sigma_inverse": [symbols[i] for i in engine.sigma_inverse],
+            "tau_inverse": [symbols[i] for i in engine.tau_inverse]}
+
+
+def engine_from_checkpoint(entry):
+    """
+    Make an engine in the state recorded by an index entry
+    """
+    sigma_inverse, tau_inverse = (
+            Perm(dict(zip(entry["symbols"], entry[name])))
+            for name in ("sigma_inverse", "tau_inverse"))
+    return AutopermEngine(sigma_inverse.inverse(), tau_inverse.inverse())
+
+
+@CipherStreamer
+def checkpointed_encipher(plaintext, sigma, tau, checkpoints,
+                          interval=INTERVAL_DEFAULT):
+    """
+    Same as autoperm_encipher, but also adds an index entry to the deque
+    `checkpoints` before every `interval` pairs, for CheckpointWriter to pick
+    up.
+    """
+    if interval < 1:
+        raise ValueError("interval should be at least 1")
+    engine = AutopermEngine(sigma, tau)
+    # stripping can turn one character into several letters (ß is SS), and
+    # CheckpointWriter counts letters in the output, so the engine has to be
+    # given them one at a time too or the counts drift apart
+    plaintext = itertools.chain.from_iterable(plaintext)
+    letters = 0
+    while True:
+        block = list(itertools.islice(plaintext, 2 * interval))
+        if not block:
+            return
+        checkpoints.append(engine_checkpoint(engine, letters))
+        yield from engine.encipher(block)
+        letters += len(block)
+
+
+class CheckpointWriter:
+    """
+    Wraps the file the ciphertext is being written to, to work out at which
+    byte offset each checkpoint's letter lands, and writes the completed index
+    entries to an index file.
+
+    This can't just be worked out from the letter offset, as the output has
+    got spaces, newlines and maybe punctuation in between the letters. Compare
+    mode can't be used, as then the output has plaintext in too.
+    """
+    def __init__(self, out_file, index_file, checkpoints,
+                 interval=INTERVAL_DEFAULT):
+        """
+        `checkpoints` should be the deque given to checkpointed_encipher.
+        """
+        self.out_file = out_file
+        self.index_file = index_file
+        self.checkpoints = checkpoints
+        self.encoding = getattr(out_file, "encoding", None) or "utf-8"
+        self.letters = 0
+        self.bytes = 0
+        index_file.write(json.dumps({"interval": interval}) + "\n")
+
+    def write(self, text):
+        letters = count_letters(text)
+        while (self.checkpoints
+               and self.checkpoints[0]["letters"] < self.letters + letters):
+            entry = self.checkpoints.popleft()
+            # find where the checkpoint's letter is in this bit of text
+            position = next(itertools.islice(
+                    (i for i, c in enumerate(text) if c.isalpha()),
+                    entry["letters"] - self.letters, None))
+            entry["bytes"] = self.bytes + len(
+                    text[:position].encode(self.encoding))
+            self.index_file.write(json.dumps(entry) + "\n")
+        self.letters += letters
+        self.bytes += len(text.encode(self.encoding))
+        return self.out_file.write(text)
+
+
+def read_index(index_file):
+    """
+    Read the entries of an index, in order
+    """
+    lines = iter(index_file)
+    # skip the header
+    next(lines, None)
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def segment_letters(path, entry, encoding="utf-8"):
+    """
+    Generate the plaintext letters of the ciphertext file at `path`, starting
+    from the checkpoint in index entry `entry`.
+    """
+    with open(path, "rb") as raw_file:
+        raw_file.seek(entry["bytes"])
+        with io.TextIOWrapper(raw_file, encoding, newline="") as in_file:
+            yield from engine_from_checkpoint(entry).decipher(
+                    strip_chunks(file_chunks(in_file)))
+
+
+def decipher_segment(job):
+    """
+    Decipher the `count` letters after a checkpoint (or everything after it if
+    `count` is None), returning them as a string. This is what the worker
+    processes of parallel_decipher run.
+
+    `job` is a tuple (path, entry, count, encoding).
+    """
+    path, entry, count, encoding = job
+    return "".join(itertools.islice(segment_letters(path, entry, encoding),
+                                    count))
+
+
+def find_checkpoint(entries, letter):
+    """
+    Find the last index entry at or before a letter offset
+    """
+    offsets = [entry["letters"] for entry in entries]
+    return entries[bisect.bisect_right(offsets, letter) - 1]
+
+
+@CipherStreamer
+def range_decipher(_, path, entries, start, stop=None, encoding="utf-8"):
+    """
+    Decipher letters start to stop (or to the end if stop is None) of the
+    ciphertext file at `path`, using the index `entries` to skip to the nearest
+    checkpoint. The ciphertext is read from `path` rather than from the
+    streamer, so seeking works.
+    """
+    # empty input doesn't get any checkpoints, and there's nothing to decipher
+    if not entries:
+        return
+    start = max(start, 0)
+    entry = find_checkpoint(entries, start)
+    yield from itertools.islice(
+            segment_letters(path, entry, encoding), start - entry["letters"],
+            None if stop is None else max(stop - entry["letters"], 0))
+
+
+@CipherStreamer
+def parallel_decipher(ciphertext, path, entries, processes=None,
+                      encoding="utf-8"):
+    """
+    Decipher the whole ciphertext file at `path` by splitting it up at the
+    checkpoints in the index `entries`, and deciphering the segments in
+    parallel. Again the ciphertext is read from `path` rather than from the
+    streamer.
+
+    Only a few segments per process are in flight at a time, so memory use
+    stays bounded however big the file is. For that to hold with
+    CipherStreamer.preserve, which tees the input between the generator and
+    its template, the ciphertext from the streamer (the same file) is read
+    and thrown away as fast as plaintext comes out, or the tee would end up
+    holding all of it.
+    """
+    ciphertext = iter(ciphertext)
+
+    def keep_pace(letters):
+        collections.deque(itertools.islice(ciphertext, len(letters)),
+                          maxlen=0)
+        return letters
+
+    counts = [b["letters"] - a["letters"] for a, b in zip(entries, entries[1:])]
+    jobs = [(path, entry, count, encoding)
+            for entry, count in itertools.zip_longest(entries, counts)]
+    max_in_flight = 2 * (processes or os.cpu_count())
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        in_flight = collections.deque()
+        for job in jobs:
+            in_flight.append(executor.submit(decipher_segment, job))
+            if len(in_flight) > max_in_flight:
+                yield from keep_pace(in_flight.popleft().result())
+        while in_flight:
+            yield from keep_pace(in_flight.popleft().result())
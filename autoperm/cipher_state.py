@@ -0,0 +1,135 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Saving and resuming the live state of the autoperm cipher.
+
+This is for text that keeps growing, like logs: rather than encrypting the
+whole thing again every time some more is added, you can save the state the
+cipher was left in, and next time carry on from there with just the new text.
+The ciphertext you get by sticking the outputs of each run together is exactly
+the ciphertext of the whole text in one go (apart from how the output is
+split into blocks and lines), and decryption works just the same way.
+
+The state file is a single line of JSON, in the same form as a checkpoint
+index entry (see checkpoint_index.py), plus "pending": the plaintext letter
+left over at the end of the last run if there was an odd number of letters,
+or null. This letter has already been output (as it's enciphered with sigma on
+its own), but it still has to be paired with the first letter of the next run
+to work out the next transposition.
+
+As with an index, the state file is as secret as the keys!
+"""
+
+import os
+import json
+import itertools
+
+from cipher_streamer import CipherStreamer
+from autoperm_engine import AutopermEngine
+from checkpoint_index import engine_checkpoint, engine_from_checkpoint
+
+# Number of letters to work through at a time
+BLOCK_SIZE = 2 ** 16
+
+
+class CipherState:
+    """
+    An AutopermEngine, together with the number of letters it's seen so far
+    and the odd letter left over at the end (if any).
+
+    Unlike the engine, this doesn't mind being fed text with an odd number of
+    letters more than once: a leftover letter is just paired up with the first
+    letter of the next lot.
+    """
+    __slots__ = ("engine", "letters", "pending")
+
+    def __init__(self, engine, letters=0, pending=None):
+        self.engine = engine
+        self.letters = letters
+        self.pending = pending
+
+    @classmethod
+    def from_keys(cls, sigma, tau):
+        """
+        Start from the beginning, with sigma and tau as Perm objects
+        """
+        return cls(AutopermEngine(sigma, tau))
+
+    @classmethod
+    def read(cls, state_file):
+        """
+        Read a state written by write
+        """
+        state = json.loads(state_file.read())
+        return cls(engine_from_checkpoint(state), state["letters"],
+                   state["pending"])
+
+    def write(self, state_file):
+        """
+        Write the state to a file, as a line of JSON
+        """
+        state = engine_checkpoint(self.engine, self.letters)
+        state["pending"] = self.pending
+        state_file.write(json.dumps(state) + "\n")
+
+    def save(self, path):
+        """
+        Write the state to `path`, replacing it in one go, so that there's
+        never a half-written state file if something goes wrong.
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as state_file:
+            self.write(state_file)
+        os.replace(temp_path, path)
+
+    def pending_ciphertext(self):
+        """
+        Get what the pending letter was enciphered as
+        """
+        engine = self.engine
+        return engine.symbols[engine.sigma[engine.index[self.pending]]]
+
+    def run(self, text, decrypt):
+        """
+        Encipher or decipher an iterable of letters, carrying on from where
+        the last call left off.
+        """
+        process = self.engine.decipher if decrypt else self.engine.encipher
+        text = iter(text)
+        if self.pending is not None:
+            first = next(text, None)
+            if first is None:
+                return
+            # the first half of the pair was output last time
+            pair = ((self.pending_ciphertext(), first) if decrypt
+                    else (self.pending, first))
+            _, second = process(pair)
+            self.pending = None
+            self.letters += 1
+            yield second
+        while True:
+            block = list(itertools.islice(text, BLOCK_SIZE))
+            if not block:
+                return
+            output = list(process(block))
+            self.letters += len(block)
+            if len(block) % 2:
+                # that'll be the end of the text, as BLOCK_SIZE is even
+                self.pending = output[-1] if decrypt else block[-1]
+            yield from output
+
+
+@CipherStreamer
+def state_encipher(plaintext, state):
+    """
+    Encipher plaintext carrying on from a CipherState
+    """
+    yield from state.run(plaintext, decrypt=False)
+
+
+@CipherStreamer
+def state_decipher(ciphertext, state):
+    """
+    Decipher ciphertext carrying on from a CipherState
+    """
+    yield from state.run(ciphertext, decrypt=True)
@@ -4,13 +4,25 @@
 Cipher streamer class
 """
 
+import re
+import string
 import itertools
+import collections
 
-from util import file_chars, strip_punc
+from util import CHUNK_SIZE, NON_LETTERS, file_chunks, strip_chunks
 
 # Block default of 4 makes much more sense :P
 BLOCK_DEFAULT = 4
 WIDTH_DEFAULT = 80
+# How much output to build up at once when not wrapping lines
+UNWRAPPED_LINE_LENGTH = 2 ** 16
+# Roughly how many characters get_lines reads at a time
+FORMAT_BATCH_SIZE = 2 ** 16
+
+# Used by restore_punctuation and restore_case on ASCII text
+WORD_PATTERN = re.compile("[A-Za-z]+")
+CASE_BITS = bytes.maketrans(string.ascii_letters.encode("ascii"),
+                            b"\x20" * 26 + bytes(26))
 
 
 def chunk(iterable, size, fillvalue=None):
@@ -28,37 +40,189 @@ def get_lines(iterable, block, width):
     - If block <= 0, do not insert spaces
     - If width <= 0, do not insert newlines
 
-    It is *excruciatingly* lazy, to the point of illegibility. But I think it's
-    fun :).
+    It reads enough characters for a batch of lines at a time, and cuts them
+    up with slices and joins, so that the work per character happens in C
+    rather than in a tower of generators.
+    """
+    # Just strip of any extra spaces at this stage rather than worrying about
+    # removing them earlier.
+    return (line.strip() for line in format_lines(
+            iter(iterable), block, get_line_length(block, width)))
+
+
+def get_line_length(block, width):
+    """
+    Work out how many characters get_lines puts on each line, or None if
+    there's no wrapping.
     """
-    # Each of the four cases is expected to produce an iterable `lines`,
-    # consisting of iterables of strings to be joined and written as lines to
-    # out_file.
+    if block > 0 and 0 < width < block:
+        raise ValueError("`width` should be >= `block`")
+    if width <= 0:
+        # everything goes on one line
+        return None
     if block <= 0:
-        if width <= 0:
-            lines = iterable,
-        else:
-            # chunk output into lines of length `width`
-            lines = chunk(iterable, width, "")
+        return width
+    return (width + 1) // (block + 1) * block
+
+
+def format_lines(iterator, block, line_length):
+    """
+    Generate the lines for get_lines, each containing `line_length` characters
+    from `iterator` (or all of them if `line_length` is None), with a space
+    after every `block` characters if block > 0.
+    """
+    if line_length is None:
+        batch_size = spaced_length = None
     else:
-        # chunk the output into blocks of size `block`
-        chunks = chunk(iterable, block, "")
-        # add a space after each block
-        chunks_spaced = map(itertools.chain.from_iterable,
-                            zip(chunks, itertools.repeat(" ")))
-        if width <= 0:
-            # just write all the blocks
-            lines = itertools.chain.from_iterable(chunks_spaced),
+        batch_size = max(1, FORMAT_BATCH_SIZE // line_length) * line_length
+        # how long each line is once it's got a space after each block
+        spaced_length = line_length if block <= 0 \
+            else line_length // block * (block + 1)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch and line_length is not None:
+            return
+        if block > 0:
+            batch = add_spaces(batch, block)
+        if line_length is None:
+            yield "".join(batch)
+            return
+        for start in range(0, len(batch), spaced_length):
+            yield "".join(batch[start:start + spaced_length])
+
+
+def add_spaces(chars, block):
+    """
+    Put a space after every `block` characters of a list of characters,
+    including after the last (maybe shorter) block.
+
+    Rather than going block by block, this copies the characters into place
+    with one extended slice assignment per position within a block.
+    """
+    # pad the last block out with empty strings, like chunk would
+    chars = chars + [""] * (-len(chars) % block)
+    spaced = [" "] * (len(chars) // block * (block + 1))
+    for position in range(block):
+        spaced[position::block + 1] = chars[position::block]
+    return spaced
+
+
+def compare_windows(chars, func, size):
+    """
+    Generate pairs of lists (plain, output), where plain is the next `size`
+    characters of the iterable `chars`, and output is the next `size`
+    characters that `func` produces when it's given `chars`. If `size` is None,
+    there's just the one pair, of everything.
+
+    If either runs out, empty lists fill in until the other is exhausted.
+
+    This could be done by teeing `chars`, but then if func reads a different
+    amount to what it produces the tee can end up holding a lot. Instead both
+    sides read whole windows of `size` characters, and windows are only kept
+    until the other side has got to them (or until func is finished), so when
+    func reads and writes in step, only a window or two is ever held.
+    """
+    # windows that only func has read, and windows that func hasn't read yet
+    plain_to_read = collections.deque()
+    func_to_read = collections.deque()
+
+    def func_windows():
+        while True:
+            if func_to_read:
+                yield func_to_read.popleft()
+                continue
+            window = list(itertools.islice(chars, size))
+            if not window:
+                return
+            plain_to_read.append(window)
+            yield window
+
+    output = func(itertools.chain.from_iterable(func_windows()))
+    output_finished = False
+    while True:
+        if plain_to_read:
+            plain = plain_to_read.popleft()
         else:
-            if width < block:
-                raise ValueError("`width` should be >= `block`")
-            blocks_per_line = (width + 1) // (block + 1)
-            # split blocks into lines
-            lines = map(itertools.chain.from_iterable,
-                        chunk(chunks_spaced, blocks_per_line, ""))
-    # Just strip of any extra spaces at this stage rather than worrying about
-    # removing them earlier.
-    return ("".join(line).strip() for line in lines)
+            plain = list(itertools.islice(chars, size))
+            if not output_finished:
+                func_to_read.append(plain)
+        line = list(itertools.islice(output, size))
+        if size is None or len(line) < size:
+            output_finished = True
+            func_to_read.clear()
+        if size is not None and not plain and not line:
+            return
+        yield plain, line
+        if size is None:
+            return
+
+
+def is_ascii(text):
+    """
+    Check whether a string is all ASCII
+    """
+    try:
+        text.encode("ascii")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def count_letters(text):
+    """
+    Count how many characters of a string are letters
+    """
+    if is_ascii(text):
+        return len(text.encode("ascii").translate(None, NON_LETTERS))
+    return sum(map(str.isalpha, text))
+
+
+def restore_case(letters, template):
+    """
+    Make each of a string of ASCII letters the same case as the corresponding
+    letter of `template`, which should be at least as long.
+
+    The case of an ASCII letter is just bit 0x20, so this is done by ORing
+    together the uppercased letters and the case bits of the template as big
+    integers, which is much faster than going letter by letter.
+    """
+    case_bits = template[:len(letters)].encode("ascii").translate(CASE_BITS)
+    return (int.from_bytes(letters.upper().encode("ascii"), "big")
+            | int.from_bytes(case_bits, "big")).to_bytes(
+                    len(letters), "big").decode("ascii")
+
+
+def restore_punctuation(text, letters):
+    """
+    Replace the letters of `text` in turn with the strings in `letters`,
+    changing their case to match. If there aren't enough, the rest of the
+    letters of `text` are left out.
+
+    If everything is ASCII and `letters` are single letters, the text is split
+    into words and the words are filled in from slices of `letters`, so the
+    work per character is all done in C. Otherwise this goes character by
+    character.
+    """
+    joined = "".join(letters)
+    if (len(joined) == len(letters) and is_ascii(text + joined)
+            and (joined.isalpha() or not joined)):
+        words = WORD_PATTERN.findall(text)
+        cased = restore_case(joined, "".join(words))
+        ends = list(itertools.accumulate(map(len, words)))
+        filled_words = map(cased.__getitem__, map(slice, [0, *ends], ends))
+        # re.split gives the punctuation before, between and after the words
+        return "".join(itertools.chain.from_iterable(itertools.zip_longest(
+                WORD_PATTERN.split(text), filled_words, fillvalue="")))
+    letters = iter(letters)
+    pieces = []
+    for c in text:
+        if not c.isalpha():
+            pieces.append(c)
+            continue
+        letter = next(letters, None)
+        if letter is not None:
+            pieces.append(letter.upper() if c.isupper() else letter.lower())
+    return "".join(pieces)
 
 
 class CipherStreamer:
@@ -129,34 +293,53 @@ class CipherStreamer:
         """
         if compare and 0 < width <= 2:
             raise ValueError("width should be > 2 in compare mode")
-        input_chars = strip_punc(file_chars(in_file))
-        if compare:
-            input_chars, plaintext = itertools.tee(input_chars)
-        output = self.func(input_chars, *args, **kwargs)
-        if compare:
-            lines = get_lines(output, block, width - 2)
-        else:
-            lines = get_lines(output, block, width)
+        # strip whole chunks at a time, as that's much faster than stripping
+        # character by character
+        input_chars = strip_chunks(file_chunks(in_file))
         if lowercase:
             post_func = lambda s: "{}\n".format(s.lower())
         else:
             post_func = lambda s: "{}\n".format(s.upper())
         if compare:
-            plain_lines = get_lines(plaintext, block, width - 2)
-            for line, plain in itertools.zip_longest(lines, plain_lines,
-                                                     fillvalue=""):
+            # go a line at a time, so that the input and output lines stay
+            # lined up without buffering (unless width <= 0, in which case
+            # there's only one line of each anyway)
+            windows = compare_windows(
+                    input_chars,
+                    lambda chars: self.func(chars, *args, **kwargs),
+                    get_line_length(block, width - 2))
+            for plain, line in windows:
+                # with width <= 0, get_lines gives exactly one line
+                plain, = get_lines(plain, block, 0)
+                line, = get_lines(line, block, 0)
                 out_file.write("i:{}".format(post_func(plain)))
                 out_file.write("o:{}".format(post_func(line)))
                 out_file.write("\n")
+            return
+        output = self.func(input_chars, *args, **kwargs)
+        if width <= 0:
+            # Without wrapping, get_lines would produce the whole output as one
+            # enormous line. Instead wrap into lines of a manageable length, and
+            # glue them back together as they're written, so that memory use
+            # doesn't depend on the length of the input.
+            if block <= 0:
+                pieces = get_lines(output, block, UNWRAPPED_LINE_LENGTH)
+                separator = ""
+            else:
+                blocks_per_piece = max(1, UNWRAPPED_LINE_LENGTH // (block + 1))
+                pieces = get_lines(output, block,
+                                   blocks_per_piece * (block + 1))
+                separator = " "
+            post_piece = str.lower if lowercase else str.upper
+            for i, piece in enumerate(pieces):
+                if i:
+                    out_file.write(separator)
+                out_file.write(post_piece(piece))
+            out_file.write("\n")
         else:
-            for line in lines:
+            for line in get_lines(output, block, width):
                 out_file.write(post_func(line))
 
-    # TODO: do this better (more lazily), with itertools or something. As it
-    #       stands this could easily just be written as a function returning a
-    #       closure.
-    #       I think we have to ask for func to be implemented as a coroutine to
-    #       do this nicely
     def preserve(self, in_file, out_file, *args, **kwargs):
         """
         Restore punctuation and case after the generator.
@@ -168,21 +351,19 @@ class CipherStreamer:
         This is useful because for instance it means that the last trailing
         newline (which is present in any file made by a sane person) will be
         written as output.
+
+        This works a chunk of the input at a time: exactly enough output is
+        taken from the generator to fill in the letters of the chunk, and the
+        result is written in one go.
         """
-        in_file_1, in_file_2 = itertools.tee(file_chars(in_file))
-        output = self.func(strip_punc(in_file_1), *args, **kwargs)
-        for c in output:
-            punc = ' '
-            for punc in in_file_2:
-                if punc.isalpha():
-                    break
-                out_file.write(punc)
-            if not punc.isalpha():
-                out_file.write(c)
-            elif punc.isupper():
-                out_file.write(c.upper())
-            else:
-                out_file.write(c.lower())
-        for punc in in_file_2:
-            if not punc.isalpha():
-                out_file.write(punc)
+        # the generator gets its own copy of the chunks, as it might read ahead
+        # of (or behind) the output we've written so far
+        in_chunks, template_chunks = itertools.tee(file_chunks(in_file))
+        output = self.func(strip_chunks(in_chunks), *args, **kwargs)
+        for text in template_chunks:
+            out_file.write(restore_punctuation(
+                    text, list(itertools.islice(output, count_letters(text)))))
+        # any extra output goes at the end as it is
+        for extra in iter(lambda: "".join(itertools.islice(output, CHUNK_SIZE)),
+                          ""):
+            out_file.write(extra)
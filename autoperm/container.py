@@ -0,0 +1,239 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Chunked container format, for encrypting big files in parallel.
+
+In a normal autoperm ciphertext the state flows through the whole message, so
+nothing can be done to one part without doing everything before it. In a
+container, the data is instead split into fixed-size chunks, and each chunk is
+encrypted on its own (with ByteAutopermEngine) starting from keys of its own:
+
+    sigma_i = sigma rho_i,    tau_i = tau rho'_i
+
+where rho_i and rho'_i are permutations of 0-255 derived from sigma, tau and
+the chunk index i (see chunk_keys). So every chunk can be encrypted or
+decrypted in parallel, and getting at any part of the data only means
+decrypting the chunks it's in.
+
+The file is laid out as follows (all little-endian):
+- 6 bytes of magic, b"APCHNK"
+- 1 byte giving the version of the format (1)
+- 1 byte of padding
+- 4 bytes giving the chunk size
+- 8 bytes giving the number of chunks
+- 8 bytes giving the length of the data
+Then the chunks follow one after the other, all chunk size bytes long apart
+from the last one (the ciphertext is the same length as the plaintext), so
+chunk i starts at byte HEADER.size + i * chunk size.
+
+The number of chunks and the length are only known at the end, so they're
+filled in by seeking back to the header, which means containers have to be
+written to something seekable.
+"""
+
+import os
+import struct
+import hashlib
+import collections
+import concurrent.futures
+
+from perm import Perm
+from autoperm_engine import ByteAutopermEngine
+from util import BINARY_CHUNK_SIZE, CONTAINER_CHUNK_SIZE_MAX, file_chunks
+
+MAGIC = b"APCHNK"
+VERSION = 1
+HEADER = struct.Struct("<6sBxIQQ")
+
+
+class ContainerFormatError(ValueError):
+    """
+    Raised when a container can't be read
+    """
+
+
+def key_material(sigma, tau):
+    """
+    Turn sigma and tau (Perm objects on range(256)) into 512 bytes, which is
+    what the chunk keys are derived from
+    """
+    return bytes(sigma[i] for i in range(256)) + bytes(
+            tau[i] for i in range(256))
+
+
+def chunk_permutations(material, index):
+    """
+    Derive the permutations rho_i and rho'_i for chunk `index`, as lists.
+
+    These come from shuffling 0-255 (Fisher-Yates) with numbers taken from
+    SHAKE-256 of the key material and the index, rather than from the random
+    module, so that they're pinned down by this code alone and containers can
+    always be read back.
+    """
+    stream = hashlib.shake_256(
+            MAGIC + material + index.to_bytes(8, "little")).digest(2 * 255 * 4)
+    numbers = iter(struct.unpack("<510I", stream))
+    permutations = []
+    for _ in range(2):
+        perm = list(range(256))
+        for i in range(255, 0, -1):
+            # the bias from the modulo is about 2^-24, which is neither here
+            # nor there
+            j = next(numbers) % (i + 1)
+            perm[i], perm[j] = perm[j], perm[i]
+        permutations.append(perm)
+    return permutations
+
+
+def chunk_keys(material, index):
+    """
+    Get sigma_i and tau_i for chunk `index` as Perm objects
+    """
+    sigma = material[:256]
+    tau = material[256:]
+    rho, rho_dash = chunk_permutations(material, index)
+    return (Perm({i: sigma[rho[i]] for i in range(256)}),
+            Perm({i: tau[rho_dash[i]] for i in range(256)}))
+
+
+def process_chunk(job):
+    """
+    Encrypt or decrypt a chunk, returning the output. This is what the worker
+    processes run.
+
+    `job` is a tuple (material, index, data, decrypt).
+    """
+    material, index, data, decrypt = job
+    engine = ByteAutopermEngine(*chunk_keys(material, index))
+    return engine.decipher(data) if decrypt else engine.encipher(data)
+
+
+def process_chunks(jobs, processes=None):
+    """
+    Run process_chunk over an iterable of jobs, generating the outputs in
+    order. With processes=1 everything is done in this process, otherwise
+    over a process pool, with only a few chunks per process in flight at a
+    time, so memory use stays bounded.
+    """
+    if processes == 1:
+        yield from map(process_chunk, jobs)
+        return
+    max_in_flight = 2 * (processes or os.cpu_count())
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        in_flight = collections.deque()
+        for job in jobs:
+            in_flight.append(executor.submit(process_chunk, job))
+            if len(in_flight) > max_in_flight:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+class ChunkReader:
+    """
+    Wraps a binary file so that read(n) always gives n bytes, unless the file
+    has run out. (Pipes can give less, and the chunks have to be exactly the
+    chunk size.)
+    """
+    def __init__(self, file):
+        self.file = file
+
+    def read(self, size):
+        """
+        Read `size` bytes, or whatever's left if there are fewer than that
+        """
+        data = self.file.read(size)
+        while 0 < len(data) < size:
+            more = self.file.read(size - len(data))
+            if not more:
+                break
+            data += more
+        return data
+
+
+def write_container(in_file, out_file, sigma, tau,
+                    chunk_size=BINARY_CHUNK_SIZE, processes=None):
+    """
+    Encrypt binary file in_file into a container in binary file out_file
+    (which has to be seekable), where sigma and tau are Perm objects on
+    range(256).
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size should be positive")
+    if chunk_size > CONTAINER_CHUNK_SIZE_MAX:
+        raise ValueError("chunk_size should be at most {}".format(
+                CONTAINER_CHUNK_SIZE_MAX))
+    start = out_file.tell()
+    out_file.write(HEADER.pack(MAGIC, VERSION, chunk_size, 0, 0))
+    material = key_material(sigma, tau)
+    count = length = 0
+    jobs = ((material, index, data, False) for index, data in enumerate(
+            file_chunks(ChunkReader(in_file), chunk_size)))
+    for ciphertext in process_chunks(jobs, processes):
+        out_file.write(ciphertext)
+        count += 1
+        length += len(ciphertext)
+    end = out_file.tell()
+    out_file.seek(start)
+    out_file.write(HEADER.pack(MAGIC, VERSION, chunk_size, count, length))
+    out_file.seek(end)
+
+
+def read_header(in_file):
+    """
+    Read the header of a container from a binary file, returning the chunk
+    size, the number of chunks and the length of the data
+    """
+    header = in_file.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ContainerFormatError("container is too short to have a header")
+    magic, version, chunk_size, count, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ContainerFormatError("bad magic {!r}".format(magic))
+    if version != VERSION:
+        raise ContainerFormatError("unknown version {}".format(version))
+    if chunk_size <= 0 or count != -(-length // chunk_size):
+        raise ContainerFormatError("header doesn't add up")
+    return chunk_size, count, length
+
+
+def read_container(in_file, out_file, sigma, tau, processes=None):
+    """
+    Decrypt a container in binary file in_file to binary file out_file
+    """
+    chunk_size, count, length = read_header(in_file)
+    material = key_material(sigma, tau)
+    chunks = file_chunks(ChunkReader(in_file), chunk_size)
+    jobs = ((material, index, data, True)
+            for index, data in zip(range(count), chunks))
+    written = 0
+    for plaintext in process_chunks(jobs, processes):
+        out_file.write(plaintext)
+        written += len(plaintext)
+    if written != length:
+        raise ContainerFormatError("container is truncated")
+
+
+def read_range(in_file, sigma, tau, start, stop=None):
+    """
+    Decrypt bytes start to stop (or to the end if stop is None) of the data in
+    a container, by seeking straight to the chunks they're in, and generate
+    the plaintext a chunk at a time. in_file has to be a seekable binary file,
+    with the container starting where it's at.
+    """
+    if start < 0:
+        raise ValueError("start should be at least 0")
+    base = in_file.tell()
+    chunk_size, _, length = read_header(in_file)
+    stop = length if stop is None else min(stop, length)
+    if start >= stop:
+        return
+    material = key_material(sigma, tau)
+    for index in range(start // chunk_size, (stop - 1) // chunk_size + 1):
+        offset = index * chunk_size
+        in_file.seek(base + HEADER.size + offset)
+        data = ChunkReader(in_file).read(chunk_size)
+        if len(data) != min(chunk_size, length - offset):
+            raise ContainerFormatError("container is truncated")
+        plaintext = process_chunk((material, index, data, True))
+        yield plaintext[max(start - offset, 0):stop - offset]
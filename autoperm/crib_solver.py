@@ -0,0 +1,415 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Known plaintext (crib) attack on the autoperm cipher.
+
+Hill climbing knows nothing about the plaintext, but if you know (or can guess)
+some of it, the cipher gives itself away almost at once. The transpositions
+only depend on the plaintext, so if the plaintext is known from some pair n_0
+onwards, then the state at pair n is
+
+    sigma_n = sigma_{n_0} P_n,    where P_n = (a_{n_0} b_{n_0}) ...
+
+and P_n is known. So every known letter a_{2n} with ciphertext c_{2n} pins
+down an entry of sigma_{n_0}:
+
+    sigma_{n_0}[P_n[a_{2n}]] = c_{2n}
+
+and likewise every b_{2n + 1} pins down an entry of tau_{n_0}. Going through
+the text collecting these entries (and checking they're consistent, ie that
+sigma_{n_0} stays injective) gives sigma_{n_0} and tau_{n_0}, or as much of
+them as the text uses.
+
+Where a plaintext letter isn't known, it can often be worked out from the
+entries found so far (if sigma_{n_0} is already known to map something to
+P_n^-1 of the ciphertext letter). Where it can't, the solver tries every
+letter it could be, and keeps going with each one that stays consistent, so
+you get every partial key consistent with what you know. Lots of unknown
+letters close together can make that a lot of partial keys!
+
+Guessing is much worse near n_0, where hardly any of the key is known, so
+guesses can't be worked out or ruled out, than further on, where nearly
+everything can. So the search starts at the longest stretch of known letters
+instead, pair n_1 say, and finds sigma_{n_1} going forwards from there. Then it
+goes backwards to n_0, which works the same way, as
+
+    sigma_n = sigma_{n_1} Q_n,    where Q_n = (a_{n_1 - 1} b_{n_1 - 1}) ...
+                                              (a_n b_n)
+
+and sigma_{n + 1} = sigma_n (a_n b_n) maps b_n to c_{2n}, so
+
+    sigma_{n_1}[Q_{n + 1}[b_n]] = c_{2n}
+
+and likewise tau_{n_1}[Q_{n + 1}[a_n]] = c_{2n + 1}. By then the keys are
+usually all known, so there's nothing left to guess, and sigma_{n_0} is just
+sigma_{n_1} Q_{n_0}.
+
+If the crib starts at the start of the message, n_0 = 0, and you get the keys
+themselves.
+"""
+
+import math
+import string
+import collections
+
+import argparse
+
+from perm import Perm
+from autoperm_engine import AutopermEngine
+from util import strip_punc
+
+ALPHABET = string.ascii_uppercase
+
+# A partial key consistent with the crib: `offset` is the letter the state is
+# for, `sigma` and `tau` are dictionaries of what's known of the state (which
+# have every letter in if enough is known - see solution_perms), and
+# `plaintext` is the plaintext from `offset` up to the end of the crib, with
+# any letters that weren't known filled in.
+Solution = collections.namedtuple("Solution", "offset sigma tau plaintext")
+
+
+class SearchBudgetExceeded(Exception):
+    """
+    Raised by solve when it gives up, having gone through as many pairs of
+    letters as it was allowed to
+    """
+
+
+def read_crib(text):
+    """
+    Turn the text of a crib into a list of letters, with None for each "?"
+    (meaning a letter that isn't known). Anything else that isn't a letter is
+    ignored.
+    """
+    crib = []
+    for c in text:
+        if c == "?":
+            crib.append(None)
+        elif c.isalpha():
+            crib.extend(c.upper())
+    return crib
+
+
+class PartialState:
+    """
+    What's known so far: entries of sigma_{n_1} and tau_{n_1} (and their
+    inverses), P_n (or Q_n, going backwards) and its inverse, and the letters
+    of plaintext that weren't known but have been filled in. All
+    dictionaries, with P_n missing anything it fixes.
+    """
+    __slots__ = ("sigma", "sigma_inverse", "tau", "tau_inverse", "product",
+                 "product_inverse", "filled")
+
+    def __init__(self):
+        self.sigma = {}
+        self.sigma_inverse = {}
+        self.tau = {}
+        self.tau_inverse = {}
+        self.product = {}
+        self.product_inverse = {}
+        self.filled = {}
+
+    def copy(self):
+        """
+        Copy the state, for trying out a guess
+        """
+        copy = PartialState()
+        for name in self.__slots__:
+            setattr(copy, name, dict(getattr(self, name)))
+        return copy
+
+    def constrain(self, key, key_inverse, letter, ciphertext):
+        """
+        Add the constraint that the key maps P_n[letter] to ciphertext.
+        Returns False if that contradicts what's known.
+        """
+        source = self.product.get(letter, letter)
+        if key.get(source, ciphertext) != ciphertext:
+            return False
+        if key_inverse.get(ciphertext, source) != source:
+            return False
+        key[source] = ciphertext
+        key_inverse[ciphertext] = source
+        return True
+
+    def deduce(self, key_inverse, ciphertext):
+        """
+        Work out what plaintext letter must have been enciphered as
+        `ciphertext`, or None if that isn't known yet.
+        """
+        source = key_inverse.get(ciphertext)
+        if source is None:
+            return None
+        return self.product_inverse.get(source, source)
+
+    def letter_at(self, plaintext, position, ciphertext, key_inverse):
+        """
+        Get the plaintext letter at a position, if it's in the crib, has been
+        guessed, or can be worked out from `ciphertext`, the letter the key
+        gives for it (in which case it's remembered), or None if it has to be
+        guessed.
+        """
+        letter = plaintext[position]
+        if letter is None:
+            letter = self.filled.get(position)
+        if letter is None:
+            letter = self.deduce(key_inverse, ciphertext)
+            if letter is not None:
+                self.filled[position] = letter
+        return letter
+
+    def candidates(self, key):
+        """
+        Every plaintext letter which the key might encipher as a ciphertext
+        letter it doesn't map anything to yet
+        """
+        return [letter for letter in ALPHABET
+                if self.product.get(letter, letter) not in key]
+
+    def transpose(self, a, b):
+        """
+        P_n <- P_n (a b)
+        """
+        product = self.product
+        product_inverse = self.product_inverse
+        product[a], product[b] = product.get(b, b), product.get(a, a)
+        product_inverse[product[a]] = a
+        product_inverse[product[b]] = b
+
+    def keys(self):
+        """
+        Get what's known of sigma_{n_0} and tau_{n_0}, as dictionaries, once
+        the search has got back to n_0 (so they're sigma_{n_1} Q_{n_0} and
+        tau_{n_1} Q_{n_0}). If all but one entry is known, the last one is
+        filled in.
+
+        These aren't Perm objects, as a partial key usually isn't a
+        permutation of anything (it could map E to W and W to I, but nothing to
+        E), and Perm doesn't cope with that.
+        """
+        keys = []
+        for key in self.sigma, self.tau:
+            key = {letter: key[self.product.get(letter, letter)]
+                   for letter in ALPHABET
+                   if self.product.get(letter, letter) in key}
+            if len(key) == len(ALPHABET) - 1:
+                source, = set(ALPHABET) - set(key)
+                key[source], = set(ALPHABET) - set(key.values())
+            keys.append(key)
+        return keys
+
+
+def search_start(plaintext, origin, end):
+    """
+    Pick the pair to start searching from: the first of the longest run of
+    pairs with both letters known (see the module docstring), or `origin` if
+    there aren't any.
+    """
+    best = origin
+    best_length = length = 0
+    for t in range(origin, end, 2):
+        if plaintext[t] is None or (t + 1 < end and plaintext[t + 1] is None):
+            length = 0
+            continue
+        length += 1
+        if length > best_length:
+            best = t - 2 * (length - 1)
+            best_length = length
+    return best
+
+
+def search_steps(origin, start, end):
+    """
+    Get the steps of the search from pair `start`: first forwards to `end`,
+    then None (where Q_n starts off), then backwards to `origin`. Each step is
+    a pair of letters, as (plaintext position, ciphertext position) pairs for
+    the sigma and then the tau constraint (see the module docstring). A last
+    letter on its own just has the sigma one.
+    """
+    steps = [((t, t), (t + 1, t + 1)) if t + 1 < end else ((t, t),)
+             for t in range(start, end, 2)]
+    steps.append(None)
+    steps.extend(((t + 1, t), (t, t + 1))
+                 for t in range(start - 2, origin - 1, -2))
+    return steps
+
+
+def solve(ciphertext, plaintext, budget=None):
+    """
+    Generate every partial key consistent with a crib.
+
+    `ciphertext` is a sequence of letters, and `plaintext` a sequence of the
+    same letters of plaintext, with None for letters that aren't known (and it
+    can be shorter than the ciphertext). The partial keys are for the state
+    at the pair where the first known letter is (see the module docstring),
+    and are generated as Solution objects.
+
+    This does a depth first search over the letters that have to be guessed,
+    so solutions come out as soon as they're found: if you only want a few,
+    stop early. If `budget` is given, SearchBudgetExceeded is raised rather
+    than go through more than that many pairs of letters (counting a pair
+    again each time it's tried with a different guess), as with enough
+    unknown letters the search can take practically forever.
+    """
+    known = [t for t, letter in enumerate(plaintext[:len(ciphertext)])
+             if letter is not None]
+    if not known:
+        return
+    origin = known[0] // 2 * 2
+    end = known[-1] + 1
+    steps = search_steps(origin, search_start(plaintext, origin, end), end)
+    budget = math.inf if budget is None else budget
+    # (step, state) pairs still to be tried
+    stack = [(0, PartialState())]
+    while stack:
+        i, state = stack.pop()
+        while i < len(steps):
+            step = steps[i]
+            if step is None:
+                # turning round, so start on Q_n
+                state.product = {}
+                state.product_inverse = {}
+                i += 1
+                continue
+            if budget <= 0:
+                raise SearchBudgetExceeded("gave up searching for keys")
+            budget -= 1
+            # go through the pair's letters, first the sigma constraint and
+            # then the tau one
+            pair = []
+            for (position, enciphered), key, key_inverse in zip(
+                    step, (state.sigma, state.tau),
+                    (state.sigma_inverse, state.tau_inverse)):
+                letter = state.letter_at(plaintext, position,
+                                         ciphertext[enciphered], key_inverse)
+                if letter is None:
+                    # guess, and come back to this step with each guess
+                    for guess in reversed(state.candidates(key)):
+                        guessed = state.copy()
+                        guessed.filled[position] = guess
+                        stack.append((i, guessed))
+                    break
+                if not state.constrain(key, key_inverse, letter,
+                                       ciphertext[enciphered]):
+                    break
+                pair.append(letter)
+            else:
+                if len(pair) == 2:
+                    state.transpose(*pair)
+                i += 1
+                continue
+            # the pair wasn't finished, either because of a contradiction or
+            # because we're guessing
+            break
+        else:
+            sigma, tau = state.keys()
+            yield Solution(origin, sigma, tau, "".join(
+                    plaintext[position] or state.filled[position]
+                    for position in range(origin, end)))
+
+
+def solution_perms(solution):
+    """
+    Get a solution's sigma and tau as Perm objects, if they're complete, or
+    None if not.
+    """
+    if not all(len(key) == len(ALPHABET)
+               for key in (solution.sigma, solution.tau)):
+        return None
+    return Perm(dict(solution.sigma)), Perm(dict(solution.tau))
+
+
+def solution_plaintext(solution, ciphertext):
+    """
+    Decipher the ciphertext from a solution's offset onwards, if its keys are
+    complete, or return None if not.
+    """
+    perms = solution_perms(solution)
+    if perms is None:
+        return None
+    return "".join(AutopermEngine(*perms).decipher(
+            ciphertext[solution.offset:]))
+
+
+def key_table(key):
+    """
+    Format a (maybe partial) key as a table like Perm.table_format, with ? for
+    anything that isn't known
+    """
+    return "{}\n{}".format(" ".join(ALPHABET),
+                           " ".join(key.get(c, "?") for c in ALPHABET))
+
+
+def get_args():
+    """
+    Parse argv
+    """
+    parser = argparse.ArgumentParser(
+            description="""Recover autoperm keys from a crib: some known
+                           plaintext, lined up with the ciphertext""",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            "in_file", type=argparse.FileType("r"),
+            help="Ciphertext")
+    parser.add_argument(
+            "crib_file", type=argparse.FileType("r"),
+            help="""Known plaintext, with ? for each letter that isn't known.
+                    Punctuation is ignored.""")
+    parser.add_argument(
+            "out_file", type=argparse.FileType("w"), default="-", nargs="?",
+            help="Where to write the solutions")
+    parser.add_argument(
+            "-o", "--offset", type=int, default=0,
+            help="Letter of the ciphertext where the crib starts")
+    parser.add_argument(
+            "-n", "--solutions", type=int, default=10,
+            help="Stop after this many solutions")
+    parser.add_argument(
+            "-b", "--budget", type=int, default=10 ** 6,
+            help="""Give up after going through this many pairs of letters
+                    (going through them again for each guess), or 0 to never
+                    give up""")
+    args = parser.parse_args()
+    if args.offset < 0:
+        parser.error("-o/--offset should be at least 0")
+    if args.solutions < 1:
+        parser.error("-n/--solutions should be at least 1")
+    if args.budget < 0:
+        parser.error("-b/--budget should be at least 0")
+    return args
+
+
+def main(args):
+    """
+    Main function
+    """
+    with args.in_file, args.crib_file, args.out_file:
+        ciphertext = "".join(strip_punc(args.in_file.read()))
+        crib = [None] * args.offset + read_crib(args.crib_file.read())
+        solutions = solve(ciphertext, crib, args.budget or None)
+        count = 0
+        try:
+            for count, solution in enumerate(solutions, 1):
+                args.out_file.write(
+                        "solution {}, for the state at letter {}:\n"
+                        "sigma:\n{}\ntau:\n{}\n".format(
+                                count, solution.offset,
+                                key_table(solution.sigma),
+                                key_table(solution.tau)))
+                plaintext = solution_plaintext(solution, ciphertext)
+                if plaintext is None:
+                    plaintext = solution.plaintext + "..."
+                args.out_file.write("plaintext:\n{}\n\n".format(plaintext))
+                if count == args.solutions:
+                    break
+        except SearchBudgetExceeded:
+            args.out_file.write(
+                    "gave up after {} pairs of letters (try a bigger "
+                    "-b/--budget, or more of the crib)\n".format(args.budget))
+            return
+        if not count:
+            args.out_file.write("no solutions\n")
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -4,23 +4,53 @@
 Early beta release of hill climbing attack on simple substitution ciphers
 """
 
+import os
 import string
 import itertools
 import math
 import sys
 import random
 import time
+import queue
+import functools
+import contextlib
 import collections
+import multiprocessing
 
 import abc
+import concurrent.futures
 
 from perm import Perm
 from substitution import substitution
-from quadgram_metric import quadgram_score
-from metric import ENGLISH_FREQUENCIES
+from quadgram_metric import (
+        quadgram_score, incremental_quadgram_scorer, SwapScorer)
+from metric import ENGLISH_FREQUENCIES, english_bigram_frequencies
 
-MOD_PERMUTATIONS = [Perm.from_cycle(transp)
-        for transp in itertools.combinations(string.ascii_uppercase, 2)]
+
+@functools.lru_cache(maxsize=None)
+def mod_permutations():
+    """
+    All of the transpositions of the alphabet, which are used to generate
+    neighbouring keys. They're only built the first time they're needed.
+    """
+    return [Perm.from_cycle(transp)
+            for transp in itertools.combinations(string.ascii_uppercase, 2)]
+
+
+def __getattr__(name):
+    """
+    Make MOD_PERMUTATIONS a lazily built module attribute (see PEP 562).
+    """
+    if name == "MOD_PERMUTATIONS":
+        return mod_permutations()
+    raise AttributeError("module {!r} has no attribute {!r}"
+            .format(__name__, name))
+
+
+# A neighbouring substitution key, obtained by swapping what the letters a and b
+# map to. Passing these around rather than whole new keys means the score can
+# be updated incrementally.
+Swap = collections.namedtuple("Swap", "a b")
 
 
 class HillClimber(abc.ABC):
@@ -46,13 +76,39 @@ class HillClimber(abc.ABC):
     def format_state(self): ...
     @abc.abstractmethod
     def modify_state(self): ...
+    # get_score may give up early and return quadgram_metric.BOUND_EXCEEDED
+    # (or anything else at least as big as `bound`) once it's sure the score
+    # is bigger than `bound`
     @abc.abstractmethod
-    def get_score(self, state): ...
+    def get_score(self, state, bound=None): ...
+
+    def random_neighbour(self):
+        """
+        Pick one neighbouring state at random. This default just picks from
+        everything modify_state produces, which subclasses should override with
+        something cheaper.
+        """
+        return random.choice(list(self.modify_state()))
 
-    def hill_climb(self):
+    def score_batch(self, states):
+        """
+        Score a whole list of states, returning a sequence of scores. By default
+        this just calls get_score for each one, but subclasses can override it
+        to do them all in one go.
+        """
+        return [self.get_score(state) for state in states]
+
+    def hill_climb(self, steepest=False):
+        """
+        Climb until a local optimum is reached. By default each step takes the
+        first improvement found, but if `steepest` is set each step scores all
+        of the neighbours (with score_batch) and takes the best.
+        """
         start_time = time.time()
         iterations = 0
-        while self.hill_climb_iteration():
+        iteration = (self.steepest_ascent_iteration if steepest
+                     else self.hill_climb_iteration)
+        while iteration():
             iterations += 1
             print("iteration {}, score {:.0f}".format(iterations,
                                                       self.best_score))
@@ -71,8 +127,9 @@ class HillClimber(abc.ABC):
             if self.total_keys_tried % self.update_interval == 0:
                 print("\rtried {} keys".format(self.total_keys_tried),
                       end="", file=sys.stderr)
-            # no walrus for compatibility
-            score = self.get_score(modified_state)
+            # no walrus for compatibility. Anything worse than the best score
+            # is thrown away anyway, so scoring can stop once it gets there.
+            score = self.get_score(modified_state, bound=self.best_score)
             if score < self.best_score:
                 self.set_state(modified_state)
                 self.best_score = score
@@ -82,15 +139,53 @@ class HillClimber(abc.ABC):
             print("\n", end="", file=sys.stderr)
             return False
 
+    def steepest_ascent_iteration(self):
+        """
+        Score every neighbour in one batch, and move to the best of them if it's
+        an improvement.
+        """
+        states = list(self.modify_state())
+        scores = self.score_batch(states)
+        self.total_keys_tried += len(states)
+        if not states:
+            return False
+        best = min(range(len(states)), key=scores.__getitem__)
+        if scores[best] < self.best_score:
+            self.set_state(states[best])
+            self.best_score = float(scores[best])
+            return True
+        return False
+
 
 class SubstitutionHillClimber(HillClimber):
-    __slots__ = "key",
+    __slots__ = "key", "scorer"
+
+    def __init__(self, text, update_interval=1000):
+        # both are set up properly by initialise_state
+        self.key = None
+        self.scorer = None
+        super().__init__(text, update_interval)
 
     def initialise_state(self):
         frequencies = collections.Counter(self.text)
-        self.key = Perm({a: b for (a, _), (b, _) in
-                zip(frequencies.most_common(),
+        # letters that don't appear at all go at the end, so that the key is a
+        # whole permutation of the alphabet
+        letters = itertools.chain(
+                (a for a, _ in frequencies.most_common()),
+                (a for a in string.ascii_uppercase if a not in frequencies))
+        self.key = Perm({a: b for a, (b, _) in
+                zip(letters,
                     collections.Counter(ENGLISH_FREQUENCIES).most_common())})
+        self.reset_scorer()
+
+    def reset_scorer(self):
+        # the scorer works from the histogram of ciphertext quadgrams, which is
+        # computed once here. It only understands A-Z, so anything else has to
+        # be scored the slow way
+        if self.text.isascii() and self.text.isalpha() and self.text.isupper():
+            self.scorer = incremental_quadgram_scorer(self.text, self.key)
+        else:
+            self.scorer = None
 
     def format_state(self):
         print("key:\n{}".format(self.key.inverse().table_format()))
@@ -102,19 +197,256 @@ class SubstitutionHillClimber(HillClimber):
         # try all other permutations, randomly ordered. The shuffling here
         # doesn't take place in a bottleneck, and it hopefully prevents the
         # search path from becoming too homogeneous.
-        yield from (self.key * p for p in
-                random.sample(MOD_PERMUTATIONS, k=len(MOD_PERMUTATIONS)))
+        transpositions = mod_permutations()
+        yield from (Swap(*p.mapping) for p in
+                random.sample(transpositions, k=len(transpositions)))
+
+    def random_neighbour(self):
+        return Swap(*random.sample(string.ascii_uppercase, k=2))
+
+    def get_score(self, state, bound=None):
+        if self.scorer is None:
+            if isinstance(state, Swap):
+                state = self.key * Perm.from_cycle(state)
+            return quadgram_score.no_strip(substitution.func(self.text, state),
+                                           bound=bound)
+        if isinstance(state, Swap):
+            return self.scorer.propose_swap(ord(state.a) - 0x41,
+                                            ord(state.b) - 0x41)
+        return self.scorer.score_key(state)
 
-    def get_score(self, state):
-        return quadgram_score.no_strip(substitution.func(self.text, state))
+    def score_batch(self, states):
+        if self.scorer is None or not all(isinstance(state, Swap)
+                                          for state in states):
+            return super().score_batch(states)
+        return self.scorer.score_swaps([(ord(a) - 0x41, ord(b) - 0x41)
+                                        for a, b in states])
 
     def set_state(self, state):
-        self.key = state
+        if isinstance(state, Swap):
+            self.key *= Perm.from_cycle(state)
+            if self.scorer is not None:
+                a, b = ord(state.a) - 0x41, ord(state.b) - 0x41
+                pending = self.scorer.pending
+                if pending is None or pending[:2] != (a, b):
+                    self.scorer.propose_swap(a, b)
+                self.scorer.commit()
+        else:
+            self.key = state
+            self.reset_scorer()
 
     def get_state(self):
         return self.key
 
 
+class BigramScorer(SwapScorer):
+    """
+    Scores a substitution key by comparing the bigram counts of the deciphered
+    text with those expected of English (the sum of absolute differences, so
+    lower is better), as in Jakobsen's fast substitution attack.
+
+    The 26 x 26 matrix of ciphertext bigram counts is computed once. The
+    matrix of plaintext bigram counts under a key is just that matrix with its
+    rows and columns permuted by the key, and swapping two letters of the key
+    swaps two rows and two columns. So scoring a key costs O(26^2), however
+    long the text is.
+
+    This has the same interface as quadgram_metric.IncrementalQuadgramScorer,
+    so it can be dropped into SubstitutionHillClimber.
+    """
+    __slots__ = "counts", "expected", "key", "matrix", "score"
+
+    def __init__(self, text, key):
+        """
+        `text` should be a string of uppercase letters (anything outside A-Z
+        is ignored), and `key` should be a permutation of A-Z, mapping the
+        letters of the text to the letters they stand for.
+        """
+        letters = [ord(c) - 0x41 for c in text if "A" <= c <= "Z"]
+        self.counts = [[0] * 26 for _ in range(26)]
+        for a, b in zip(letters, letters[1:]):
+            self.counts[a][b] += 1
+        total = max(len(letters) - 1, 0)
+        self.expected = [[frequency * total for frequency in row]
+                         for row in english_bigram_frequencies()]
+        self.key = self.key_to_integers(key)
+        self.matrix = self.permuted_counts(self.key)
+        self.score = self.matrix_score(self.matrix)
+        super().__init__()
+
+    @staticmethod
+    def key_to_integers(key):
+        """
+        Convert a key mapping letters to letters into a list mapping integers
+        to integers (A = 0, ..., Z = 25), checking that it's a permutation.
+        """
+        integers = [ord(key[chr(0x41 + c)]) - 0x41 for c in range(26)]
+        if sorted(integers) != list(range(26)):
+            raise ValueError("key should be a permutation of A-Z")
+        return integers
+
+    def permuted_counts(self, key):
+        """
+        The matrix of plaintext bigram counts under a key (as a list of
+        integers)
+        """
+        inverse = [0] * 26
+        for cipher, plain in enumerate(key):
+            inverse[plain] = cipher
+        counts = self.counts
+        return [[counts[inverse[p]][inverse[q]] for q in range(26)]
+                for p in range(26)]
+
+    def matrix_score(self, matrix):
+        """
+        Distance of a matrix of plaintext bigram counts from English
+        """
+        return sum(abs(count - expected)
+                   for row, expected_row in zip(matrix, self.expected)
+                   for count, expected in zip(row, expected_row))
+
+    def score_key(self, key):
+        """
+        Score any key (mapping letters to letters)
+        """
+        return self.matrix_score(self.permuted_counts(
+                self.key_to_integers(key)))
+
+    def propose_swap(self, a, b):
+        """
+        Get the score if the letters a and b (A = 0, ..., Z = 25) swapped what
+        they map to. This is remembered until the next call to commit or
+        rollback.
+        """
+        p, q = self.key[a], self.key[b]
+        # the swap exchanges rows p and q and columns p and q, so only cells in
+        # those rows and columns change
+        swapped = list(range(26))
+        swapped[p], swapped[q] = q, p
+        cells = [(i, j) for i in (p, q) for j in range(26)]
+        cells += [(i, j) for j in (p, q) for i in range(26) if i not in (p, q)]
+        matrix = self.matrix
+        expected = self.expected
+        delta = sum(abs(matrix[swapped[i]][swapped[j]] - expected[i][j])
+                    - abs(matrix[i][j] - expected[i][j]) for i, j in cells)
+        score = self.score + delta
+        self.pending = a, b, score
+        return score
+
+    def commit(self):
+        """
+        Keep the last proposed swap
+        """
+        a, b, _ = self.pending
+        key = self.key
+        p, q = key[a], key[b]
+        key[a], key[b] = q, p
+        matrix = self.matrix
+        matrix[p], matrix[q] = matrix[q], matrix[p]
+        for row in matrix:
+            row[p], row[q] = row[q], row[p]
+        self.score = self.matrix_score(matrix)
+        self.pending = None
+
+
+class BigramHillClimber(SubstitutionHillClimber):
+    """
+    Hill climbing attack on simple substitution ciphers, scoring keys by their
+    bigram statistics with a BigramScorer. Each step costs the same however
+    long the ciphertext is, which makes it a fast way to get close on very long
+    texts. The result is then polished off by a SubstitutionHillClimber, using
+    quadgrams.
+    """
+    __slots__ = ()
+
+    def reset_scorer(self):
+        self.scorer = BigramScorer(self.text, self.key)
+
+    def hill_climb(self, steepest=False, polish=True):
+        """
+        Climb with bigrams (see HillClimber.hill_climb for `steepest`), and
+        then, if `polish` is set, carry on from there with quadgrams.
+        """
+        super().hill_climb(steepest)
+        if polish:
+            print("polishing with quadgrams...")
+            polisher = SubstitutionHillClimber(self.text, self.update_interval)
+            polisher.set_state(self.key)
+            polisher.best_score = polisher.get_score(self.key)
+            polisher.hill_climb(steepest)
+            self.set_state(polisher.get_state())
+            self.best_score = self.get_score(self.key)
+
+
+def climb_worker(climber_type, text, seed, updates, stop):
+    """
+    Do one climb from a random start, in a worker process for
+    parallel_hill_climb. Every time the score improves, (seed, score) is put on
+    the `updates` queue. The climb is abandoned early if `stop` is set.
+
+    Returns the final score and state.
+    """
+    random.seed(seed)
+    # the climbers are chatty, which is just noise coming from lots of workers
+    with open(os.devnull, "w", encoding="utf-8") as devnull, \
+            contextlib.redirect_stdout(devnull), \
+            contextlib.redirect_stderr(devnull):
+        climber = climber_type(text)
+        updates.put((seed, climber.best_score))
+        while not stop.is_set() and climber.hill_climb_iteration():
+            updates.put((seed, climber.best_score))
+    return climber.best_score, climber.get_state()
+
+
+def parallel_hill_climb(climber_type, text, restarts, processes=None,
+                        solved_score=None, seed=None):
+    """
+    Do `restarts` independent climbs with a HillClimber subclass, spread over
+    a pool of `processes` processes (by default one per CPU), each seeded
+    differently.
+
+    Scores are reported as the workers improve. If `solved_score` is given,
+    then as soon as any worker gets a score at least that good, the rest are
+    told to stop (climbs which haven't started yet are cancelled, and those in
+    progress finish their current iteration and report what they have).
+
+    Returns the best (score, state) found.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    best_score, best_state = math.inf, None
+    with multiprocessing.Manager() as manager, \
+            concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        updates = manager.Queue()
+        stop = manager.Event()
+        remaining = {executor.submit(climb_worker, climber_type, text,
+                                     seed + i, updates, stop)
+                     for i in range(restarts)}
+        while remaining:
+            done, remaining = concurrent.futures.wait(
+                    remaining, timeout=0.1,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+            while True:
+                try:
+                    worker_seed, score = updates.get_nowait()
+                except queue.Empty:
+                    break
+                print("worker {}: score {:.0f}".format(worker_seed, score))
+                if (solved_score is not None and score <= solved_score
+                        and not stop.is_set()):
+                    print("solved, stopping workers")
+                    stop.set()
+                    for future in remaining:
+                        future.cancel()
+            for future in done:
+                if future.cancelled():
+                    continue
+                score, state = future.result()
+                if score < best_score:
+                    best_score, best_state = score, state
+    return best_score, best_state
+
+
 if __name__ == "__main__":
     from metric import BEE_MOVIE
     from util import permutation_from_key, strip_punc, file_chars
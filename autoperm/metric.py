@@ -6,6 +6,7 @@ Computing metrics on text
 
 import random
 import string
+import functools
 import collections
 
 from math import inf
@@ -15,8 +16,30 @@ from util import strip_punc
 
 # avoids problems where CWD is not the directory the source file is in
 BEE_MOVIE_PATH = Path(__file__).parent / ".." / "texts" / "beemovie.txt"
-with BEE_MOVIE_PATH.open("r") as bee_file:
-    BEE_MOVIE = bee_file.read()
+# the bee movie script itself. This is only annotated, not assigned, so that
+# the module __getattr__ below can load it the first time it's used (and so
+# that linters know it's there)
+BEE_MOVIE: str
+
+
+@functools.lru_cache(maxsize=None)
+def load_bee_movie():
+    """
+    Read the bee movie script. This only happens the first time it's needed, so
+    that importing this module doesn't go reading files.
+    """
+    with BEE_MOVIE_PATH.open("r") as bee_file:
+        return bee_file.read()
+
+
+def __getattr__(name):
+    """
+    Make BEE_MOVIE a lazily loaded module attribute (see PEP 562).
+    """
+    if name == "BEE_MOVIE":
+        return load_bee_movie()
+    raise AttributeError("module {!r} has no attribute {!r}"
+            .format(__name__, name))
 
 
 def blind_distribution(dist):
@@ -53,6 +76,26 @@ ENGLISH_FREQUENCIES = normalise(
 SORTED_ENGLISH_FREQUENCIES = blind_distribution(ENGLISH_FREQUENCIES)
 
 
+@functools.lru_cache(maxsize=None)
+def english_bigram_frequencies():
+    """
+    Normalised frequencies of bigrams in English, as a 26 x 26 list of lists
+    indexed by letters (A = 0, ..., Z = 25), so that the frequency of "TH" is
+    english_bigram_frequencies()[19][7].
+
+    These are estimated from the bee movie script (with punctuation stripped,
+    so bigrams run across word boundaries, as they do in ciphertext), which is
+    only read the first time this is called.
+    """
+    letters = [ord(c) - 0x41 for c in strip_punc(load_bee_movie())
+               if "A" <= c <= "Z"]
+    counts = [[0] * 26 for _ in range(26)]
+    for a, b in zip(letters, letters[1:]):
+        counts[a][b] += 1
+    total = sum(map(sum, counts))
+    return [[count / total for count in row] for row in counts]
+
+
 def chi_squared(observed_dist, expected_dist):
     """
     Chi-squared test for similarity between two normalised distributions.
@@ -112,7 +155,7 @@ class Metric:
 
         Namely, the bee movie script.
         """
-        return self(BEE_MOVIE)
+        return self(load_bee_movie())
 
 
 @Metric
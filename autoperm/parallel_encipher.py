@@ -0,0 +1,114 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Encrypting one big text on more than one core.
+
+It looks like autoperm encryption has to be done in order, as each pair is
+enciphered with the sigma and tau left by all of the pairs before. But when
+encrypting, the plaintext is known up front, and after pairs (a_0 b_0), ...,
+(a_{n-1} b_{n-1}) the state is just
+
+    sigma_n = sigma_0 (a_0 b_0) (a_1 b_1) ... (a_{n-1} b_{n-1})
+
+(and the same for tau), which doesn't depend on sigma_0 at all apart from the
+sigma_0 on the front. Composition is associative, so the text can be split into
+segments, and the product of each segment's transpositions can be worked out
+on its own, in parallel. Going through these products in order (which is
+cheap, they're just permutations of the alphabet) gives the sigma and tau at
+the start of every segment, and then all the segments can be encrypted in
+parallel too. The ciphertext is exactly the same as autoperm_encipher's.
+
+Working out the products costs about half as much again as encrypting, so this
+needs a few cores to be worth it.
+"""
+
+import os
+import itertools
+import collections
+import concurrent.futures
+
+from perm import Perm
+from cipher_streamer import CipherStreamer
+from autoperm_engine import AutopermEngine
+
+# Number of letters in each segment (has to be even)
+SEGMENT_SIZE = 2 ** 18
+
+
+def transposition_product(segment):
+    """
+    Work out the product (a_0 b_0) (a_1 b_1) ... of the transpositions of the
+    pairs of letters in a segment, as a Perm. An odd letter at the end is
+    ignored, as it doesn't change the state.
+    """
+    product = {}
+    pairs = iter(segment)
+    for a, b in zip(pairs, pairs):
+        # product <- product (a b), which swaps where a and b go
+        product[a], product[b] = product.get(b, b), product.get(a, a)
+    return Perm(product)
+
+
+def encipher_segment(job):
+    """
+    Encipher a segment starting from a given sigma and tau, returning the
+    ciphertext as a string. `job` is a tuple (segment, sigma, tau).
+    """
+    segment, sigma, tau = job
+    return "".join(AutopermEngine(sigma, tau).encipher(segment))
+
+
+def segments(plaintext, segment_size=SEGMENT_SIZE):
+    """
+    Split an iterable of letters up into strings of segment_size letters
+    """
+    plaintext = iter(plaintext)
+    while True:
+        segment = "".join(itertools.islice(plaintext, segment_size))
+        if not segment:
+            return
+        yield segment
+
+
+@CipherStreamer
+def parallel_encipher(plaintext, sigma, tau, processes=None,
+                      segment_size=SEGMENT_SIZE):
+    """
+    Same as autoperm_encipher, but spreads the work over a pool of processes.
+
+    This works as a pipeline, so memory use stays bounded however big the text
+    is: segments are read in and their products worked out a few at a time,
+    and as soon as the product of every segment before one is known, that
+    segment is sent off to be encrypted.
+    """
+    if segment_size % 2:
+        raise ValueError("segment_size should be even")
+    max_in_flight = 2 * (processes or os.cpu_count())
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        # segments waiting for everything before them to be done, with their
+        # products
+        waiting = collections.deque()
+        # ciphertexts of segments, in order
+        in_flight = collections.deque()
+
+        def start_next():
+            nonlocal sigma, tau
+            segment, product = waiting.popleft()
+            in_flight.append(executor.submit(
+                    encipher_segment, (segment, sigma, tau)))
+            product = product.result()
+            sigma = sigma * product
+            tau = tau * product
+
+        for segment in segments(plaintext, segment_size):
+            waiting.append((segment, executor.submit(
+                    transposition_product, segment)))
+            if len(waiting) > max_in_flight:
+                start_next()
+            while len(in_flight) > max_in_flight or (
+                    in_flight and in_flight[0].done()):
+                yield from in_flight.popleft().result()
+        while waiting:
+            start_next()
+        while in_flight:
+            yield from in_flight.popleft().result()
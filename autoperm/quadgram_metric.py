@@ -6,18 +6,70 @@ A metric scoring text based on expected quadgram frequency.
 This is a separate file because it loads a pretty considerable amount of data.
 """
 
+import abc
+import math
+import functools
 import collections
 import itertools
 
 from pathlib import Path
 
+# NumPy is optional. If it's there, scoring is done with one big vectorised
+# gather, otherwise we fall back to doing it in pure Python.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 import metric
 
-# this reads a huge array of floats from quadgrams.dat. They're indexed by
-# treating the quadgrams like base-26 integers.
+from quadgram_table import TableFormatError, load_table
+
+# The table of quadgram scores, indexed by treating the quadgrams like base-26
+# integers. If there's a binary version of the table (see quadgram_table.py)
+# it's mmapped, otherwise (or if it can't be read) we fall back to reading a
+# huge array of floats from quadgrams.dat.
 QUADGRAMS_PATH = Path(__file__).parent / ".." / "data" / "quadgrams.dat"
-with QUADGRAMS_PATH.open("r") as quadgram_file:
-    QUADGRAM_FREQUENCIES = list(map(float, quadgram_file))
+QUADGRAMS_BINARY_PATH = QUADGRAMS_PATH.with_suffix(".bin")
+
+# Returned by quadgram_score when scoring is abandoned because it went over the
+# bound. It's worse than any real score, so it can just be compared as usual.
+BOUND_EXCEEDED = math.inf
+
+
+@functools.lru_cache(maxsize=None)
+def load_quadgrams():
+    """
+    Load the quadgram table, the first time it's needed. Returns a pair
+    (frequencies, array), where `frequencies` can be indexed to get Python
+    floats and `array` is the same table as a NumPy array (or None without
+    NumPy).
+    """
+    if QUADGRAMS_BINARY_PATH.exists():
+        try:
+            return load_table(QUADGRAMS_BINARY_PATH)
+        except TableFormatError:
+            # a broken binary table (say it was only half written) is no
+            # reason not to use the text one
+            pass
+    with QUADGRAMS_PATH.open("r") as quadgram_file:
+        frequencies = list(map(float, quadgram_file))
+    if numpy is None:
+        return frequencies, None
+    return frequencies, numpy.array(frequencies, dtype=numpy.float64)
+
+
+def __getattr__(name):
+    """
+    Make QUADGRAM_FREQUENCIES and QUADGRAM_ARRAY lazily loaded module
+    attributes (see PEP 562).
+    """
+    if name == "QUADGRAM_FREQUENCIES":
+        return load_quadgrams()[0]
+    if name == "QUADGRAM_ARRAY":
+        return load_quadgrams()[1]
+    raise AttributeError("module {!r} has no attribute {!r}"
+            .format(__name__, name))
 
 
 def rolling_slice(iterable, n):
@@ -43,7 +95,7 @@ def get_quadgram_score(quadgram):
     This function does no kind of validation at all, as it is likely to be used
     in some tight loops.
     """
-    return QUADGRAM_FREQUENCIES[
+    return load_quadgrams()[0][
             sum(r * 26 ** (3 - i) for i, r in enumerate(quadgram))]
 
 
@@ -55,8 +107,128 @@ def letters_to_integers(text):
     return (ord(c) - 0x41 for c in text)
 
 
+def letters_to_array(text):
+    """
+    Encode a string of uppercase letters as a NumPy array of integers
+    (A = 0, ..., Z = 25), with dtype uint8.
+
+    Returns None if NumPy isn't available, or if the text has anything in it
+    other than A-Z, in which case the caller should do things the slow way.
+    """
+    if numpy is None:
+        return None
+    try:
+        encoded = text.encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    # subtracting in uint8 wraps anything below "A" round to >= 0xc0, so one
+    # comparison catches everything out of range
+    letters = numpy.frombuffer(encoded, dtype=numpy.uint8) - 0x41
+    if letters.size and letters.max() > 25:
+        return None
+    return letters
+
+
+def quadgram_indices(letters):
+    """
+    Get the index into the quadgram table of every quadgram in an array of
+    letters as produced by letters_to_array, as an array of integers.
+    """
+    letters = letters.astype(numpy.intp)
+    return (letters[:-3] * 17576 + letters[1:-2] * 676
+            + letters[2:-1] * 26 + letters[3:])
+
+
+def batch_quadgram_score(letters, batch_size=2 ** 21):
+    """
+    Score every row of a (K, n) NumPy array of letters (A = 0, ..., Z = 25),
+    such as the plaintexts from autoperm_engine.batch_decipher, returning an
+    array of K scores. Rows are done in batches of about `batch_size` letters,
+    to keep the temporary index arrays a sensible size.
+    """
+    frequencies = load_quadgrams()[1]
+    count, length = letters.shape
+    scores = numpy.zeros(count, dtype=numpy.float64)
+    if length < 4:
+        return scores
+    step = max(batch_size // length, 1)
+    for start in range(0, count, step):
+        batch = letters[start:start + step].astype(numpy.intp)
+        indices = (batch[:, :-3] * 17576 + batch[:, 1:-2] * 676
+                   + batch[:, 2:-1] * 26 + batch[:, 3:])
+        scores[start:start + step] = frequencies[indices].sum(
+                axis=1, dtype=numpy.float64)
+    return scores
+
+
+def python_quadgram_score(text, bound=None):
+    """
+    Pure Python implementation of quadgram_score
+    """
+    quadgrams = rolling_slice(letters_to_integers(text), 4)
+    if bound is None:
+        return sum(get_quadgram_score(quadgram) for quadgram in quadgrams)
+    total = 0
+    for quadgram in quadgrams:
+        total += get_quadgram_score(quadgram)
+        if total > bound:
+            return BOUND_EXCEEDED
+    return total
+
+
+def numpy_quadgram_score(text, bound=None, chunk_size=4096):
+    """
+    Vectorised implementation of quadgram_score: the text is encoded in one go,
+    and then all of the quadgrams are looked up in a single gather.
+
+    If there's a bound, the text is instead consumed and scored `chunk_size`
+    letters at a time, so that we can give up as soon as the bound is passed
+    without reading the rest of the text.
+
+    Falls back to python_quadgram_score for text with characters outside A-Z,
+    so that the results always agree.
+    """
+    if bound is not None:
+        return chunked_numpy_quadgram_score(text, bound, chunk_size)
+    text = "".join(text)
+    letters = letters_to_array(text)
+    if letters is None:
+        return python_quadgram_score(text)
+    if letters.size < 4:
+        return 0
+    return float(load_quadgrams()[1][quadgram_indices(letters)].sum(
+            dtype=numpy.float64))
+
+
+def chunked_numpy_quadgram_score(text, bound, chunk_size):
+    """
+    Bounded version of numpy_quadgram_score, see there.
+    """
+    frequencies = load_quadgrams()[1]
+    text = iter(text)
+    total = 0
+    # each chunk starts with the last three letters of the previous one, so
+    # that the quadgrams straddling the boundary are counted exactly once
+    tail = ""
+    while True:
+        block = tail + "".join(itertools.islice(text, chunk_size))
+        if len(block) == len(tail):
+            return total
+        letters = letters_to_array(block)
+        if letters is None:
+            rest = python_quadgram_score(itertools.chain(block, text),
+                                         bound - total)
+            return total + rest
+        if letters.size >= 4:
+            total += float(frequencies[quadgram_indices(letters)].sum(
+                    dtype=numpy.float64))
+            if total > bound:
+                return BOUND_EXCEEDED
+        tail = block[-3:]
+
+
 @metric.Metric
-def quadgram_score(text):
+def quadgram_score(text, bound=None):
     """
     A metric scoring text based on expected quadgram frequency.
 
@@ -71,15 +243,296 @@ def quadgram_score(text):
     by dividing by the length. But I haven't thought about that. And in any case
     I have no idea what the scale of the frequencies in the dataset is supposed
     to be.
+
+    If `bound` is given, scoring stops as soon as the running total goes over
+    it, and BOUND_EXCEEDED is returned. Every quadgram's score is positive, so
+    the total could only have got bigger. This is handy when all you want to
+    know is whether some text beats the best score so far, as most of the time
+    it doesn't.
+
+    This uses NumPy if it's available, and pure Python otherwise.
     """
-    return sum(get_quadgram_score(quadgram)
-            for quadgram in rolling_slice(letters_to_integers(text), 4))
+    if numpy is None:
+        return python_quadgram_score(text, bound)
+    return numpy_quadgram_score(text, bound)
+
 
+def quadgram_histogram(text):
+    """
+    Count the quadgrams in some text of uppercase letters. Returns a pair
+    (quadgrams, counts) of lists, where quadgrams[i] is a tuple of four
+    integers (A = 0, ..., Z = 25) which occurs counts[i] times.
+
+    Under a simple substitution every occurrence of a ciphertext quadgram maps
+    to the same plaintext quadgram, so a key can be scored from just this,
+    without going through the whole text again.
+    """
+    histogram = collections.Counter(
+            map(tuple, rolling_slice(letters_to_integers(text), 4)))
+    return list(histogram.keys()), list(histogram.values())
+
+
+class SwapScorer(abc.ABC):
+    """
+    Mixin for scorers which try out swaps of a substitution key with
+    propose_swap(a, b), remembering the last one in `pending` until it's kept
+    with commit or thrown away with rollback. This gives them rollback, and
+    score_swaps for scoring lots of swaps in one go.
+    """
+    __slots__ = "pending",
+
+    def __init__(self):
+        self.pending = None
+
+    @abc.abstractmethod
+    def propose_swap(self, a, b):
+        """
+        Get the score if the letters a and b (A = 0, ..., Z = 25) swapped what
+        they map to, remembering the swap in `pending`
+        """
+
+    def rollback(self):
+        """
+        Forget the last proposed swap
+        """
+        self.pending = None
+
+    def score_swaps(self, swaps):
+        """
+        Get the score for each of a sequence of swaps (a, b) of the current
+        key, as a list. This doesn't change the current key.
+        """
+        scores = [self.propose_swap(a, b) for a, b in swaps]
+        self.rollback()
+        return scores
+
+
+class IncrementalQuadgramScorer(SwapScorer):
+    """
+    Keeps track of the quadgram score of a text under a substitution key.
+
+    This works with the histogram of quadgrams in the text (see
+    quadgram_histogram), so scoring a key costs time proportional to the number
+    of distinct quadgrams, not to the length of the text. On top of that, the
+    score after swapping what two letters map to can be found by only
+    re-scoring the quadgrams containing those two letters.
+
+    A swap is tried out with propose_swap, after which it can either be kept
+    with commit or thrown away with rollback (proposing another swap also
+    throws the last one away). Any other key can be scored with score_key.
+
+    This is the pure Python implementation - see incremental_quadgram_scorer
+    for a function which picks the fastest one available.
+    """
+    __slots__ = "quadgrams", "counts", "key", "positions", "scores", "score"
+
+    def __init__(self, text, key):
+        """
+        `text` should be a string of uppercase letters A-Z, and `key` maps them
+        to the letters they stand for (eg it could be a Perm).
+        """
+        self.quadgrams, self.counts = quadgram_histogram(text)
+        self.key = self.key_to_integers(key)
+        # for each letter, the (distinct) quadgrams it appears in
+        self.positions = [set() for _ in range(26)]
+        for i, quadgram in enumerate(self.quadgrams):
+            for letter in quadgram:
+                self.positions[letter].add(i)
+        self.scores = self.weighted_scores(self.key, range(len(self.counts)))
+        self.score = sum(self.scores)
+        super().__init__()
+
+    @staticmethod
+    def key_to_integers(key):
+        """
+        Convert a key mapping letters to letters into a list mapping integers
+        to integers (A = 0, ..., Z = 25)
+        """
+        return [ord(key[chr(0x41 + c)]) - 0x41 for c in range(26)]
+
+    def weighted_scores(self, key, indices):
+        """
+        The score of each of the given distinct quadgrams under some key
+        (as a list of integers), multiplied by how many times it occurs.
+        """
+        frequencies = load_quadgrams()[0]
+        quadgrams = self.quadgrams
+        counts = self.counts
+        return [counts[i] * frequencies[((key[a] * 26 + key[b]) * 26
+                                         + key[c]) * 26 + key[d]]
+                for i, (a, b, c, d) in ((i, quadgrams[i]) for i in indices)]
+
+    def score_key(self, key):
+        """
+        Score the text under any key (mapping letters to letters)
+        """
+        return sum(self.weighted_scores(self.key_to_integers(key),
+                                        range(len(self.counts))))
+
+    def propose_swap(self, a, b):
+        """
+        Get the score of the text if the letters a and b (A = 0, ..., Z = 25)
+        swapped what they map to. This is remembered until the next call to
+        commit or rollback.
+        """
+        key = self.key[:]
+        key[a], key[b] = key[b], key[a]
+        windows = list(self.positions[a] | self.positions[b])
+        scores = self.scores
+        new_scores = self.weighted_scores(key, windows)
+        score = self.score + sum(new_scores) - sum(scores[i] for i in windows)
+        self.pending = a, b, windows, new_scores, score
+        return score
+
+    def commit(self):
+        """
+        Keep the last proposed swap
+        """
+        a, b, windows, new_scores, _ = self.pending
+        key = self.key
+        key[a], key[b] = key[b], key[a]
+        scores = self.scores
+        for i, score in zip(windows, new_scores):
+            scores[i] = score
+        # recompute from scratch rather than trusting the running total, so
+        # that rounding errors don't pile up over a long climb
+        self.score = sum(scores)
+        self.pending = None
+
+
+class NumpyIncrementalQuadgramScorer(IncrementalQuadgramScorer):
+    """
+    Vectorised implementation of IncrementalQuadgramScorer. The quadgrams
+    affected by a swap are found and re-scored with a handful of NumPy
+    operations, rather than a loop over each of them.
+    """
+    __slots__ = "masks",
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, text, key):
+        """
+        `text` should be a string of uppercase letters A-Z, and `key` maps them
+        to the letters they stand for (eg it could be a Perm).
+        """
+        letters = letters_to_array(text)
+        indices, counts = numpy.unique(
+                quadgram_indices(letters) if letters.size >= 4
+                    else numpy.zeros(0, dtype=numpy.intp),
+                return_counts=True)
+        # unpick the base-26 indices back into columns of letters
+        self.quadgrams = numpy.stack(
+                [indices // 26 ** (3 - i) % 26 for i in range(4)], axis=1)
+        self.counts = counts.astype(numpy.float64)
+        self.key = numpy.array(self.key_to_integers(key), dtype=numpy.intp)
+        # a bitmask of the letters in each quadgram, which is how we tell which
+        # quadgrams contain a given letter
+        self.masks = numpy.zeros(len(indices), dtype=numpy.uint32)
+        for column in self.quadgrams.T:
+            self.masks |= numpy.left_shift(numpy.uint32(1),
+                                           column.astype(numpy.uint32))
+        self.positions = [
+                numpy.flatnonzero(self.contains(self.masks, letter))
+                for letter in range(26)]
+        self.scores = self.weighted_scores(self.key, slice(None))
+        self.score = float(self.scores.sum())
+        self.pending = None
+
+    @staticmethod
+    def contains(masks, letter):
+        """
+        Boolean array saying which of the bitmasks include a letter
+        """
+        return (masks >> numpy.uint32(letter)) & numpy.uint32(1) != 0
+
+    def weighted_scores(self, key, indices):
+        """
+        The score of each of the given distinct quadgrams under some key
+        (as an array of integers), multiplied by how many times it occurs.
+        """
+        quadgrams = key[self.quadgrams[indices]]
+        return self.counts[indices] * load_quadgrams()[1][
+                ((quadgrams[:, 0] * 26 + quadgrams[:, 1]) * 26
+                 + quadgrams[:, 2]) * 26 + quadgrams[:, 3]]
+
+    def score_key(self, key):
+        """
+        Score the text under any key (mapping letters to letters)
+        """
+        return float(self.weighted_scores(
+                numpy.array(self.key_to_integers(key), dtype=numpy.intp),
+                slice(None)).sum())
+
+    def propose_swap(self, a, b):
+        """
+        Get the score of the text if the letters a and b (A = 0, ..., Z = 25)
+        swapped what they map to. This is remembered until the next call to
+        commit or rollback.
+        """
+        key = self.key.copy()
+        key[a], key[b] = key[b], key[a]
+        # every quadgram with an a in it, and every quadgram with a b but no a
+        # in it
+        b_windows = self.positions[b]
+        windows = numpy.concatenate((
+                self.positions[a],
+                b_windows[~self.contains(self.masks[b_windows], a)]))
+        new_scores = self.weighted_scores(key, windows)
+        score = self.score + float(new_scores.sum()
+                                   - self.scores[windows].sum())
+        self.pending = a, b, windows, new_scores, score
+        return score
+
+    def score_swaps(self, swaps, batch_size=2 ** 21):
+        """
+        Get the score for each of a sequence of swaps (a, b) of the current
+        key, as an array. This doesn't change the current key.
+
+        All of the swapped keys are applied to every distinct quadgram at once,
+        as one big fancy index, in batches of about `batch_size` quadgrams to
+        keep memory in check.
+        """
+        swaps = numpy.array(swaps, dtype=numpy.intp).reshape(-1, 2)
+        rows = numpy.arange(len(swaps))
+        keys = numpy.tile(self.key, (len(swaps), 1))
+        keys[rows, swaps[:, 0]] = self.key[swaps[:, 1]]
+        keys[rows, swaps[:, 1]] = self.key[swaps[:, 0]]
+        frequencies = load_quadgrams()[1]
+        quadgrams = self.quadgrams
+        scores = numpy.empty(len(swaps), dtype=numpy.float64)
+        step = max(batch_size // max(len(self.counts), 1), 1)
+        for start in range(0, len(swaps), step):
+            batch = keys[start:start + step]
+            indices = (((batch[:, quadgrams[:, 0]] * 26
+                         + batch[:, quadgrams[:, 1]]) * 26
+                        + batch[:, quadgrams[:, 2]]) * 26
+                       + batch[:, quadgrams[:, 3]])
+            scores[start:start + step] = frequencies[indices] @ self.counts
+        return scores
+
+    def commit(self):
+        """
+        Keep the last proposed swap
+        """
+        a, b, windows, new_scores, _ = self.pending
+        self.key[a], self.key[b] = self.key[b], self.key[a]
+        self.scores[windows] = new_scores
+        self.score = float(self.scores.sum())
+        self.pending = None
+
+
+def incremental_quadgram_scorer(text, key):
+    """
+    Make an incremental scorer for some text (see IncrementalQuadgramScorer),
+    using NumPy if it's available.
+    """
+    if letters_to_array(text) is None:
+        return IncrementalQuadgramScorer(text, key)
+    return NumpyIncrementalQuadgramScorer(text, key)
 
 if __name__ == "__main__":
     import sys
     from util import file_chars
-    print("Total frequency: {} (?)".format(sum(QUADGRAM_FREQUENCIES)))
+    print("Total frequency: {} (?)".format(sum(load_quadgrams()[0])))
     print("English: {}".format(quadgram_score.english()))
     print("Random: {}".format(quadgram_score.random()))
     if not sys.stdin.isatty():
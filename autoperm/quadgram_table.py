@@ -0,0 +1,170 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Compact binary format for n-gram score tables, like the one in quadgrams.dat.
+
+The text format stores one float per line, which takes a while to parse and
+leaves every process with its own list of half a million boxed floats. The
+binary format is just a small header followed by the raw little-endian floats,
+so it can be mmapped: every process reading the table then shares the same
+pages of the page cache, and loading it costs next to nothing.
+
+The header is laid out as follows (all little-endian):
+- 4 bytes of magic, b"NGRM"
+- 1 byte giving n (4 for quadgrams)
+- 1 byte giving the float type, b"d" (float64) or b"f" (float32)
+- 1 byte giving the length of the alphabet
+- the alphabet itself, in ASCII
+- zero padding up to a multiple of 8 bytes, so the floats are aligned
+Then there are len(alphabet) ** n floats, indexed by treating the n-grams as
+base-len(alphabet) integers.
+"""
+
+import sys
+import mmap
+import array
+import string
+import struct
+
+import argparse
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b"NGRM"
+HEADER = struct.Struct("<4sBcB")
+TYPECODES = b"d", b"f"
+ALIGNMENT = 8
+
+
+class TableFormatError(ValueError):
+    """
+    Raised when a binary table can't be read
+    """
+
+
+def header_bytes(n, typecode, alphabet):
+    """
+    Build the header for a table, including padding.
+    """
+    header = HEADER.pack(MAGIC, n, typecode, len(alphabet)) + alphabet.encode(
+            "ascii")
+    return header + bytes(-len(header) % ALIGNMENT)
+
+
+def write_table(frequencies, out_file, n=4, typecode=b"d",
+                alphabet=string.ascii_uppercase):
+    """
+    Write an iterable of floats as a binary table to a binary file object.
+    """
+    if typecode not in TYPECODES:
+        raise ValueError("typecode should be one of {}".format(TYPECODES))
+    table = array.array(typecode.decode("ascii"), frequencies)
+    if len(table) != len(alphabet) ** n:
+        raise ValueError("expected {} entries, got {}".format(
+                len(alphabet) ** n, len(table)))
+    if sys.byteorder != "little":
+        table.byteswap()
+    out_file.write(header_bytes(n, typecode, alphabet))
+    out_file.write(table.tobytes())
+
+
+def convert_text_table(text_file, out_file, n=4, typecode=b"d",
+                       alphabet=string.ascii_uppercase):
+    """
+    Convert a table in the text format (one float per line) to the binary
+    format.
+    """
+    write_table(map(float, text_file), out_file, n, typecode, alphabet)
+
+
+def parse_header(buffer):
+    """
+    Read the header of a table from a buffer. Returns n, the typecode, the
+    alphabet and the offset at which the floats start.
+    """
+    if len(buffer) < HEADER.size:
+        raise TableFormatError("table is too short to have a header")
+    magic, n, typecode, alphabet_length = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise TableFormatError("bad magic {!r}".format(magic))
+    if typecode not in TYPECODES:
+        raise TableFormatError("bad typecode {!r}".format(typecode))
+    alphabet = bytes(buffer[HEADER.size:HEADER.size + alphabet_length]).decode(
+            "ascii")
+    offset = HEADER.size + alphabet_length
+    offset += -offset % ALIGNMENT
+    expected = offset + alphabet_length ** n * struct.calcsize(
+            typecode.decode("ascii"))
+    if len(buffer) != expected:
+        raise TableFormatError("expected {} bytes, got {}".format(
+                expected, len(buffer)))
+    return n, typecode.decode("ascii"), alphabet, offset
+
+
+def load_table(path, n=4, alphabet=string.ascii_uppercase):
+    """
+    mmap a binary table, and check it's for the n-grams and alphabet you were
+    expecting.
+
+    Returns a pair (table, array): `table` supports indexing and iteration
+    producing Python floats (it's a memoryview of the mmap), and `array` is a
+    NumPy array of the same memory, or None if NumPy isn't installed.
+    """
+    with open(path, "rb") as table_file:
+        try:
+            mapped = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as exc:
+            # can't mmap an empty file
+            raise TableFormatError("table is empty") from exc
+    table_n, typecode, table_alphabet, offset = parse_header(mapped)
+    if (table_n, table_alphabet) != (n, alphabet):
+        raise TableFormatError(
+                "table is for {}-grams over {!r}, expected {}-grams over {!r}"
+                    .format(table_n, table_alphabet, n, alphabet))
+    if sys.byteorder == "little":
+        table = memoryview(mapped)[offset:].cast(typecode)
+    else:
+        # the memoryview would be in the wrong byte order, so make a copy
+        table = array.array(typecode, mapped[offset:])
+        table.byteswap()
+    if numpy is None:
+        return table, None
+    return table, numpy.frombuffer(mapped, dtype="<f{}".format(
+            struct.calcsize(typecode)), offset=offset)
+
+
+def get_args():
+    """
+    Parse argv
+    """
+    parser = argparse.ArgumentParser(
+            description="Convert a text n-gram table to the binary format",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+            "in_file", type=argparse.FileType("r"),
+            help="Text table, with one float per line")
+    parser.add_argument(
+            "out_file", type=argparse.FileType("wb"),
+            help="Binary table to write")
+    parser.add_argument(
+            "-n", type=int, default=4, help="Length of the n-grams")
+    parser.add_argument(
+            "-f", "--float32", action="store_true",
+            help="Store float32 instead of float64 (half the size)")
+    return parser.parse_args()
+
+
+def main(args):
+    """
+    Main function
+    """
+    with args.in_file, args.out_file:
+        convert_text_table(args.in_file, args.out_file, args.n,
+                           b"f" if args.float32 else b"d")
+
+
+if __name__ == "__main__":
+    main(get_args())
@@ -0,0 +1,102 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Simulated annealing, using the same state interface as the hill climbers in
+hill_climbing.py.
+
+Hill climbing only ever accepts improvements, so to know it's finished it has
+to try every single neighbour of the current state, and it tends to get stuck
+in local optima. Annealing instead tries one random neighbour per step, and
+sometimes accepts a worse one, with a probability that shrinks as the
+temperature is lowered according to some cooling schedule.
+"""
+
+import sys
+import math
+import random
+
+
+def exponential_schedule(start=10, end=0.1):
+    """
+    Cooling schedule which decays geometrically from `start` to `end`.
+
+    A cooling schedule is a function taking the current step and the total
+    number of steps, and returning a temperature. Temperatures are in the same
+    units as scores, so sensible values depend on the metric and on the length
+    of the text.
+    """
+    def schedule(step, steps):
+        return start * (end / start) ** (step / steps)
+    return schedule
+
+
+def linear_schedule(start=10, end=0.1):
+    """
+    Cooling schedule which decreases linearly from `start` to `end`.
+    """
+    def schedule(step, steps):
+        return start + (end - start) * step / steps
+    return schedule
+
+
+class SimulatedAnnealer:
+    """
+    Anneals the state of a HillClimber. The climber supplies the states (via
+    get_state, set_state, random_neighbour and get_score), and keeps its
+    current state and best_score up to date, so you can for instance anneal
+    for a while and then finish off with climber.hill_climb().
+    """
+    __slots__ = "climber", "schedule", "steps"
+
+    def __init__(self, climber, schedule=None, steps=100000):
+        """
+        `climber` is a HillClimber, `schedule` a cooling schedule (by default
+        exponential_schedule()) and `steps` the number of neighbours to try.
+        """
+        self.climber = climber
+        self.schedule = exponential_schedule() if schedule is None else schedule
+        self.steps = steps
+
+    def anneal(self):
+        """
+        Run the annealing. At the end the climber is left in the best state
+        seen, which is returned along with its score.
+        """
+        climber = self.climber
+        score = best_score = climber.best_score
+        best_state = climber.get_state()
+        for step in range(self.steps):
+            temperature = self.schedule(step, self.steps)
+            neighbour = climber.random_neighbour()
+            climber.total_keys_tried += 1
+            new_score = climber.get_score(neighbour)
+            # always go downhill, and sometimes go uphill
+            if (new_score < score or temperature > 0 and random.random()
+                    < math.exp((score - new_score) / temperature)):
+                climber.set_state(neighbour)
+                score = new_score
+                if score < best_score:
+                    best_score, best_state = score, climber.get_state()
+            if step % climber.update_interval == 0:
+                print("\rstep {}, temperature {:.2f}, score {:.0f}".format(
+                        step, temperature, score), end="", file=sys.stderr)
+        print("\n", end="", file=sys.stderr)
+        climber.set_state(best_state)
+        climber.best_score = best_score
+        return best_score, best_state
+
+
+if __name__ == "__main__":
+    from hill_climbing import SubstitutionHillClimber
+    from metric import BEE_MOVIE
+    from util import permutation_from_key, strip_punc, file_chars
+    from substitution import substitution
+    if sys.stdin.isatty():
+        plaintext = "".join(strip_punc(BEE_MOVIE))
+        key = permutation_from_key("linustorvalds")
+        ciphertext = "".join(substitution.func(plaintext, key))
+    else:
+        ciphertext = "".join(strip_punc(file_chars(sys.stdin)))
+    hill_climber = SubstitutionHillClimber(ciphertext, 1000)
+    SimulatedAnnealer(hill_climber, steps=20000).anneal()
+    hill_climber.format_state()
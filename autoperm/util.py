@@ -6,20 +6,45 @@ files.
 """
 
 import string
+import functools
+import itertools
 import collections
 
 # I think it's fine to import from perm because perm is a very stand-alone sort
 # of module
 from perm import Perm
 
-def file_chars(file):
+# How much to read from a file at once
+CHUNK_SIZE = 2 ** 16
+# How much to read from a binary file at once (see ByteAutopermEngine)
+BINARY_CHUNK_SIZE = 2 ** 20
+# The biggest chunk size a container can have, as its header only has 4 bytes
+# for it (see container.py, which isn't imported by the CLI unless it's needed)
+CONTAINER_CHUNK_SIZE_MAX = 2 ** 32 - 1
+# Number of pairs between checkpoints in a checkpoint index. This lives here
+# rather than in checkpoint_index.py so the CLI can show it without importing
+# that
+INTERVAL_DEFAULT = 2 ** 16
+
+
+def file_chunks(file, chunk_size=CHUNK_SIZE):
+    """
+    Generate the contents of a file in chunks of at most `chunk_size`
+    characters, until the end of the file.
+    """
+    # file.read(0) is "" for text files and b"" for binary ones
+    return iter(functools.partial(file.read, chunk_size), file.read(0))
+
+
+def file_chars(file, chunk_size=CHUNK_SIZE):
     """
     Generate the characters in a file one by one.
 
-    This just reads the file into memory. It's not worth doing anything stupid
-    with iterators because we're dealing with tiny tiny files.
+    The file is read `chunk_size` characters at a time, so only a chunk is ever
+    in memory at once, and you can stream a file of any size (or a pipe that
+    never ends) through a cipher.
     """
-    return file.read()
+    return itertools.chain.from_iterable(file_chunks(file, chunk_size))
 
 
 # TODO: try to do something with stripping accents from Unicode characters with
@@ -33,10 +58,38 @@ def file_chars(file):
 def strip_punc(gen):
     """
     Remove all but the letters and make them uppercase
+
+    If `gen` is a string of ASCII, this is done in one go by bytes.translate,
+    rather than calling two functions per character, which is much faster. So
+    pass whole strings where you can.
     """
+    if isinstance(gen, str):
+        try:
+            encoded = gen.encode("ascii")
+        except UnicodeEncodeError:
+            pass
+        else:
+            return iter(encoded.translate(UPPERCASE_TABLE, NON_LETTERS)
+                            .decode("ascii"))
     return map(str.upper, filter(str.isalpha, gen))
 
 
+def strip_chunks(chunks):
+    """
+    strip_punc for an iterable of chunks of text (eg from file_chunks), which
+    strips each chunk in one go if it can.
+    """
+    return itertools.chain.from_iterable(map(strip_punc, chunks))
+
+
+# bytes.translate tables for strip_punc: make a-z uppercase, and delete
+# everything in ASCII that isn't a letter
+UPPERCASE_TABLE = bytes.maketrans(string.ascii_lowercase.encode("ascii"),
+                                  string.ascii_uppercase.encode("ascii"))
+NON_LETTERS = bytes(c for c in range(128)
+                    if chr(c) not in string.ascii_letters)
+
+
 def permutation_from_key(key):
     """
     Generate a low-level permutation from a key consisting of letters, by
@@ -54,13 +107,30 @@ def permutation_from_key(key):
     This function generously strips any punctuation and makes the string
     uppercase, so should be fairly robust on any input.
     """
+    return keyed_permutation("".join(strip_punc(key)), string.ascii_uppercase)
+
+
+def byte_permutation_from_key(key):
+    """
+    Like permutation_from_key, but for a permutation of all the byte values
+    0-255 (for ByteAutopermEngine). The key is a str, which is encoded as
+    UTF-8, and nothing is stripped from it.
+    """
+    return keyed_permutation(key.encode("utf-8"), range(256))
+
+
+def keyed_permutation(key, alphabet):
+    """
+    The guts of permutation_from_key, for any key (an iterable of symbols) and
+    any sorted alphabet that every symbol in the key is in.
+    """
     mapping = {}
-    alphabet = set(string.ascii_uppercase)
-    from_iterable = iter(string.ascii_uppercase)
-    # use an OrderedDict so as to retain compatibility with 3.6 spec
-    key_unique = "".join(collections.OrderedDict.fromkeys(strip_punc(key)))
+    from_iterable = iter(alphabet)
     # in case of empty key (although that's not a good idea)
-    k = 'A'
+    k = alphabet[0]
+    alphabet = set(alphabet)
+    # use an OrderedDict so as to retain compatibility with 3.6 spec
+    key_unique = collections.OrderedDict.fromkeys(key)
     for k, a in zip(key_unique, from_iterable):
         mapping[a] = k
         alphabet.remove(k)
@@ -10,14 +10,58 @@ import string
 import random
 import os
 import io
+import sys
+import tempfile
+import contextlib
+import subprocess
+
+from unittest import mock
 
 from pathlib import Path
 
 from autoperm.perm import Perm
-from autoperm.autoperm import autoperm_encipher, autoperm_decipher
+from autoperm.autoperm import (
+        autoperm_encipher, autoperm_decipher, AutopermCipher, get_args, main,
+        batch_inputs, perm_to_key, read_key_manifest)
 from autoperm.util import permutation_from_key
 
-TEXTS_DIR = Path(__file__).parent / ".." / "texts"
+REPO_DIR = Path(__file__).parent / ".."
+TEXTS_DIR = REPO_DIR / "texts"
+SOURCE_DIR = REPO_DIR / "autoperm"
+
+# How much text to pipe through the CLI in TestStreaming. This is kept fairly
+# small so that the test doesn't take forever, but memory use shouldn't depend
+# on it at all, so turn it up as far as you like.
+STREAM_SIZE = 8 * 2 ** 20
+# How much more memory (in bytes) the CLI is allowed to use to encrypt
+# STREAM_SIZE characters than to encrypt half as many. (Buffers and the
+# allocator take a few megabytes to settle down whatever the size of the input,
+# so comparing with encrypting nothing at all would be a bit unfair.)
+STREAM_MEMORY_ALLOWANCE = 2 * 2 ** 20
+# Encrypts stdin to stdout with the CLI, then writes its peak memory use in
+# bytes to stderr. This uses VmHWM rather than getrusage, as ru_maxrss can
+# include memory the test runner was using before the fork.
+STREAM_SCRIPT = """
+import sys
+import runpy
+
+sys.argv = ["autoperm", "-e", "-k", "richardstallman", "linustorvalds",
+            *sys.argv[1:]]
+runpy.run_module("autoperm", run_name="__main__")
+with open("/proc/self/status") as status:
+    for line in status:
+        if line.startswith("VmHWM:"):
+            sys.stderr.write(str(int(line.split()[1]) * 1024))
+"""
+
+
+class TrickleFile(io.StringIO):
+    """
+    A file that only ever hands out a few characters per read, so that pairs of
+    letters get split over reads.
+    """
+    def read(self, size=-1):
+        return super().read(3 if size < 0 else min(size, 3))
 
 
 class TestAutoPerm(unittest.TestCase):
@@ -41,6 +85,24 @@ class TestAutoPerm(unittest.TestCase):
         self.assertEqual(list(autoperm_decipher.func("", sigma, tau)), [])
         self.assertEqual(list(autoperm_decipher.func("B", sigma, tau)), ["A"])
 
+    def test_autoperm_cipher(self):
+        sigma = Perm.random(string.ascii_uppercase)
+        tau = Perm.random(string.ascii_uppercase)
+        for _ in range(20):
+            text = "".join(random.choices("ab, C", k=random.randrange(50)))
+            plaintext = text.upper().replace(" ", "").replace(",", "")
+            ciphertext = "".join(autoperm_encipher.func(plaintext, sigma, tau))
+            for decrypt, in_text, out_text in ((False, text, ciphertext),
+                                               (True, ciphertext, plaintext)):
+                cipher = AutopermCipher(sigma, tau, decrypt)
+                cuts = sorted(random.choices(range(len(in_text) + 1), k=5))
+                output = [cipher.update(in_text[a:b])
+                          for a, b in zip([0, *cuts], [*cuts, len(in_text)])]
+                output.append(cipher.finalize())
+                self.assertEqual("".join(output), out_text)
+                self.assertRaises(ValueError, cipher.update, "A")
+                self.assertRaises(ValueError, cipher.finalize)
+
     # this tests integrated functionality of the whole module. Probably doesn't
     # belong in a unit test suite, but oh well.
     #
@@ -74,6 +136,182 @@ class TestAutoPerm(unittest.TestCase):
         if not found_files:
             raise ValueError("test_integration did not find any files to read")
 
+    def test_binary(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        paths = [os.path.join(directory.name, name)
+                 for name in ("in", "encrypted", "decrypted")]
+        data = bytes(random.choices(range(256), k=100001))
+        with open(paths[0], "wb") as data_file:
+            data_file.write(data)
+        for action, in_path, out_path in (("-e", *paths[:2]),
+                                          ("-d", *paths[1:])):
+            with mock.patch.object(sys, "argv", [
+                    "autoperm", action, "-B", "-k", "pässword", "hunter2",
+                    in_path, out_path]):
+                main(get_args())
+        with open(paths[2], "rb") as data_file:
+            self.assertEqual(data_file.read(), data)
+        with open(paths[1], "rb") as data_file:
+            self.assertNotEqual(data_file.read(), data)
+
+    def test_bad_args(self):
+        for argv in (["-e", "-k", "a", "b", "-j", "0"],
+                     ["-e", "-k", "a", "b", "-j", "-1"]):
+            with mock.patch.object(sys, "argv", ["autoperm", *argv]), \
+                    contextlib.redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit):
+                get_args()
+
+    def test_chunk_edges(self):
+        sigma = Perm.random(string.ascii_uppercase)
+        tau = Perm.random(string.ascii_uppercase)
+        for length in 0, 1, 2, 3, 4, 99, 100:
+            text = "".join(random.choices("ab, C", k=length))
+            for func in autoperm_encipher, autoperm_decipher:
+                expected = "".join(func.func(text.upper().replace(" ", "")
+                                             .replace(",", ""), sigma, tau))
+                out_file = io.StringIO()
+                func.strip(TrickleFile(text), out_file, sigma, tau, block=0,
+                           width=0)
+                self.assertEqual(out_file.getvalue(), expected + "\n")
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.texts = {
+                "a.txt": "Never gonna give you up\n",
+                "b.txt": "Never gonna let you down!\n",
+                os.path.join("sub", "c.txt"): "Never gonna run around, and "
+                                              "desert you\n"}
+        for name, text in self.texts.items():
+            self.write(os.path.join("in", name), text)
+
+    def path(self, *parts):
+        return os.path.join(self.directory.name, *parts)
+
+    def write(self, name, text):
+        os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+        with open(self.path(name), "w") as out_file:
+            out_file.write(text)
+
+    def read(self, name):
+        with open(self.path(name)) as in_file:
+            return in_file.read()
+
+    def run_cli(self, *argv):
+        """
+        Run the CLI in batch mode, and return what it reports
+        """
+        report = io.StringIO()
+        with mock.patch.object(sys, "argv", ["autoperm", *argv]), \
+                contextlib.redirect_stdout(report):
+            main(get_args())
+        return report.getvalue()
+
+    def test_random_keys(self):
+        report = self.run_cli("-e", "-r", "-p", "-j", "2",
+                              "--batch", self.path("in"),
+                              "-o", self.path("encrypted"),
+                              "--key-manifest", self.path("keys.tsv"))
+        self.assertIn("total: 3 files", report)
+        for name in self.texts:
+            self.assertIn(name + ":", report)
+        with open(self.path("keys.tsv")) as manifest:
+            keys = read_key_manifest(manifest)
+        self.assertEqual(set(keys), set(self.texts))
+        # each file should have been encrypted with its own keys
+        for name, (sigma, tau) in keys.items():
+            out_file = io.StringIO()
+            autoperm_encipher.preserve(io.StringIO(self.texts[name]), out_file,
+                                       sigma, tau)
+            self.assertEqual(self.read(os.path.join("encrypted", name)),
+                             out_file.getvalue())
+        self.run_cli("-d", "-K", self.path("keys.tsv"), "-p",
+                     "--batch", self.path("encrypted"),
+                     "-o", self.path("decrypted"))
+        for name, text in self.texts.items():
+            self.assertEqual(self.read(os.path.join("decrypted", name)), text)
+
+    def test_manifest(self):
+        self.write("manifest.txt", "in/a.txt\n\nin/sub/c.txt\n")
+        self.run_cli("-e", "-k", "richardstallman", "linustorvalds", "-b", "5",
+                     "--batch", self.path("manifest.txt"),
+                     "-o", self.path("encrypted"))
+        sigma = permutation_from_key("richardstallman")
+        tau = permutation_from_key("linustorvalds")
+        for name in "a.txt", os.path.join("sub", "c.txt"):
+            out_file = io.StringIO()
+            autoperm_encipher.strip(io.StringIO(self.texts[name]), out_file,
+                                    sigma, tau, block=5)
+            self.assertEqual(
+                    self.read(os.path.join("encrypted", "in", name)),
+                    out_file.getvalue())
+        self.assertFalse(os.path.exists(
+                self.path("encrypted", "in", "b.txt")))
+
+    def test_out_dir_in_source(self):
+        self.write("manifest.txt", "in/a.txt\n")
+        for source, out_dir in ((self.path("in"), self.path("in")),
+                                (self.path("in"), self.path("in", "sub")),
+                                (self.path("in"), self.path("in", "..", "in")),
+                                (self.path("manifest.txt"), self.path())):
+            with mock.patch.object(sys, "argv", [
+                    "autoperm", "-e", "-k", "a", "b", "--batch", source,
+                    "-o", out_dir]), \
+                    contextlib.redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit):
+                get_args()
+        self.assertEqual(self.read(os.path.join("in", "a.txt")),
+                         self.texts["a.txt"])
+
+    def test_batch_inputs(self):
+        self.assertEqual(
+                batch_inputs(self.path("in")),
+                [(self.path("in", name), name) for name in sorted(self.texts)])
+        self.write("manifest.txt", "../a.txt\n")
+        self.assertRaises(ValueError, batch_inputs, self.path("manifest.txt"))
+
+    def test_perm_to_key(self):
+        perm = Perm.random(string.ascii_uppercase)
+        self.assertEqual(permutation_from_key(perm_to_key(perm)), perm)
+
+
+@unittest.skipIf(not os.path.exists("/proc/self/status"),
+                 "can't measure peak memory use here")
+class TestStreaming(unittest.TestCase):
+    def peak_memory(self, size, *args):
+        """
+        Pipe `size` characters of text through the CLI (with any extra
+        arguments `args`), and return its peak memory use in bytes.
+        """
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+                filter(None, (str(SOURCE_DIR), env.get("PYTHONPATH"))))
+        process = subprocess.Popen(
+                [sys.executable, "-c", STREAM_SCRIPT, *args], env=env,
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE)
+        line = b"The quick brown fox jumps over the lazy dog.\n"
+        with process.stdin:
+            for _ in range(size // len(line)):
+                process.stdin.write(line)
+        with process.stderr:
+            peak = int(process.stderr.read())
+        self.assertEqual(process.wait(), 0)
+        return peak
+
+    def test_bounded_memory(self):
+        self.assertLess(self.peak_memory(STREAM_SIZE)
+                            - self.peak_memory(STREAM_SIZE // 2),
+                        STREAM_MEMORY_ALLOWANCE)
+
+    def test_bounded_memory_compare(self):
+        self.assertLess(self.peak_memory(STREAM_SIZE, "-c")
+                            - self.peak_memory(STREAM_SIZE // 2, "-c"),
+                        STREAM_MEMORY_ALLOWANCE)
 
 if __name__ == "__main__":
     unittest.main()
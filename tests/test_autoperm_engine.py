@@ -0,0 +1,150 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Unit tests for autoperm_engine.py
+"""
+
+import unittest
+
+import string
+import random
+import importlib.util
+
+from autoperm.perm import Perm
+from autoperm.cipher_streamer import chunk
+from autoperm.autoperm_engine import (
+        AutopermEngine, ByteAutopermEngine, perms_to_array, batch_decipher)
+
+
+# straight transcriptions of the specification, using Perm objects, to check
+# the engine against
+def reference_encipher(plaintext, sigma, tau):
+    for a, b in chunk(plaintext, 2):
+        if b is None:
+            yield sigma[a]
+        else:
+            yield from (sigma[a], tau[b])
+            transposition = Perm.from_cycle([a, b])
+            sigma *= transposition
+            tau *= transposition
+
+
+def reference_decipher(ciphertext, sigma, tau):
+    sigma_inverse = sigma.inverse()
+    tau_inverse = tau.inverse()
+    for a, b in chunk(ciphertext, 2):
+        if b is None:
+            yield sigma_inverse[a]
+        else:
+            a_plain = sigma_inverse[a]
+            b_plain = tau_inverse[b]
+            yield from (a_plain, b_plain)
+            transposition = Perm.from_cycle([a_plain, b_plain])
+            sigma_inverse = transposition * sigma_inverse
+            tau_inverse = transposition * tau_inverse
+
+
+class TestAutopermEngine(unittest.TestCase):
+    def random_text(self, alphabet=string.ascii_uppercase):
+        return "".join(random.choices(alphabet, k=random.randrange(200)))
+
+    def test_against_reference(self):
+        for _ in range(50):
+            sigma = Perm.random(string.ascii_uppercase)
+            tau = Perm.random(string.ascii_uppercase)
+            text = self.random_text()
+            self.assertEqual(
+                    list(AutopermEngine(sigma, tau).encipher(text)),
+                    list(reference_encipher(text, sigma, tau)))
+            self.assertEqual(
+                    list(AutopermEngine(sigma, tau).decipher(text)),
+                    list(reference_decipher(text, sigma, tau)))
+
+    def test_partial_domains(self):
+        # permutations that don't mention every letter, and text containing
+        # symbols outside of A-Z
+        sigma = Perm.from_cycle("ABCD")
+        tau = Perm.from_cycle("AB") * Perm.from_cycle([1, 2])
+        for _ in range(50):
+            text = self.random_text("ABCDEÉ12")
+            ciphertext = list(AutopermEngine(sigma, tau).encipher(text))
+            self.assertEqual(ciphertext,
+                             list(reference_encipher(text, sigma, tau)))
+            self.assertEqual(
+                    "".join(AutopermEngine(sigma, tau).decipher(ciphertext)),
+                    text)
+
+    def test_state(self):
+        sigma = Perm.random(string.ascii_uppercase)
+        tau = Perm.random(string.ascii_uppercase)
+        engine = AutopermEngine(sigma, tau)
+        self.assertEqual(engine.perms(), (sigma, tau))
+        list(engine.encipher("ABCD"))
+        self.assertEqual(engine.perms(),
+                         (sigma * Perm.from_cycle("AB") * Perm.from_cycle("CD"),
+                          tau * Perm.from_cycle("AB") * Perm.from_cycle("CD")))
+        # the inverses should be kept in step with sigma and tau
+        self.assertEqual(engine.sigma_inverse,
+                         AutopermEngine.inverse_of(engine.sigma))
+        self.assertEqual(engine.tau_inverse,
+                         AutopermEngine.inverse_of(engine.tau))
+
+    def test_split_text(self):
+        sigma = Perm.random(string.ascii_uppercase)
+        tau = Perm.random(string.ascii_uppercase)
+        text = self.random_text()
+        engine = AutopermEngine(sigma, tau)
+        self.assertEqual(
+                "".join(engine.encipher(text[:100]))
+                    + "".join(engine.encipher(text[100:])),
+                "".join(reference_encipher(text, sigma, tau)))
+
+    def test_bytes(self):
+        sigma = Perm.random(range(256))
+        tau = Perm.random(range(256))
+        for _ in range(20):
+            data = bytes(random.choices(range(256), k=random.randrange(200)))
+            ciphertext = bytes(reference_encipher(data, sigma, tau))
+            # split the data up into pieces, some of them odd lengths
+            cuts = sorted(random.choices(range(len(data) + 1), k=4))
+            for process, in_data, out_data in (("encipher", data, ciphertext),
+                                               ("decipher", ciphertext, data)):
+                engine = ByteAutopermEngine(sigma, tau)
+                output = b"".join(
+                        getattr(engine, process)(in_data[a:b])
+                        for a, b in zip([0, *cuts], [*cuts, len(data)]))
+                self.assertEqual(output, out_data)
+        # the state should go the same way as AutopermEngine's
+        engine = ByteAutopermEngine(sigma, tau)
+        engine.encipher(b"ABCD")
+        transposition = Perm.from_cycle(b"AB") * Perm.from_cycle(b"CD")
+        self.assertEqual(engine.perms(), (sigma * transposition,
+                                          tau * transposition))
+
+    @unittest.skipIf(importlib.util.find_spec("numpy") is None,
+                     "NumPy not installed")
+    def test_batch_decipher(self):
+        for length in 0, 1, 2, 7, 100, 101:
+            text = "".join(random.choices(string.ascii_uppercase, k=length))
+            sigmas = [Perm.random(string.ascii_uppercase) for _ in range(10)]
+            taus = [Perm.random(string.ascii_uppercase) for _ in range(10)]
+            plaintexts = batch_decipher(
+                    [ord(c) - 0x41 for c in text],
+                    perms_to_array(sigmas), perms_to_array(taus))
+            self.assertEqual(plaintexts.shape, (10, length))
+            for row, sigma, tau in zip(plaintexts, sigmas, taus):
+                self.assertEqual(
+                        "".join(chr(c + 0x41) for c in row),
+                        "".join(AutopermEngine(sigma, tau).decipher(text)))
+
+    @unittest.skipIf(importlib.util.find_spec("numpy") is None,
+                     "NumPy not installed")
+    def test_perms_to_array(self):
+        self.assertEqual(perms_to_array([]).shape, (0, 26))
+        self.assertEqual(
+                perms_to_array([Perm.from_cycle("ABC")], "ABCD").tolist(),
+                [[1, 2, 0, 3]])
+
+
+if __name__ == "__main__":
+    unittest.main()
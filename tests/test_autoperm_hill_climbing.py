@@ -9,3 +9,28 @@ see test_hill_climbing.py
 import unittest
 
 from autoperm.autoperm_hill_climbing import AutopermHillClimber
+from autoperm.autoperm import autoperm_encipher
+from autoperm.metric import BEE_MOVIE
+from autoperm.util import strip_punc, permutation_from_key
+
+
+class TestAutopermHillClimber(unittest.TestCase):
+    def setUp(self):
+        plaintext = "".join(strip_punc(BEE_MOVIE[:1000]))
+        self.ciphertext = "".join(autoperm_encipher.func(
+                plaintext, permutation_from_key("richardstallman"),
+                permutation_from_key("linustorvalds")))
+
+    def test_score_batch(self):
+        hill_climber = AutopermHillClimber(self.ciphertext)
+        states = list(hill_climber.modify_state())[:50]
+        # small batch size, to make sure batching works
+        for batch_size in 10 ** 4, 2 ** 24:
+            scores = hill_climber.score_batch(states, batch_size)
+            self.assertEqual(len(scores), len(states))
+            for state, score in zip(states, scores):
+                self.assertAlmostEqual(score, hill_climber.get_score(state))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Unit tests for checkpoint_index.py
+"""
+
+import unittest
+
+import io
+import os
+import sys
+import string
+import random
+import tempfile
+import contextlib
+import collections
+
+from unittest import mock
+
+from autoperm.perm import Perm
+from autoperm.autoperm import (
+        autoperm_encipher, autoperm_decipher, get_args, main)
+from autoperm.checkpoint_index import (
+        checkpointed_encipher, CheckpointWriter, read_index, find_checkpoint,
+        range_decipher, parallel_decipher)
+from autoperm.util import strip_punc, permutation_from_key
+
+
+def random_text(length):
+    return "".join(random.choices(string.ascii_letters + " ,.\n'é", k=length))
+
+
+class TestCheckpointIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "ciphertext")
+        self.sigma = Perm.random(string.ascii_uppercase)
+        self.tau = Perm.random(string.ascii_uppercase)
+
+    def encrypt(self, text, interval, preserve=False, **kwargs):
+        """
+        Encrypt text to self.path, and return the index entries
+        """
+        checkpoints = collections.deque()
+        index_file = io.StringIO()
+        with open(self.path, "w") as out_file:
+            writer = CheckpointWriter(out_file, index_file, checkpoints,
+                                      interval)
+            if preserve:
+                checkpointed_encipher.preserve(
+                        io.StringIO(text), writer, self.sigma, self.tau,
+                        checkpoints, interval=interval)
+            else:
+                checkpointed_encipher.strip(
+                        io.StringIO(text), writer, self.sigma, self.tau,
+                        checkpoints, interval=interval, **kwargs)
+        return read_index(io.StringIO(index_file.getvalue()))
+
+    def plaintext(self, text):
+        return "".join(strip_punc(text))
+
+    def test_same_ciphertext(self):
+        text = random_text(1000)
+        for kwargs in {}, {"block": 0, "width": 0}, {"block": 3, "width": 7}:
+            self.encrypt(text, 5, **kwargs)
+            expected = io.StringIO()
+            autoperm_encipher.strip(io.StringIO(text), expected, self.sigma,
+                                    self.tau, **kwargs)
+            with open(self.path) as in_file:
+                self.assertEqual(in_file.read(), expected.getvalue())
+
+    def test_entries(self):
+        text = random_text(1000)
+        for preserve in False, True:
+            entries = self.encrypt(text, 7, preserve)
+            letters = len(self.plaintext(text))
+            self.assertEqual([entry["letters"] for entry in entries],
+                             list(range(0, letters, 14)))
+            # the first entry is just the keys
+            self.assertEqual(entries[0]["sigma_inverse"],
+                             [self.sigma.inverse()[s]
+                              for s in entries[0]["symbols"]])
+            # and every entry should point at the start of a letter
+            with open(self.path, "rb") as in_file:
+                ciphertext = in_file.read()
+            for entry in entries:
+                self.assertTrue(chr(ciphertext[entry["bytes"]]).isalpha())
+
+    def test_range_decipher(self):
+        text = random_text(1000)
+        plaintext = self.plaintext(text)
+        for preserve in False, True:
+            entries = self.encrypt(text, 4, preserve)
+            for start, stop in ((0, None), (0, 10), (3, 9), (8, 16), (17, 501),
+                                (len(plaintext) - 1, None),
+                                (len(plaintext), None), (500, None),
+                                (500, 10)):
+                out_file = io.StringIO()
+                # the ciphertext is read from self.path, not in_file
+                range_decipher.strip(io.StringIO(), out_file, self.path,
+                                     entries, start, stop, block=0, width=0)
+                self.assertEqual(out_file.getvalue(),
+                                 plaintext[start:stop] + "\n")
+
+    def test_multiple_letter_characters(self):
+        # ß is stripped to SS, so it's two letters in one character
+        text = "Die Straße ist groß, aber die Straßenbahn ist größer. " * 20
+        plaintext = self.plaintext(text)
+        for preserve in False, True:
+            entries = self.encrypt(text, 3, preserve)
+            self.assertEqual([entry["letters"] for entry in entries],
+                             list(range(0, len(plaintext), 6)))
+        for start, stop in (0, None), (5, 20), (101, 400):
+            out_file = io.StringIO()
+            range_decipher.strip(io.StringIO(), out_file, self.path, entries,
+                                 start, stop, block=0, width=0)
+            self.assertEqual(out_file.getvalue(), plaintext[start:stop] + "\n")
+
+    def test_empty(self):
+        entries = self.encrypt("", 5)
+        self.assertEqual(entries, [])
+        for start, stop in (0, None), (0, 5), (3, 4):
+            out_file = io.StringIO()
+            range_decipher.strip(io.StringIO(), out_file, self.path, entries,
+                                 start, stop)
+            self.assertEqual(out_file.getvalue().strip(), "")
+        out_file = io.StringIO()
+        parallel_decipher.strip(io.StringIO(), out_file, self.path, entries, 1)
+        self.assertEqual(out_file.getvalue().strip(), "")
+
+    def test_parallel_decipher(self):
+        text = random_text(2000)
+        for interval in 1, 3, 1000:
+            entries = self.encrypt(text, interval, True)
+            for preserve in False, True:
+                expected = io.StringIO()
+                out_file = io.StringIO()
+                with open(self.path) as in_file:
+                    if preserve:
+                        autoperm_decipher.preserve(in_file, expected,
+                                                   self.sigma, self.tau)
+                        in_file.seek(0)
+                        parallel_decipher.preserve(in_file, out_file,
+                                                   self.path, entries, 2)
+                    else:
+                        autoperm_decipher.strip(in_file, expected,
+                                                self.sigma, self.tau)
+                        parallel_decipher.strip(in_file, out_file, self.path,
+                                                entries, 2)
+                self.assertEqual(out_file.getvalue(), expected.getvalue())
+        self.assertEqual(out_file.getvalue(), text)
+
+    def test_keeps_pace(self):
+        text = random_text(2000)
+        entries = self.encrypt(text, 3)
+        letters = len(self.plaintext(text))
+        ciphertext = iter(range(letters))
+        output = parallel_decipher.func(ciphertext, self.path, entries, 1)
+        # only the ciphertext of the first segment should have been used up
+        next(output)
+        self.assertEqual(len(list(ciphertext)), letters - 6)
+
+    def test_bad_interval(self):
+        with self.assertRaises(ValueError):
+            self.encrypt(random_text(100), 0)
+
+    def test_find_checkpoint(self):
+        entries = [{"letters": n} for n in (0, 10, 20)]
+        for letter, expected in (0, 0), (9, 0), (10, 10), (25, 20):
+            self.assertEqual(find_checkpoint(entries, letter)["letters"],
+                             expected)
+
+    def test_cli(self):
+        text = random_text(5000)
+        plain_path = os.path.join(self.directory.name, "plaintext")
+        index_path = os.path.join(self.directory.name, "index")
+        with open(plain_path, "w") as plain_file:
+            plain_file.write(text)
+        keys = ["-k", "richardstallman", "linustorvalds"]
+
+        out_path = os.path.join(self.directory.name, "out")
+
+        def run_cli(*argv):
+            with mock.patch.object(sys, "argv", ["autoperm", *argv]):
+                main(get_args())
+            with open(argv[-1]) as out_file:
+                return out_file.read()
+
+        run_cli("-e", *keys, "-p", "--index", index_path,
+                "--checkpoint-interval", "100", plain_path, self.path)
+        with open(index_path) as index_file:
+            self.assertEqual(len(read_index(index_file)),
+                             -(-len(self.plaintext(text)) // 200))
+        # no keys needed to decrypt
+        self.assertEqual(run_cli("-d", "-p", "--index", index_path, "-j", "2",
+                                 self.path, out_path),
+                         text)
+        self.assertEqual(run_cli("-d", "--index", index_path, "-b", "0",
+                                 "-w", "0", "--range", "1234:", self.path,
+                                 out_path),
+                         self.plaintext(text)[1234:] + "\n")
+        for argv in (["-e", *keys, "--index", index_path,
+                      "--checkpoint-interval", "0"],
+                     ["-d", "--index", index_path, "--range", "500:10"],
+                     ["-d", "--index", index_path, "--range=-5:"]):
+            with mock.patch.object(sys, "argv",
+                                   ["autoperm", *argv, self.path]), \
+                    contextlib.redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit):
+                get_args()
+        self.sigma = permutation_from_key("richardstallman")
+        self.tau = permutation_from_key("linustorvalds")
+        expected = io.StringIO()
+        autoperm_encipher.preserve(io.StringIO(text), expected, self.sigma,
+                                   self.tau)
+        with open(self.path) as in_file:
+            self.assertEqual(in_file.read(), expected.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
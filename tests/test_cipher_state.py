@@ -0,0 +1,113 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Unit tests for cipher_state.py
+"""
+
+import unittest
+
+import io
+import os
+import sys
+import string
+import random
+import tempfile
+
+from unittest import mock
+
+from autoperm.perm import Perm
+from autoperm.autoperm import autoperm_encipher, get_args, main
+from autoperm.cipher_state import CipherState, state_encipher, state_decipher
+from autoperm.util import permutation_from_key
+
+
+def split_randomly(text, pieces):
+    cuts = sorted(random.choices(range(len(text) + 1), k=pieces - 1))
+    return [text[a:b] for a, b in zip([0, *cuts], [*cuts, len(text)])]
+
+
+class TestCipherState(unittest.TestCase):
+    def setUp(self):
+        self.sigma = Perm.random(string.ascii_uppercase)
+        self.tau = Perm.random(string.ascii_uppercase)
+
+    def run_pieces(self, func, pieces):
+        """
+        Run func over each piece, saving and reading back the state in
+        between, and return the outputs joined together
+        """
+        state = CipherState.from_keys(self.sigma, self.tau)
+        output = []
+        for piece in pieces:
+            output.extend(func.func(piece, state))
+            state_file = io.StringIO()
+            state.write(state_file)
+            state = CipherState.read(io.StringIO(state_file.getvalue()))
+        return "".join(output)
+
+    def test_pieces(self):
+        for _ in range(20):
+            text = "".join(random.choices(string.ascii_uppercase + "É",
+                                          k=random.randrange(100)))
+            pieces = split_randomly(text, random.randrange(1, 8))
+            ciphertext = "".join(autoperm_encipher.func(text, self.sigma,
+                                                        self.tau))
+            self.assertEqual(self.run_pieces(state_encipher, pieces),
+                             ciphertext)
+            self.assertEqual(
+                    self.run_pieces(state_decipher,
+                                    split_randomly(ciphertext, len(pieces))),
+                    text)
+
+    def test_state(self):
+        state = CipherState.from_keys(self.sigma, self.tau)
+        list(state.run("ABC", decrypt=False))
+        self.assertEqual((state.letters, state.pending), (3, "C"))
+        list(state.run("", decrypt=False))
+        self.assertEqual((state.letters, state.pending), (3, "C"))
+        list(state.run("D", decrypt=False))
+        self.assertEqual((state.letters, state.pending), (4, None))
+        transposition = Perm.from_cycle("AB") * Perm.from_cycle("CD")
+        self.assertEqual(state.engine.perms(), (self.sigma * transposition,
+                                                self.tau * transposition))
+
+    def test_cli(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        def path(name):
+            return os.path.join(directory.name, name)
+
+        def run_cli(*argv):
+            with mock.patch.object(sys, "argv", ["autoperm", *argv]):
+                main(get_args())
+            with open(argv[-1]) as out_file:
+                return out_file.read()
+
+        text = "Never gonna give you up, never gonna let you down!\n" * 20
+        ciphertext = ""
+        plaintext = ""
+        for i, piece in enumerate(split_randomly(text, 5)):
+            with open(path("log"), "w") as log_file:
+                log_file.write(piece)
+            ciphertext += run_cli("-e", "-k", "richardstallman",
+                                  "linustorvalds", "-p", "--state",
+                                  path("encrypt_state"), path("log"),
+                                  path("out"))
+            # keys are only needed the first time
+            keys = ["-k", "richardstallman", "linustorvalds"] if i == 0 else []
+            with open(path("log"), "w") as log_file:
+                log_file.write(ciphertext[len(plaintext):])
+            plaintext += run_cli("-d", *keys, "-p", "--state",
+                                 path("decrypt_state"), path("log"),
+                                 path("out"))
+        expected = io.StringIO()
+        autoperm_encipher.preserve(io.StringIO(text), expected,
+                                   permutation_from_key("richardstallman"),
+                                   permutation_from_key("linustorvalds"))
+        self.assertEqual(ciphertext, expected.getvalue())
+        self.assertEqual(plaintext, text)
+
+
+if __name__ == "__main__":
+    unittest.main()
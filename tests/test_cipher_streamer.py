@@ -8,9 +8,12 @@ import unittest
 
 import io
 import random
+import itertools
+import tracemalloc
 import textwrap as tw
 
 from autoperm.cipher_streamer import CipherStreamer, chunk, get_lines
+from autoperm.util import strip_punc
 
 
 # generators for use in TestCipherStreamer
@@ -59,6 +62,84 @@ def not_enough_exes(_):
     yield from "XXX"
 
 
+@CipherStreamer
+def to_sigmas(text):
+    for _ in text:
+        yield "\u03a3"
+
+
+# the original implementation of CipherStreamer.preserve, which the real one
+# should always agree with
+def reference_preserve(func, in_file, out_file, *args, **kwargs):
+    in_file_1, in_file_2 = itertools.tee(in_file.read())
+    output = func.func(strip_punc(in_file_1), *args, **kwargs)
+    for c in output:
+        punc = ' '
+        for punc in in_file_2:
+            if punc.isalpha():
+                break
+            out_file.write(punc)
+        if not punc.isalpha():
+            out_file.write(c)
+        elif punc.isupper():
+            out_file.write(c.upper())
+        else:
+            out_file.write(c.lower())
+    for punc in in_file_2:
+        if not punc.isalpha():
+            out_file.write(punc)
+
+
+# the original implementation of get_lines, likewise
+def reference_get_lines(iterable, block, width):
+    if block <= 0:
+        if width <= 0:
+            lines = iterable,
+        else:
+            lines = chunk(iterable, width, "")
+    else:
+        chunks = chunk(iterable, block, "")
+        chunks_spaced = map(itertools.chain.from_iterable,
+                            zip(chunks, itertools.repeat(" ")))
+        if width <= 0:
+            lines = itertools.chain.from_iterable(chunks_spaced),
+        else:
+            blocks_per_line = (width + 1) // (block + 1)
+            lines = map(itertools.chain.from_iterable,
+                        chunk(chunks_spaced, blocks_per_line, ""))
+    return ("".join(line).strip() for line in lines)
+
+
+# the original compare mode of CipherStreamer.strip, likewise
+def reference_compare(func, in_file, out_file, block, width):
+    input_chars, plaintext = itertools.tee(strip_punc(in_file.read()))
+    lines = reference_get_lines(func.func(input_chars), block, width - 2)
+    plain_lines = reference_get_lines(plaintext, block, width - 2)
+    for line, plain in itertools.zip_longest(lines, plain_lines, fillvalue=""):
+        out_file.write("i:{}\n".format(plain.upper()))
+        out_file.write("o:{}\n".format(line.upper()))
+        out_file.write("\n")
+
+
+class NullFile(io.TextIOBase):
+    """
+    A file that throws away everything written to it
+    """
+    def writable(self):
+        return True
+
+    def write(self, text):
+        return len(text)
+
+
+class TrickleFile(io.StringIO):
+    """
+    A file that only ever hands out a few characters per read
+    """
+    def read(self, size=-1):
+        return super().read(3 if size < 0 else min(size, 3))
+
+
 class TestCipherStreamer(unittest.TestCase):
     def setUp(self):
         self.preservative_generators = [
@@ -237,6 +318,23 @@ class TestCipherStreamer(unittest.TestCase):
         self.assertEqual(self.output_file.getvalue(),
                          '"Xxx (  ),   !?";')
 
+    def test_preserve_reference(self):
+        for g in [*self.generators, to_sigmas]:
+            for _ in range(20):
+                text = "".join(random.choices(
+                        "aBc \n,.1\u00e9\u00c9\u00df\u03a3\u2167",
+                        k=random.randrange(100)))
+                for file_type in io.StringIO, TrickleFile:
+                    output_file = io.StringIO()
+                    reference_file = io.StringIO()
+                    seed = random.random()
+                    random.seed(seed)
+                    g.preserve(file_type(text), output_file)
+                    random.seed(seed)
+                    reference_preserve(g, io.StringIO(text), reference_file)
+                    self.assertEqual(output_file.getvalue(),
+                                     reference_file.getvalue())
+
     # currently this is basically a rip-off of test_strip
     def test_get_lines(self):
         # these two should always return one line
@@ -264,6 +362,57 @@ class TestCipherStreamer(unittest.TestCase):
                                    block=5, width=width)),
                     self.input_blocks_lines.strip().split("\n"))
 
+    def test_get_lines_reference(self):
+        for _ in range(200):
+            # the odd space and multiple-character item too
+            chars = random.choices(["A", "B", " ", "SS"], [10, 10, 1, 1],
+                                   k=random.randrange(200))
+            block = random.randrange(-1, 8)
+            width = random.randrange(-1, 30)
+            if block > 0 and 0 < width < block:
+                self.assertRaises(ValueError, get_lines, chars, block, width)
+                continue
+            self.assertEqual(list(get_lines(iter(chars), block, width)),
+                             list(reference_get_lines(chars, block, width)))
+        # long enough to be read in several batches
+        chars = random.choices("AB", k=200000)
+        for block, width in (0, 0), (0, 7), (3, 0), (3, 13):
+            self.assertEqual(list(get_lines(iter(chars), block, width)),
+                             list(reference_get_lines(chars, block, width)))
+
+    def test_compare_reference(self):
+        for g in self.generators:
+            for _ in range(20):
+                text = "".join(random.choices("aBc ,.",
+                                              k=random.randrange(200)))
+                block = random.randrange(-1, 6)
+                width = random.choice([-1, 0, *range(max(block, 1) + 2, 30)])
+                output_file = io.StringIO()
+                reference_file = io.StringIO()
+                seed = random.random()
+                random.seed(seed)
+                g.strip(io.StringIO(text), output_file, block=block,
+                        width=width, compare=True)
+                random.seed(seed)
+                reference_compare(g, io.StringIO(text), reference_file, block,
+                                  width)
+                self.assertEqual(output_file.getvalue(),
+                                 reference_file.getvalue())
+
+    def test_compare_memory(self):
+        # whether the generator keeps up with the input or stops reading it,
+        # compare mode shouldn't hold on to much of it
+        input_file = io.StringIO(
+                "Sphinx of black quartz, judge my vow. " * 10000)
+        for g in to_exes, not_enough_exes:
+            input_file.seek(0)
+            tracemalloc.start()
+            try:
+                g.strip(input_file, NullFile(), compare=True)
+                self.assertLess(tracemalloc.get_traced_memory()[1], 2 ** 20)
+            finally:
+                tracemalloc.stop()
+
     def test_strip(self):
         # Also test the lowercase version in each case, with a nice D.R.Y loop
         for lowercase, case_func in ((True, str.lower), (False, lambda s: s)):
@@ -0,0 +1,165 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Unit tests for container.py
+"""
+
+import unittest
+
+import io
+import os
+import sys
+import random
+import tempfile
+import contextlib
+
+from unittest import mock
+
+from autoperm.perm import Perm
+from autoperm.autoperm import get_args, main
+from autoperm.autoperm_engine import ByteAutopermEngine
+from autoperm.container import (
+        HEADER, ContainerFormatError, key_material, chunk_keys,
+        write_container, read_container, read_header, read_range)
+
+
+class TrickleFile(io.BytesIO):
+    """
+    A file that only ever hands out a few bytes per read, like a pipe might
+    """
+    def read(self, size=-1):
+        return super().read(3 if size < 0 else min(size, 3))
+
+
+class NotSeekable(io.StringIO):
+    """
+    Stands in for a pipe as stdin or stdout
+    """
+    def seekable(self):
+        return False
+
+
+class TestContainer(unittest.TestCase):
+    def setUp(self):
+        self.sigma = Perm.random(range(256))
+        self.tau = Perm.random(range(256))
+
+    def encrypt(self, data, chunk_size, processes=1):
+        out_file = io.BytesIO()
+        write_container(io.BytesIO(data), out_file, self.sigma, self.tau,
+                        chunk_size, processes)
+        return out_file.getvalue()
+
+    def test_roundtrip(self):
+        for length in 0, 1, 99, 100, 101, 1000:
+            data = bytes(random.choices(range(256), k=length))
+            for processes in 1, 2:
+                container = self.encrypt(data, 100, processes)
+                self.assertEqual(len(container), HEADER.size + length)
+                self.assertEqual(read_header(io.BytesIO(container)),
+                                 (100, -(-length // 100), length))
+                out_file = io.BytesIO()
+                read_container(io.BytesIO(container), out_file, self.sigma,
+                               self.tau, processes)
+                self.assertEqual(out_file.getvalue(), data)
+
+    def test_chunks(self):
+        data = bytes(random.choices(range(256), k=250))
+        container = self.encrypt(data, 100)
+        material = key_material(self.sigma, self.tau)
+        # each chunk is just ByteAutopermEngine with its own keys
+        for index in range(3):
+            chunk_data = data[index * 100:(index + 1) * 100]
+            self.assertEqual(
+                    container[HEADER.size + index * 100:][:len(chunk_data)],
+                    ByteAutopermEngine(*chunk_keys(material, index))
+                        .encipher(chunk_data))
+        # and the keys are different for every chunk
+        self.assertNotEqual(chunk_keys(material, 0), chunk_keys(material, 1))
+        # but always the same for the same chunk
+        self.assertEqual(chunk_keys(material, 1), chunk_keys(material, 1))
+        # the output shouldn't depend on how the input comes in
+        out_file = io.BytesIO()
+        write_container(TrickleFile(data), out_file, self.sigma, self.tau,
+                        100, 1)
+        self.assertEqual(out_file.getvalue(), container)
+
+    def test_read_range(self):
+        data = bytes(random.choices(range(256), k=1000))
+        container = io.BytesIO(self.encrypt(data, 64))
+        for start, stop in ((0, None), (0, 1), (63, 65), (64, 128), (500, 999),
+                            (999, 2000), (1000, None), (5, 5), (10, 3)):
+            container.seek(0)
+            self.assertEqual(b"".join(read_range(container, self.sigma,
+                                                 self.tau, start, stop)),
+                             data[start:stop])
+        with self.assertRaises(ValueError):
+            list(read_range(container, self.sigma, self.tau, -1))
+        truncated = io.BytesIO(container.getvalue()[:-1])
+        with self.assertRaises(ContainerFormatError):
+            list(read_range(truncated, self.sigma, self.tau, 900))
+
+    def test_bad_chunk_size(self):
+        # the chunk size has to fit in 4 bytes of the header
+        for chunk_size in 0, -1, 2 ** 32:
+            with self.assertRaises(ValueError):
+                self.encrypt(b"data", chunk_size)
+        self.assertEqual(read_header(io.BytesIO(self.encrypt(
+                b"data", 2 ** 32 - 1))), (2 ** 32 - 1, 1, 4))
+
+    def test_bad_containers(self):
+        container = self.encrypt(b"hello world", 4)
+        for bad in (b"", container[:10], b"X" + container[1:],
+                    container[:-1]):
+            self.assertRaises(ContainerFormatError, read_container,
+                              io.BytesIO(bad), io.BytesIO(), self.sigma,
+                              self.tau, 1)
+
+    def test_cli(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        paths = [os.path.join(directory.name, name)
+                 for name in ("in", "container", "out")]
+        data = bytes(random.choices(range(256), k=5000))
+        with open(paths[0], "wb") as data_file:
+            data_file.write(data)
+        keys = ["-k", "pässword", "hunter2"]
+
+        def run_cli(*argv):
+            with mock.patch.object(sys, "argv", ["autoperm", *argv]):
+                main(get_args())
+            with open(argv[-1], "rb") as out_file:
+                return out_file.read()
+
+        self.assertNotEqual(
+                run_cli("-e", "-B", "--container", "--chunk-size", "1000",
+                        "-j", "2", *keys, *paths[:2]),
+                data)
+        with open(paths[1], "rb") as container:
+            self.assertEqual(read_header(container), (1000, 5, 5000))
+        self.assertEqual(run_cli("-d", "-B", "--container", *keys, *paths[1:]),
+                         data)
+        self.assertEqual(run_cli("-d", "-B", "--container", "--range",
+                                 "1999:2001", *keys, *paths[1:]),
+                         data[1999:2001])
+        # --range has to seek, and containers have to be written to something
+        # seekable
+        for argv in (["-d", "--range", "5:"], ["-e"]):
+            with mock.patch.object(sys, "argv", [
+                    "autoperm", "-B", "--container", *keys, *argv]), \
+                    mock.patch.object(sys, "stdin", NotSeekable()), \
+                    mock.patch.object(sys, "stdout", NotSeekable()), \
+                    contextlib.redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit):
+                get_args()
+        for chunk_size in "0", str(2 ** 32):
+            with mock.patch.object(sys, "argv", [
+                    "autoperm", "-e", "-B", "--container", "--chunk-size",
+                    chunk_size, *keys, *paths[:2]]), \
+                    contextlib.redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit):
+                get_args()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Unit tests for crib_solver.py
+"""
+
+import unittest
+
+import io
+import os
+import sys
+import string
+import random
+import tempfile
+import itertools
+import contextlib
+
+from unittest import mock
+
+from autoperm.perm import Perm
+from autoperm.autoperm import autoperm_encipher
+from autoperm.autoperm_engine import AutopermEngine
+from autoperm.crib_solver import (
+        read_crib, solve, solution_perms, solution_plaintext, key_table,
+        SearchBudgetExceeded, get_args, main)
+from autoperm.util import strip_punc
+from autoperm.metric import BEE_MOVIE
+
+
+class TestCribSolver(unittest.TestCase):
+    def setUp(self):
+        self.sigma = Perm.random(string.ascii_uppercase)
+        self.tau = Perm.random(string.ascii_uppercase)
+        self.plaintext = "".join(strip_punc(BEE_MOVIE[:5000]))
+        self.ciphertext = "".join(autoperm_encipher.func(
+                self.plaintext, self.sigma, self.tau))
+
+    def state_at(self, offset):
+        engine = AutopermEngine(self.sigma, self.tau)
+        list(engine.encipher(self.plaintext[:offset]))
+        return engine.perms()
+
+    def assertConsistent(self, partial, perm):
+        for a, b in partial.items():
+            self.assertEqual(perm[a], b)
+
+    def test_read_crib(self):
+        self.assertEqual(read_crib("a? b!?"), ["A", None, "B", None])
+
+    def test_full_crib(self):
+        solutions = list(solve(self.ciphertext, self.plaintext[:1000]))
+        self.assertEqual(len(solutions), 1)
+        solution, = solutions
+        self.assertEqual(solution.offset, 0)
+        self.assertEqual(solution_perms(solution), (self.sigma, self.tau))
+        self.assertEqual(solution.plaintext, self.plaintext[:1000])
+        self.assertEqual(solution_plaintext(solution, self.ciphertext),
+                         self.plaintext)
+
+    def test_short_crib(self):
+        # not enough to get the whole keys, but what there is should be right
+        solution, = solve(self.ciphertext, self.plaintext[:10])
+        self.assertConsistent(solution.sigma, self.sigma)
+        self.assertConsistent(solution.tau, self.tau)
+        self.assertIsNone(solution_perms(solution))
+        self.assertIsNone(solution_plaintext(solution, self.ciphertext))
+        table = key_table(solution.sigma).splitlines()
+        self.assertEqual(table[0].split(), list(string.ascii_uppercase))
+        self.assertEqual(
+                [b for a, b in zip(*map(str.split, table)) if b != "?"],
+                [solution.sigma[a] for a in sorted(solution.sigma)])
+
+    def test_crib_in_the_middle(self):
+        for offset in 1000, 1001:
+            crib = [None] * offset + list(self.plaintext[offset:offset + 1000])
+            solutions = list(itertools.islice(
+                    solve(self.ciphertext, crib), 30))
+            origin = offset // 2 * 2
+            sigma, tau = self.state_at(origin)
+            self.assertIn((sigma, tau), map(solution_perms, solutions))
+            for solution in solutions:
+                self.assertEqual(solution.offset, origin)
+                self.assertEqual(solution.plaintext[offset - origin:],
+                                 self.plaintext[offset:offset + 1000])
+
+    def test_unknown_letters(self):
+        crib = [None if random.random() < 0.1 else c
+                for c in self.plaintext[:2000]]
+        crib[0] = self.plaintext[0]
+        # this should take nowhere near the whole budget, but if the search
+        # goes wrong it fails rather than hanging
+        solutions = list(itertools.islice(
+                solve(self.ciphertext, crib, 10 ** 6), 100))
+        self.assertIn((self.sigma, self.tau), map(solution_perms, solutions))
+        for solution in solutions:
+            # everything that was known should have been kept
+            self.assertTrue(all(c is None or c == p
+                                for c, p in zip(crib, solution.plaintext)))
+
+    def test_budget(self):
+        # a full crib is 500 pairs, and nothing to guess
+        crib = self.plaintext[:1000]
+        solution, = solve(self.ciphertext, crib, 500)
+        self.assertEqual(solution_perms(solution), (self.sigma, self.tau))
+        with self.assertRaises(SearchBudgetExceeded):
+            list(solve(self.ciphertext, crib, 499))
+        # with only every third letter known, there's far too much guessing
+        crib = [c if i % 3 == 0 else None
+                for i, c in enumerate(self.plaintext[:1000])]
+        with self.assertRaises(SearchBudgetExceeded):
+            list(solve(self.ciphertext, crib, 10000))
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, name)
+                     for name in ("ciphertext", "crib", "out")]
+            for path, text in zip(paths, (self.ciphertext, "".join(
+                    c or "?" for c in crib))):
+                with open(path, "w") as text_file:
+                    text_file.write(text)
+            with mock.patch.object(sys, "argv", [
+                    "crib_solver", "-b", "10000", *paths]):
+                main(get_args())
+            with open(paths[2]) as out_file:
+                self.assertIn("gave up", out_file.read())
+
+    def test_contradiction(self):
+        crib = list(self.plaintext[:1000])
+        # make a letter wrong
+        crib[500] = "A" if crib[500] != "A" else "B"
+        self.assertEqual(list(solve(self.ciphertext, crib)), [])
+        self.assertEqual(list(solve(self.ciphertext, [])), [])
+
+    def test_bad_args(self):
+        for argv in ["-o", "-1"], ["-n", "0"], ["-b", "-1"]:
+            with mock.patch.object(sys, "argv", [
+                    "crib_solver", *argv, os.devnull, os.devnull]), \
+                    contextlib.redirect_stderr(io.StringIO()), \
+                    self.assertRaises(SystemExit):
+                get_args()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -9,4 +9,150 @@ somewhat stochastic code (especially when it's unfinished).
 
 import unittest
 
-from autoperm.hill_climbing import SubstitutionHillClimber
+import io
+import random
+import string
+import contextlib
+
+from math import inf
+
+from autoperm.hill_climbing import (
+        SubstitutionHillClimber, BigramScorer, BigramHillClimber,
+        parallel_hill_climb)
+from autoperm.metric import BEE_MOVIE
+from autoperm.perm import Perm
+from autoperm.util import strip_punc, permutation_from_key
+from autoperm.substitution import substitution
+from autoperm.quadgram_metric import quadgram_score
+
+
+class TestSubstitutionHillClimber(unittest.TestCase):
+    def setUp(self):
+        plaintext = "".join(strip_punc(BEE_MOVIE[:2000]))
+        self.ciphertext = "".join(substitution.func(
+                plaintext, permutation_from_key("linustorvalds")))
+
+    def climb(self, text, hill_climber_type=SubstitutionHillClimber):
+        hill_climber = hill_climber_type(text)
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            for _ in range(5):
+                hill_climber.hill_climb_iteration()
+        return hill_climber
+
+    def test_scores_consistent(self):
+        # the incrementally updated score should agree with scoring from scratch
+        hill_climber = self.climb(self.ciphertext)
+        self.assertIsNotNone(hill_climber.scorer)
+        self.assertAlmostEqual(
+                hill_climber.best_score,
+                quadgram_score.no_strip(substitution.func(
+                    self.ciphertext, hill_climber.key)))
+
+    def test_set_state(self):
+        hill_climber = SubstitutionHillClimber(self.ciphertext)
+        key = Perm.from_cycle("ABC")
+        hill_climber.set_state(key)
+        self.assertEqual(hill_climber.get_state(), key)
+        self.assertAlmostEqual(hill_climber.scorer.score,
+                               hill_climber.get_score(key))
+
+    def test_not_letters(self):
+        # falls back to scoring the whole text
+        hill_climber = self.climb(self.ciphertext[:500] + "É")
+        self.assertIsNone(hill_climber.scorer)
+
+    def test_steepest_ascent(self):
+        hill_climber = SubstitutionHillClimber(self.ciphertext)
+        states = list(hill_climber.modify_state())
+        scores = hill_climber.score_batch(states)
+        self.assertEqual(len(scores), len(states))
+        for state, score in zip(states[:10], scores):
+            self.assertAlmostEqual(score, hill_climber.get_score(state))
+        best_score = min(scores)
+        self.assertTrue(hill_climber.steepest_ascent_iteration())
+        self.assertAlmostEqual(hill_climber.best_score, best_score)
+        self.assertAlmostEqual(
+                hill_climber.best_score,
+                quadgram_score.no_strip(substitution.func(
+                    self.ciphertext, hill_climber.key)))
+
+    def test_initial_key(self):
+        hill_climber = SubstitutionHillClimber("AAAB")
+        self.assertEqual(hill_climber.key["A"], "E")
+        self.assertEqual(hill_climber.key["B"], "T")
+        self.assertTrue(hill_climber.key.is_permutation())
+        self.assertEqual(len(hill_climber.key.mapping), 26)
+
+
+class TestBigramHillClimber(unittest.TestCase):
+    def setUp(self):
+        plaintext = "".join(strip_punc(BEE_MOVIE[:5000]))
+        self.ciphertext = "".join(substitution.func(
+                plaintext, permutation_from_key("linustorvalds")))
+
+    def test_bigram_scorer(self):
+        key = Perm.random(string.ascii_uppercase)
+        scorer = BigramScorer(self.ciphertext, key)
+        self.assertAlmostEqual(scorer.score, scorer.score_key(key))
+        for _ in range(50):
+            a, b = random.sample(string.ascii_uppercase, k=2)
+            new_key = key * Perm.from_cycle([a, b])
+            score = scorer.propose_swap(ord(a) - 0x41, ord(b) - 0x41)
+            self.assertAlmostEqual(score, scorer.score_key(new_key))
+            if random.random() < 0.5:
+                scorer.commit()
+                key = new_key
+            else:
+                scorer.rollback()
+            self.assertAlmostEqual(scorer.score, scorer.score_key(key))
+        self.assertRaises(ValueError, BigramScorer, self.ciphertext,
+                          Perm({"A": "B"}))
+
+    def test_bigram_scorer_english(self):
+        # the right key should look more like English than a random one
+        scorer = BigramScorer(self.ciphertext,
+                              permutation_from_key("linustorvalds").inverse())
+        self.assertLess(scorer.score,
+                        scorer.score_key(Perm.random(string.ascii_uppercase)))
+
+    def test_climb(self):
+        hill_climber = BigramHillClimber(self.ciphertext)
+        start_score = hill_climber.best_score
+        with contextlib.redirect_stdout(io.StringIO()), \
+                contextlib.redirect_stderr(io.StringIO()):
+            hill_climber.hill_climb_iteration()
+        self.assertLess(hill_climber.best_score, start_score)
+        self.assertAlmostEqual(hill_climber.best_score,
+                               hill_climber.scorer.score_key(hill_climber.key))
+
+
+class TestParallelHillClimb(unittest.TestCase):
+    def setUp(self):
+        plaintext = "".join(strip_punc(BEE_MOVIE[:1000]))
+        self.ciphertext = "".join(substitution.func(
+                plaintext, permutation_from_key("linustorvalds")))
+
+    def test_parallel_hill_climb(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            score, key = parallel_hill_climb(
+                    SubstitutionHillClimber, self.ciphertext, restarts=3,
+                    processes=2, seed=0)
+        self.assertAlmostEqual(score, quadgram_score.no_strip(
+                substitution.func(self.ciphertext, key)))
+
+    def test_solved(self):
+        # everything counts as solved, so the workers should be stopped after
+        # their first iteration
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            score, key = parallel_hill_climb(
+                    SubstitutionHillClimber, self.ciphertext, restarts=20,
+                    processes=2, solved_score=inf)
+        self.assertIn("solved", output.getvalue())
+        self.assertIsNotNone(key)
+        self.assertLess(score, inf)
+
+
+if __name__ == "__main__":
+    unittest.main()
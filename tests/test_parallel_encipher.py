@@ -0,0 +1,55 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Unit tests for parallel_encipher.py
+"""
+
+import unittest
+
+import io
+import string
+import random
+
+from autoperm.perm import Perm
+from autoperm.autoperm import autoperm_encipher
+from autoperm.parallel_encipher import (
+        transposition_product, parallel_encipher)
+
+
+class TestParallelEncipher(unittest.TestCase):
+    def test_transposition_product(self):
+        self.assertEqual(transposition_product(""), Perm())
+        self.assertEqual(transposition_product("ABCDA"),
+                         Perm.from_cycle("AB") * Perm.from_cycle("CD"))
+        segment = "".join(random.choices(string.ascii_uppercase, k=100))
+        expected = Perm()
+        for a, b in zip(segment[::2], segment[1::2]):
+            expected *= Perm.from_cycle([a, b])
+        self.assertEqual(transposition_product(segment), expected)
+
+    def test_same_as_sequential(self):
+        sigma = Perm.random(string.ascii_uppercase)
+        tau = Perm.random(string.ascii_uppercase)
+        for length in 0, 1, 2, 7, 8, 9, 100, 1001:
+            text = "".join(random.choices(string.ascii_uppercase + "É",
+                                          k=length))
+            self.assertEqual(
+                    "".join(parallel_encipher.func(text, sigma, tau, 2, 8)),
+                    "".join(autoperm_encipher.func(text, sigma, tau)))
+        self.assertRaises(ValueError, list,
+                          parallel_encipher.func(text, sigma, tau, 2, 7))
+
+    def test_preserve(self):
+        sigma = Perm.random(string.ascii_uppercase)
+        tau = Perm.random(string.ascii_uppercase)
+        text = "Never gonna give you up, never gonna let you down!\n" * 50
+        expected = io.StringIO()
+        out_file = io.StringIO()
+        autoperm_encipher.preserve(io.StringIO(text), expected, sigma, tau)
+        parallel_encipher.preserve(io.StringIO(text), out_file, sigma, tau,
+                                   processes=2, segment_size=64)
+        self.assertEqual(out_file.getvalue(), expected.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,8 +6,25 @@ Unit tests for quadgram_metric.py
 
 import unittest
 
+import random
+import string
+import tempfile
+
+from unittest import mock
+
+from pathlib import Path
+
+from autoperm import quadgram_metric
 from autoperm.quadgram_metric import (
-        rolling_slice, get_quadgram_score, letters_to_integers, quadgram_score)
+        rolling_slice, get_quadgram_score, letters_to_integers,
+        letters_to_array, batch_quadgram_score, python_quadgram_score,
+        numpy_quadgram_score,
+        quadgram_score, quadgram_histogram, BOUND_EXCEEDED,
+        IncrementalQuadgramScorer,
+        NumpyIncrementalQuadgramScorer, incremental_quadgram_scorer)
+from autoperm.quadgram_table import convert_text_table
+from autoperm.perm import Perm
+from autoperm.substitution import substitution
 
 
 class TestQuadgramMetric(unittest.TestCase):
@@ -55,3 +72,165 @@ class TestQuadgramMetric(unittest.TestCase):
         self.assertAlmostEqual(quadgram_score("AAAA"), 6.4268008571)
         self.assertAlmostEqual(quadgram_score("AAAAB"),
                                6.4268008571 + 7.02886084843)
+
+    def test_no_numpy(self):
+        with mock.patch.object(quadgram_metric, "numpy", None):
+            self.assertIsNone(letters_to_array("ABCD"))
+            self.assertEqual(quadgram_score(""), 0)
+            self.assertAlmostEqual(quadgram_score("AAAAB"),
+                                   6.4268008571 + 7.02886084843)
+
+    def test_load_quadgrams(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # whatever gets loaded here mustn't stick around for the other tests,
+        # so load the real table again afterwards (cleanups run last first).
+        # Leaving the cache empty would be no good either, as then
+        # test_no_numpy would cache a table without an array.
+        self.addCleanup(quadgram_metric.load_quadgrams)
+        self.addCleanup(quadgram_metric.load_quadgrams.cache_clear)
+        binary_path = Path(directory.name) / "quadgrams.bin"
+
+        def load():
+            quadgram_metric.load_quadgrams.cache_clear()
+            with mock.patch.object(quadgram_metric, "QUADGRAMS_BINARY_PATH",
+                                   binary_path):
+                return quadgram_metric.load_quadgrams()[0]
+
+        expected = load()
+        with quadgram_metric.QUADGRAMS_PATH.open("r") as text_file, \
+                binary_path.open("wb") as binary_file:
+            convert_text_table(text_file, binary_file)
+        frequencies = load()
+        self.assertIsInstance(frequencies, memoryview)
+        self.assertEqual(list(frequencies), expected)
+        # a truncated binary table falls back to the text one
+        with binary_path.open("r+b") as binary_file:
+            binary_file.truncate(1000)
+        self.assertEqual(load(), expected)
+
+    @unittest.skipIf(quadgram_metric.numpy is None, "NumPy not installed")
+    def test_letters_to_array(self):
+        self.assertEqual(list(letters_to_array("")), [])
+        self.assertEqual(list(letters_to_array("AZ")), [0, 25])
+        self.assertIsNone(letters_to_array("AaZ"))
+        self.assertIsNone(letters_to_array("A@Z"))
+        self.assertIsNone(letters_to_array("AÉZ"))
+
+    @unittest.skipIf(quadgram_metric.numpy is None, "NumPy not installed")
+    def test_numpy_quadgram_score(self):
+        for length in range(8):
+            text = "".join(random.choices(string.ascii_uppercase, k=length))
+            self.assertAlmostEqual(numpy_quadgram_score(text),
+                                   python_quadgram_score(text))
+        for _ in range(20):
+            text = "".join(random.choices(string.ascii_uppercase,
+                                          k=random.randrange(2000)))
+            self.assertAlmostEqual(numpy_quadgram_score(iter(text)),
+                                   python_quadgram_score(text))
+        # weird characters take the slow path
+        self.assertAlmostEqual(numpy_quadgram_score("AAAAÉ"),
+                               python_quadgram_score("AAAAÉ"))
+
+    def test_quadgram_histogram(self):
+        self.assertEqual(quadgram_histogram("ABC"), ([], []))
+        self.assertEqual(quadgram_histogram("ABCD"), ([(0, 1, 2, 3)], [1]))
+        self.assertEqual(
+                dict(zip(*quadgram_histogram("ABCDABCDA"))),
+                {(0, 1, 2, 3): 2, (1, 2, 3, 0): 2, (2, 3, 0, 1): 1,
+                 (3, 0, 1, 2): 1})
+
+    def check_incremental_quadgram_scorer(self, scorer_type):
+        text = "".join(random.choices(string.ascii_uppercase, k=500))
+        key = Perm.random(string.ascii_uppercase)
+        scorer = scorer_type(text, key)
+        self.assertAlmostEqual(
+                scorer.score,
+                python_quadgram_score(substitution.func(text, key)))
+        for _ in range(50):
+            a, b = random.sample(string.ascii_uppercase, k=2)
+            new_key = key * Perm.from_cycle([a, b])
+            score = scorer.propose_swap(ord(a) - 0x41, ord(b) - 0x41)
+            self.assertAlmostEqual(
+                    score,
+                    python_quadgram_score(substitution.func(text, new_key)))
+            if random.random() < 0.5:
+                scorer.commit()
+                key = new_key
+            else:
+                scorer.rollback()
+            self.assertAlmostEqual(
+                    scorer.score,
+                    python_quadgram_score(substitution.func(text, key)))
+        swaps = [tuple(random.sample(range(26), k=2)) for _ in range(20)]
+        for (a, b), score in zip(swaps, scorer.score_swaps(swaps)):
+            self.assertAlmostEqual(
+                    score,
+                    python_quadgram_score(substitution.func(
+                        text, key * Perm.from_cycle([chr(a + 0x41),
+                                                     chr(b + 0x41)]))))
+        self.assertIsNone(scorer.pending)
+        for _ in range(5):
+            key = Perm.random(string.ascii_uppercase)
+            self.assertAlmostEqual(
+                    scorer.score_key(key),
+                    python_quadgram_score(substitution.func(text, key)))
+        # too short to have any quadgrams
+        self.assertEqual(scorer_type("ABC", key).propose_swap(0, 1), 0)
+        self.assertEqual(scorer_type("", key).score_key(key), 0)
+
+    def test_incremental_quadgram_scorer(self):
+        self.check_incremental_quadgram_scorer(IncrementalQuadgramScorer)
+        with mock.patch.object(quadgram_metric, "numpy", None):
+            self.assertIs(type(incremental_quadgram_scorer("ABCDE", Perm())),
+                          IncrementalQuadgramScorer)
+
+    @unittest.skipIf(quadgram_metric.numpy is None, "NumPy not installed")
+    def test_numpy_incremental_quadgram_scorer(self):
+        self.check_incremental_quadgram_scorer(NumpyIncrementalQuadgramScorer)
+        self.assertIsInstance(incremental_quadgram_scorer("ABCDE", Perm()),
+                              NumpyIncrementalQuadgramScorer)
+
+    @unittest.skipIf(quadgram_metric.numpy is None, "NumPy not installed")
+    def test_batch_quadgram_score(self):
+        texts = ["".join(random.choices(string.ascii_uppercase, k=300))
+                 for _ in range(10)]
+        letters = quadgram_metric.numpy.array(
+                [letters_to_array(text) for text in texts])
+        # make sure batching works
+        for batch_size in 1, 1000, 2 ** 21:
+            for score, text in zip(batch_quadgram_score(letters, batch_size),
+                                   texts):
+                self.assertAlmostEqual(score, python_quadgram_score(text))
+        self.assertEqual(
+                list(batch_quadgram_score(letters[:, :3])), [0] * 10)
+
+    def check_bounded_score(self, score_function):
+        for length in 0, 3, 4, 10, 1000:
+            text = "".join(random.choices(string.ascii_uppercase, k=length))
+            score = python_quadgram_score(text)
+            # under the bound, we should get the real score (with a bit of
+            # slack, as chunking changes the order the floats get added in)
+            self.assertAlmostEqual(score_function(text, score + 1e-6), score)
+            self.assertAlmostEqual(score_function(iter(text), score + 1), score)
+            if score:
+                self.assertEqual(score_function(text, score / 2),
+                                 BOUND_EXCEEDED)
+                self.assertEqual(score_function(iter(text), 0), BOUND_EXCEEDED)
+
+    def test_bounded_quadgram_score(self):
+        with mock.patch.object(quadgram_metric, "numpy", None):
+            self.check_bounded_score(quadgram_score.no_strip)
+        self.check_bounded_score(python_quadgram_score)
+
+    @unittest.skipIf(quadgram_metric.numpy is None, "NumPy not installed")
+    def test_bounded_numpy_quadgram_score(self):
+        self.check_bounded_score(quadgram_score.no_strip)
+        # small chunks, so that lots of quadgrams straddle chunk boundaries
+        for chunk_size in 1, 2, 3, 5:
+            self.check_bounded_score(lambda text, bound: numpy_quadgram_score(
+                    text, bound, chunk_size))
+        # falling back to the slow way part of the way through
+        text = "ABCDEFGHIJ" * 10 + "ABCDÉ"
+        self.assertAlmostEqual(numpy_quadgram_score(text, 1e9, 7),
+                               python_quadgram_score(text))
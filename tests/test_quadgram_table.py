@@ -0,0 +1,82 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Unit tests for quadgram_table.py
+"""
+
+import unittest
+
+import io
+import os
+import random
+import tempfile
+
+from autoperm.quadgram_table import (
+        TableFormatError, write_table, convert_text_table, load_table, numpy)
+
+
+class TestQuadgramTable(unittest.TestCase):
+    def setUp(self):
+        # a little 3-gram table over a 3 letter alphabet
+        self.frequencies = [random.random() * 10 for _ in range(27)]
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, **kwargs):
+        with open(self.path, "wb") as table_file:
+            write_table(self.frequencies, table_file, n=3, alphabet="ABC",
+                        **kwargs)
+
+    def test_round_trip(self):
+        self.write()
+        table, array = load_table(self.path, n=3, alphabet="ABC")
+        self.assertEqual(list(table), self.frequencies)
+        self.assertEqual(table[5], self.frequencies[5])
+        if numpy is not None:
+            self.assertEqual(list(array), self.frequencies)
+
+    def test_float32(self):
+        self.write(typecode=b"f")
+        table, array = load_table(self.path, n=3, alphabet="ABC")
+        for a, b in zip(table, self.frequencies):
+            self.assertAlmostEqual(a, b, places=5)
+        if numpy is not None:
+            for a, b in zip(array, self.frequencies):
+                self.assertAlmostEqual(a, b, places=5)
+
+    def test_convert_text_table(self):
+        text = io.StringIO("".join("{!r}\n".format(f)
+                                   for f in self.frequencies))
+        with open(self.path, "wb") as table_file:
+            convert_text_table(text, table_file, n=3, alphabet="ABC")
+        table, _ = load_table(self.path, n=3, alphabet="ABC")
+        self.assertEqual(list(table), self.frequencies)
+
+    def test_bad_tables(self):
+        with self.assertRaises(ValueError):
+            self.write(typecode=b"q")
+        with self.assertRaises(ValueError):
+            with open(self.path, "wb") as table_file:
+                write_table([1.0], table_file, n=3, alphabet="ABC")
+        with open(self.path, "wb"):
+            pass
+        self.assertRaises(TableFormatError, load_table, self.path)
+        with open(self.path, "wb") as table_file:
+            table_file.write(b"rubbish, not a table")
+        self.assertRaises(TableFormatError, load_table, self.path)
+        self.write()
+        # wrong n or alphabet
+        self.assertRaises(TableFormatError, load_table, self.path)
+        self.assertRaises(TableFormatError, load_table, self.path, n=3)
+        # truncated
+        with open(self.path, "r+b") as table_file:
+            table_file.truncate(os.path.getsize(self.path) - 1)
+        self.assertRaises(TableFormatError, load_table, self.path,
+                          n=3, alphabet="ABC")
+
+
+if __name__ == "__main__":
+    unittest.main()
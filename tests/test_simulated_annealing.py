@@ -0,0 +1,65 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Unit tests for simulated_annealing.py
+"""
+
+import unittest
+
+import io
+import contextlib
+
+from autoperm.simulated_annealing import (
+        exponential_schedule, linear_schedule, SimulatedAnnealer)
+from autoperm.hill_climbing import SubstitutionHillClimber, Swap
+from autoperm.autoperm_hill_climbing import AutopermHillClimber
+from autoperm.metric import BEE_MOVIE
+from autoperm.util import strip_punc, permutation_from_key
+from autoperm.substitution import substitution
+from autoperm.autoperm import autoperm_encipher
+
+
+class TestSimulatedAnnealing(unittest.TestCase):
+    def setUp(self):
+        self.plaintext = "".join(strip_punc(BEE_MOVIE[:3000]))
+
+    def test_schedules(self):
+        for schedule in exponential_schedule(10, 0.1), linear_schedule(10, 0.1):
+            self.assertAlmostEqual(schedule(0, 100), 10)
+            self.assertAlmostEqual(schedule(100, 100), 0.1)
+            temperatures = [schedule(step, 100) for step in range(100)]
+            self.assertEqual(temperatures, sorted(temperatures, reverse=True))
+        self.assertAlmostEqual(exponential_schedule(10, 0.1)(50, 100), 1)
+        self.assertAlmostEqual(linear_schedule(10, 0.1)(50, 100), 5.05)
+
+    def anneal(self, hill_climber, **kwargs):
+        with contextlib.redirect_stderr(io.StringIO()):
+            return SimulatedAnnealer(hill_climber, **kwargs).anneal()
+
+    def test_substitution(self):
+        key = permutation_from_key("linustorvalds")
+        ciphertext = "".join(substitution.func(self.plaintext, key))
+        hill_climber = SubstitutionHillClimber(ciphertext)
+        start_score = hill_climber.best_score
+        self.assertIsInstance(hill_climber.random_neighbour(), Swap)
+        score, state = self.anneal(hill_climber, steps=2000)
+        self.assertLessEqual(score, start_score)
+        self.assertEqual(hill_climber.get_state(), state)
+        self.assertEqual(hill_climber.best_score, score)
+        self.assertAlmostEqual(score, hill_climber.get_score(state))
+        self.assertEqual(hill_climber.total_keys_tried, 2000)
+
+    def test_autoperm(self):
+        ciphertext = "".join(autoperm_encipher.func(
+                self.plaintext[:500], permutation_from_key("richardstallman"),
+                permutation_from_key("linustorvalds")))
+        hill_climber = AutopermHillClimber(ciphertext)
+        start_score = hill_climber.best_score
+        score, state = self.anneal(hill_climber, steps=200,
+                                   schedule=linear_schedule(50, 0))
+        self.assertLessEqual(score, start_score)
+        self.assertAlmostEqual(score, hill_climber.get_score(state))
+
+
+if __name__ == "__main__":
+    unittest.main()
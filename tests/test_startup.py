@@ -0,0 +1,108 @@
+# vim: ts=4 sw=0 sts=-1 et ai tw=80
+
+"""
+Tests that things which don't need the reference data (the bee movie, the
+quadgram table, the transpositions used for hill climbing) don't load it.
+
+These run in a fresh interpreter, as the test runner will probably have
+imported everything already.
+"""
+
+import unittest
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+
+from pathlib import Path
+
+REPO_DIR = Path(__file__).parent / ".."
+SOURCE_DIR = REPO_DIR / "autoperm"
+
+# Records every file opened while running the CLI to encrypt something, and
+# whether MOD_PERMUTATIONS got built along the way
+ENCRYPT_SCRIPT = """
+import sys
+import json
+import runpy
+
+opened = []
+sys.addaudithook(
+        lambda event, args: opened.append(str(args[0]))
+                            if event == "open" else None)
+
+import hill_climbing
+import autoperm_hill_climbing
+
+sys.argv = ["autoperm", "-e", "-k", "richardstallman", "linustorvalds",
+            *sys.argv[1:]]
+runpy.run_module("autoperm", run_name="__main__")
+print(json.dumps({
+        "opened": opened,
+        "mod_permutations": hill_climbing.mod_permutations.cache_info()[3]}))
+"""
+
+# Lists every module imported while running the CLI to encrypt something
+MODULES_SCRIPT = """
+import sys
+import json
+import runpy
+
+sys.argv = ["autoperm", "-e", "-k", "richardstallman", "linustorvalds",
+            *sys.argv[1:]]
+runpy.run_module("autoperm", run_name="__main__")
+print(json.dumps(sorted(sys.modules)))
+"""
+
+# Modules only needed by the CLI's other modes, which shouldn't be imported
+# just to encrypt something
+MODE_MODULES = ("checkpoint_index", "cipher_state", "container",
+                "parallel_encipher", "concurrent.futures", "multiprocessing")
+
+
+class TestStartup(unittest.TestCase):
+    def run_script(self, script, *args):
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+                filter(None, (str(SOURCE_DIR), str(REPO_DIR),
+                              env.get("PYTHONPATH"))))
+        result = subprocess.run([sys.executable, "-c", script, *args], env=env,
+                                cwd=str(REPO_DIR), stdout=subprocess.PIPE,
+                                check=True)
+        return json.loads(result.stdout.decode())
+
+    def encrypt(self, script):
+        """
+        Run a script which runs the CLI to encrypt a file, returning what it
+        printed (as JSON)
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            in_path = os.path.join(directory, "in.txt")
+            out_path = os.path.join(directory, "out.txt")
+            with open(in_path, "w") as in_file:
+                in_file.write("Never gonna give you up")
+            result = self.run_script(script, in_path, out_path)
+            with open(out_path, "r") as out_file:
+                self.assertEqual(out_file.read(), "QSEG XOUS ULXV QXJS BWV\n")
+        return result
+
+    def test_encrypt_loads_nothing(self):
+        result = self.encrypt(ENCRYPT_SCRIPT)
+        for name in "beemovie.txt", "quadgrams.dat", "quadgrams.bin":
+            self.assertFalse(
+                    any(path.endswith(name) for path in result["opened"]),
+                    "{} was opened".format(name))
+        self.assertEqual(result["mod_permutations"], 0)
+
+    def test_encrypt_imports_nothing_extra(self):
+        modules = self.encrypt(MODULES_SCRIPT)
+        for name in MODE_MODULES:
+            self.assertNotIn(name, modules)
+        # NumPy is only for hill climbing, and is slow to import
+        self.assertNotIn("numpy", modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
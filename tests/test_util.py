@@ -11,7 +11,9 @@ import string
 import random
 
 from autoperm.perm import Perm
-from autoperm.util import file_chars, strip_punc, permutation_from_key
+from autoperm.util import (
+        file_chunks, file_chars, strip_punc, strip_chunks, permutation_from_key,
+        byte_permutation_from_key)
 
 
 class TestUtil(unittest.TestCase):
@@ -27,10 +29,33 @@ class TestUtil(unittest.TestCase):
         for input_text, _ in self.strings:
             self.assertEqual("".join(file_chars(io.StringIO(input_text))),
                              input_text)
+            for chunk_size in 1, 2, 3:
+                self.assertEqual(
+                        "".join(file_chars(io.StringIO(input_text),
+                                           chunk_size)),
+                        input_text)
+        self.assertEqual(list(file_chunks(io.StringIO("ABCDE"), 2)),
+                         ["AB", "CD", "E"])
+        self.assertEqual(list(file_chunks(io.BytesIO(b"ABC"), 2)),
+                         [b"AB", b"C"])
 
     def test_strip_punc(self):
         for input_text, result in self.strings:
             self.assertEqual("".join(strip_punc(input_text)), result)
+            self.assertEqual("".join(strip_punc(iter(input_text))), result)
+
+    def test_strip_chunks(self):
+        for input_text, result in self.strings:
+            self.assertEqual("".join(strip_chunks(input_text)), result)
+            self.assertEqual("".join(strip_chunks([input_text[:2],
+                                                   input_text[2:]])),
+                             result)
+        # every ASCII character, and some that aren't (note that \u00df becomes
+        # a single "SS")
+        for text in "".join(map(chr, range(128))), "ÉéaB\u00dfz!":
+            self.assertEqual(
+                    list(strip_chunks([text, text])),
+                    2 * list(map(str.upper, filter(str.isalpha, text))))
 
     def test_permutation_from_key(self):
         self.assertEqual(Perm(), permutation_from_key(""))
@@ -61,6 +86,15 @@ class TestUtil(unittest.TestCase):
                                          k=random.randrange(30)))
             self.assertTrue(permutation_from_key(key).is_permutation())
 
+    def test_byte_permutation_from_key(self):
+        self.assertEqual(Perm(), byte_permutation_from_key(""))
+        self.assertEqual(Perm(), byte_permutation_from_key("\x00"))
+        # works just like permutation_from_key, but over bytes
+        perm = byte_permutation_from_key("é!")
+        self.assertEqual([perm[i] for i in range(4)], [0xc3, 0xa9, 0x21, 0x22])
+        self.assertTrue(perm.is_permutation())
+        self.assertEqual(sorted(perm[i] for i in range(256)), list(range(256)))
+
 
 if __name__ == "__main__":
     unittest.main()